@@ -0,0 +1,211 @@
+"""Per-client rate limits and load shedding.
+
+Logins and registrations, trades, and market reads each draw on their own
+token bucket, set by ``RATE_LIMIT_AUTH``, ``RATE_LIMIT_TRADE`` and
+``RATE_LIMIT_MARKET`` as ``<requests>/<seconds>``: a bucket holds
+``requests`` tokens and refills at that pace. Requests with a valid token
+are counted per user, the rest per client address. ``RATE_LIMIT_IP_HEADER``
+takes the address from a header set by a trusted proxy, such as nginx's
+``X-Real-IP``. An empty bucket answers ``429`` with ``Retry-After``.
+Buckets live in ``RATE_LIMIT_URL`` (``CACHE_URL`` by default): in this
+process, or in Redis so that every worker and node shares them. If Redis is
+unreachable, requests are let through.
+
+Load shedding keeps requests from piling up behind the database pool. Every
+connection checkout is timed. While the recent average wait is above
+``LOAD_SHED_POOL_WAIT`` seconds, a worker only starts a request when fewer
+than ``LOAD_SHED_MIN_CONCURRENCY`` are in flight and answers the rest
+``503`` with ``Retry-After``. ``MAX_CONCURRENT_REQUESTS`` caps requests in
+flight per worker at all times. Streams and ``/metrics`` are exempt.
+"""
+from flask import g, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.pool import QueuePool
+from shared_cache import CACHE_PREFIX, backend_from_url
+from metrics import DB_POOL_WAIT, RATE_LIMITED, SHED_REQUESTS
+from collections import namedtuple
+from functools import wraps
+import threading
+import math
+import time
+import os
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_URL = os.environ.get('RATE_LIMIT_URL', os.environ.get('CACHE_URL', ''))
+RATE_LIMIT_IP_HEADER = os.environ.get('RATE_LIMIT_IP_HEADER', '')
+SHED_RETRY_AFTER = 1
+# Weight of the newest checkout in the average wait, and how long an average
+# without new checkouts is still believed.
+POOL_WAIT_SMOOTHING = 0.2
+POOL_WAIT_HORIZON = 5.0
+EXEMPT_ENDPOINTS = {'api.stream', 'metrics'}
+
+Limit = namedtuple('Limit', ['name', 'capacity', 'rate'])
+
+
+def parse_limit(name, spec):
+    """``'30/10'`` -> 30 tokens refilled over 10 seconds; ``'0'`` turns the limit off."""
+    requests, _, seconds = spec.partition('/')
+    capacity = int(requests)
+    return Limit(name, capacity, capacity / float(seconds or 1))
+
+
+LIMITS = {name: parse_limit(name, os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+          for name, default in (('auth', '10/60'), ('trade', '30/10'), ('market', '60/10'))}
+
+
+def refuse(status, message, retry_after):
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, status
+
+
+def client_key():
+    """``user:<id>`` for requests with a verified token, ``ip:<address>`` otherwise."""
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:  # the view is not behind @jwt_required()
+        identity = None
+    if identity is not None:
+        return f'user:{identity}'
+    address = request.headers.get(RATE_LIMIT_IP_HEADER) if RATE_LIMIT_IP_HEADER else None
+    # Proxies append to X-Forwarded-For; only the last entry was not written by the client.
+    return f'ip:{address.rsplit(",", 1)[-1].strip() if address else request.remote_addr}'
+
+
+class RateLimiter:
+    def __init__(self, backend=None, limits=None, enabled=None):
+        self.backend = backend if backend is not None else backend_from_url(RATE_LIMIT_URL)
+        self.limits = limits if limits is not None else LIMITS
+        self.enabled = enabled if enabled is not None else RATE_LIMIT_ENABLED
+        self.prefix = CACHE_PREFIX + 'rl:'
+        self.rejected = dict.fromkeys(self.limits, 0)
+        self.errors = 0
+
+    def check(self, name, client):
+        """0 if ``client`` may go ahead under limit ``name``, else seconds until it may."""
+        limit = self.limits[name]
+        if not self.enabled or not limit.capacity:
+            return 0
+        try:
+            wait = self.backend.take(f'{self.prefix}{name}:{client}', limit.rate, limit.capacity)
+        except self.backend.errors:
+            self.errors += 1
+            return 0
+        if wait:
+            self.rejected[name] += 1
+            RATE_LIMITED.labels(name).inc()
+        return wait
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'backend': type(self.backend).__name__,
+            'limits': {limit.name: f'{limit.capacity}/{limit.capacity / limit.rate:g}' if limit.capacity else 'off'
+                       for limit in self.limits.values()},
+            'rejected': dict(self.rejected),
+            'errors': self.errors
+        }
+
+
+def rate_limited(name):
+    """Refuse the view with 429 once the caller has used up limit ``name``.
+
+    Goes below ``@jwt_required()`` so signed-in callers are counted by user.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            wait = rate_limiter.check(name, client_key())
+            if wait:
+                return refuse(429, 'Too many requests, slow down', wait)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class LoadShedder:
+    """Counts requests in flight per worker and turns new ones away while the pool is congested."""
+
+    def __init__(self, max_concurrent=None, min_concurrency=None, pool_wait=None):
+        self.max_concurrent = max_concurrent if max_concurrent is not None else int(os.environ.get('MAX_CONCURRENT_REQUESTS', '0'))
+        self.min_concurrency = min_concurrency if min_concurrency is not None else int(os.environ.get('LOAD_SHED_MIN_CONCURRENCY', '1'))
+        self.pool_wait_threshold = pool_wait if pool_wait is not None else float(os.environ.get('LOAD_SHED_POOL_WAIT', '0.25'))
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.pool_wait = 0.0
+        self._sampled_at = None
+        self.shed = {'concurrency': 0, 'pool_wait': 0}
+
+    def observe_pool_wait(self, seconds):
+        DB_POOL_WAIT.observe(seconds)
+        with self._lock:
+            self.pool_wait += (seconds - self.pool_wait) * POOL_WAIT_SMOOTHING
+            self._sampled_at = time.monotonic()
+
+    def congested(self):
+        return (self.pool_wait > self.pool_wait_threshold and self._sampled_at is not None
+                and time.monotonic() - self._sampled_at < POOL_WAIT_HORIZON)
+
+    def enter(self):
+        """Count a new request in; the reason it is shed instead, or ``None``."""
+        with self._lock:
+            if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                reason = 'concurrency'
+            elif self.in_flight >= self.min_concurrency and self.congested():
+                # The few requests still admitted keep sampling the pool, so shedding stops once it drains.
+                reason = 'pool_wait'
+            else:
+                self.in_flight += 1
+                return None
+            self.shed[reason] += 1
+        SHED_REQUESTS.labels(reason).inc()
+        return reason
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'max_concurrent': self.max_concurrent,
+                'pool_wait': round(self.pool_wait, 6),
+                'pool_wait_threshold': self.pool_wait_threshold,
+                'congested': self.congested(),
+                'shed': dict(self.shed)
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """``QueuePool`` that reports how long each checkout waited to the load shedder."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            load_shedder.observe_pool_wait(time.perf_counter() - started)
+
+
+rate_limiter = RateLimiter()
+load_shedder = LoadShedder()
+
+
+def _admit():
+    if request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if load_shedder.enter() is not None:
+        return refuse(503, 'Server is busy, try again shortly', SHED_RETRY_AFTER)
+    g.admitted = True
+
+
+def _release(exc):
+    if g.pop('admitted', False):
+        load_shedder.leave()
+
+
+def init_admission(app):
+    app.before_request(_admit)
+    app.teardown_request(_release)
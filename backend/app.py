@@ -1,27 +1,191 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from database import db, init_db
-from models import User, Cryptocurrency, Holdings, Transaction, Order
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, current_user
+from database import db, init_db, upgrade_db, replica_reads, write_tracker
+from models import User, Cryptocurrency, Transaction, Order
+from auth import HashingBusy, identity_cache, password_hasher, stream_tickets, init_auth
+from admission import TimedQueuePool, init_admission, load_shedder, rate_limited, rate_limiter, refuse
+from price_cache import price_cache
+from upstream import coingecko, UpstreamHTTPError
+from price_history import INTERVALS, candles_for, record_trade, trade_ticks
+from market_data import MAX_PER_PAGE, market_snapshot, ingest_markets, load_snapshot, market_ingestor
+from portfolio import MAX_LEADERBOARD, user_portfolio, portfolio_valuator
+from shared_cache import NOT_FOUND, response_cache
+from history import EXPORT_FORMATS, transaction_query, transaction_dict, export_rows, export_chunks
+from pagination import InvalidCursor, page_size, paginate_desc
+from trading import (
+    TradeError, InsufficientFunds, InsufficientHoldings, OrderUnavailable, run_in_transaction, lock_users, lock_holdings, lock_account,
+    debit_usd, credit_usd, add_holding, remove_holding, fill_order, reservation, reserve_order, shift_locked,
+    deactivate_order, deactivate_orders
+)
+from stream import broker, format_event, TooManySubscribers
+from metrics import init_metrics, add_time
+from order_book import matching_engine, BookOrder, FILLED, MAKER_REJECTED
+from triggers import LIMIT, ORDER_KINDS, is_crossed, trigger_engine
+import journal
+import money
+import serialization
 import requests
-from datetime import datetime, timedelta
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
 import os
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql://postgres:postgres@db:5432/crypto_exchange')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'super-secret-key-change-in-production')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+api = Blueprint('api', __name__)
+jwt = JWTManager()
 
-CORS(app, resources={r"/api/*": {"origins": "*", "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"]}})
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', '15'))
+STREAM_BATCH_INTERVAL = float(os.environ.get('STREAM_BATCH_INTERVAL', '0.25'))
+ORDER_BATCH_MAX = int(os.environ.get('ORDER_BATCH_MAX', '500'))
+MARKETS_CACHE_TTL = float(os.environ.get('MARKETS_CACHE_TTL', '10'))
+COIN_CACHE_TTL = float(os.environ.get('COIN_CACHE_TTL', '30'))
+COIN_NEGATIVE_TTL = float(os.environ.get('COIN_NEGATIVE_TTL', '300'))
+PORTFOLIO_CACHE_TTL = float(os.environ.get('PORTFOLIO_CACHE_TTL', '5'))
+CACHE_STALE_TTL = float(os.environ.get('CACHE_STALE_TTL', '60'))
+PRICE_RETRY_AFTER = 5
 
-COMMISSION_RATE = 0.015
 
-jwt = JWTManager(app)
-init_db(app)
+def engine_options(database_uri):
+    if database_uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': True,
+        'poolclass': TimedQueuePool
+    }
 
 
-@app.route('/api/register', methods=['POST'])
+class MoneyJSONProvider(DefaultJSONProvider):
+    """Encode with ``serialization.dumps`` (orjson when installed); ledger ``Decimal`` values become JSON numbers."""
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return serialization.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+    def _encode(self, obj):
+        started = time.perf_counter()
+        try:
+            return serialization.dumps(obj, sort_keys=self.sort_keys,
+                                       indent=self.compact is False or (self.compact is None and self._app.debug))
+        finally:
+            add_time('json', time.perf_counter() - started)
+
+
+def invalidate_markets(prices):
+    """Cached market pages carry prices; drop them whenever prices change."""
+    response_cache.invalidate('markets')
+
+
+price_cache.add_listener(invalidate_markets)
+
+
+def create_app(config=None, start_services=True):
+    """Build the Flask application.
+
+    Schema migrations are not run here; see ``database.upgrade_db`` (run once by
+    the gunicorn master or ``flask init-db``). With ``start_services`` the
+    order books are loaded and the background price refresher is started;
+    CLI and migration runs pass ``start_services=False``.
+    """
+    app = Flask(__name__)
+    app.json = MoneyJSONProvider(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql://postgres:postgres@db:5432/crypto_exchange')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'super-secret-key-change-in-production')
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    CORS(app, resources={r"/api/*": {"origins": "*", "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"], "expose_headers": ["X-Next-Cursor"]}})
+
+    jwt.init_app(app)
+    init_auth(jwt)
+    init_db(app)
+    init_metrics(app)
+    init_admission(app)
+    serialization.init_serialization(app)
+    app.register_blueprint(api)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Apply pending schema migrations."""
+        upgrade_db()
+
+    @app.cli.command('journal-snapshot')
+    def journal_snapshot_command():
+        """Fold the journal into a new snapshot."""
+        state = journal.take_snapshot()
+        print(f'snapshot at sequence {state.seq}' if state else 'no new events')
+
+    @app.cli.command('journal-audit')
+    def journal_audit_command():
+        """Replay the journal from the newest snapshot and compare it with the tables."""
+        started = time.perf_counter()
+        problems = journal.audit()
+        for problem in problems:
+            print(problem)
+        print(f'{len(problems)} differences, replayed in {time.perf_counter() - started:.2f}s')
+        if problems:
+            raise SystemExit(1)
+
+    if start_services:
+        start_background_services(app)
+
+    return app
+
+
+def start_background_services(app):
+    with app.app_context():
+        try:
+            loaded = load_snapshot()
+        except (OSError, ValueError):
+            app.logger.exception('Market snapshot could not be loaded')
+        else:
+            if loaded:
+                app.logger.info('Loaded %d coins from the market snapshot', loaded)
+        matching_engine.rebuild(Order.query.filter_by(is_active=True, kind=LIMIT).order_by(Order.timestamp, Order.id))
+        trigger_engine.rebuild(db.session.query(
+            Order.id, Cryptocurrency.coingecko_id, Order.order_type, Order.kind, Order.trigger_price
+        ).join(Cryptocurrency, Cryptocurrency.id == Order.crypto_id).filter(
+            Order.is_active.is_(True), Order.kind != LIMIT
+        ))
+    price_cache.add_listener(trigger_engine.on_prices)
+    trigger_engine.start(app, execute_trigger)
+    price_cache.start(app)
+    market_ingestor.start(app)
+    trade_ticks.start(app)
+    journal.snapshotter.start(app)
+
+
+def fetch_coin_quote(coingecko_id):
+    try:
+        coin_data = coingecko.get_json(f'/coins/{coingecko_id}')
+    except UpstreamHTTPError as exc:
+        if exc.status_code < 500 and exc.status_code != 429:
+            return None
+        raise
+    quote = {
+        'price': coin_data['market_data']['current_price']['usd'],
+        'symbol': coin_data['symbol'].upper(),
+        'name': coin_data['name']
+    }
+    price_cache.set(coingecko_id, quote['price'])
+    return quote
+
+
+@api.route('/api/register', methods=['POST'])
+@rate_limited('auth')
 def register():
     data = request.json
     username = data.get('username')
@@ -37,9 +201,14 @@ def register():
     if User.query.filter_by(email=email).first():
         return jsonify({'error': 'Email is already in use'}), 400
     
-    user = User(username=username, email=email)
-    user.set_password(password)
+    try:
+        password_hash = password_hasher.hash(password)
+    except HashingBusy:
+        return hashing_busy()
+    user = User(username=username, email=email, password_hash=password_hash)
     db.session.add(user)
+    db.session.flush()
+    journal.record('deposit', user.id, usd=user.balance_usd)
     db.session.commit()
     
     access_token = create_access_token(identity=str(user.id))
@@ -49,7 +218,8 @@ def register():
         'user': user.to_dict()
     }), 201
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
+@rate_limited('auth')
 def login():
     data = request.json
     username = data.get('username')
@@ -59,8 +229,15 @@ def login():
         return jsonify({'error': 'Enter username and password'}), 400
     
     user = User.query.filter_by(username=username).first()
-    if not user or not user.check_password(password):
-        return jsonify({'error': 'Invalid username or password'}), 401
+    try:
+        # Unknown users are not hashed for, so a burst of bad usernames costs nothing.
+        if not user or not password_hasher.verify(user.password_hash, password):
+            return jsonify({'error': 'Invalid username or password'}), 401
+        if password_hasher.needs_rehash(user.password_hash):
+            user.password_hash = password_hasher.hash(password)
+            db.session.commit()
+    except HashingBusy:
+        return hashing_busy()
     
     access_token = create_access_token(identity=str(user.id))
     return jsonify({
@@ -68,71 +245,88 @@ def login():
         'user': user.to_dict()
     }), 200
 
+def hashing_busy():
+    response = jsonify({'error': 'Too many logins in progress, try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
-@app.route('/api/gecko/markets', methods=['GET'])
+def price_unavailable():
+    """CoinGecko is unreachable and no price is recent enough to trade at (``PRICE_FALLBACK_MAX_AGE``)."""
+    return refuse(503, 'No recent price while CoinGecko is unreachable, try again shortly', PRICE_RETRY_AFTER)
+
+
+@api.route('/api/gecko/markets', methods=['GET'])
+@rate_limited('market')
 def gecko_markets_proxy():
-    try:
-        response = requests.get('https://api.coingecko.com/api/v3/coins/markets', params=request.args)
-        response.raise_for_status()
-        data = response.json()
-        
-        for coin_data in data:
-            coingecko_id = coin_data.get('id')
-            symbol = coin_data.get('symbol', '').upper()
-
-            if not coingecko_id or not symbol:
-                continue
+    """Markets list served from the stored snapshot kept fresh by the ingestion job.
 
-            crypto = Cryptocurrency.query.filter_by(coingecko_id=coingecko_id).first()
-            
-            if not crypto:
-                crypto = Cryptocurrency(coingecko_id=coingecko_id, symbol=symbol)
-                db.session.add(crypto)
-            
-            crypto.symbol = symbol
-            crypto.name = coin_data.get('name', '')
-            crypto.current_price = coin_data.get('current_price')
-            crypto.market_cap = coin_data.get('market_cap')
-            crypto.volume_24h = coin_data.get('total_volume')
-            crypto.price_change_24h = coin_data.get('price_change_percentage_24h')
-            crypto.last_updated = datetime.utcnow()
-        
-        db.session.commit()
-        return jsonify(data), 200
-        
-    except requests.exceptions.RequestException:
-        cryptos = Cryptocurrency.query.order_by(Cryptocurrency.market_cap.desc()).all()
-        
-        formatted_cryptos = []
-        for crypto in cryptos:
-            formatted_cryptos.append({
-                'id': crypto.coingecko_id,
-                'symbol': crypto.symbol,
-                'name': crypto.name,
-                'current_price': crypto.current_price,
-                'market_cap': crypto.market_cap,
-                'total_volume': crypto.volume_24h,
-                'price_change_percentage_24h': crypto.price_change_24h,
-                'market_cap_rank': None
-            })
-        return jsonify(formatted_cryptos), 200
+    CoinGecko is only called inline while the snapshot is still empty.
+    """
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 100, type=int), MAX_PER_PAGE))
+
+    def load():
+        with replica_reads():
+            data = market_snapshot(page, per_page)
+        if not data and page == 1:
+            try:
+                ingest_markets()
+            except requests.exceptions.RequestException:
+                return None
+            data = market_snapshot(page, per_page)
+        # An empty page is not cached, so a fresh install fills in as soon as ingestion runs.
+        return data or None
+
+    encoded = response_cache.get_encoded(f'markets:{page}:{per_page}', load, MARKETS_CACHE_TTL, CACHE_STALE_TTL,
+                                         group='markets')
+    return serialization.json_body(encoded or serialization.EMPTY_LIST)
 
 
-@app.route('/api/gecko/coins/<coin_id>', methods=['GET'])
+@api.route('/api/gecko/coins/<coin_id>', methods=['GET'])
+@rate_limited('market')
 def gecko_coin_detail_proxy(coin_id):
+    """CoinGecko's coin detail, cached; ids CoinGecko does not know are cached as misses too."""
     try:
-        response = requests.get(f'https://api.coingecko.com/api/v3/coins/{coin_id}')
-        response.raise_for_status()
-        data = response.json()
-        
-        symbol = data.get('symbol', '').upper()
-        if not symbol:
-            return jsonify(data), 200
+        data = response_cache.get_encoded(f'coin:{coin_id}', lambda: load_coin_detail(coin_id),
+                                          COIN_CACHE_TTL, CACHE_STALE_TTL, negative_ttl=COIN_NEGATIVE_TTL)
+    except requests.exceptions.RequestException:
+        data = NOT_FOUND
+    if data is not NOT_FOUND:
+        return serialization.json_body(data)
+
+    crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_id).first()
+    if crypto:
+        return jsonify({
+            'id': crypto.coingecko_id,
+            'symbol': crypto.symbol,
+            'name': crypto.name,
+            'image': {'large': ''},
+            'description': {'en': 'Could not load description from CoinGecko.'},
+            'market_data': {
+                'current_price': {'usd': crypto.current_price},
+                'price_change_percentage_24h': crypto.price_change_24h,
+                'market_cap': {'usd': crypto.market_cap},
+                'total_volume': {'usd': crypto.volume_24h}
+            }
+        }), 200
+    else:
+        return jsonify(error="Coin not found in cache"), 404
 
+def load_coin_detail(coin_id):
+    """Fetch a coin from CoinGecko and write its market data through to the database."""
+    try:
+        data = coingecko.get_json(f'/coins/{coin_id}')
+    except UpstreamHTTPError as exc:
+        if exc.status_code == 404:
+            return NOT_FOUND
+        raise
+
+    symbol = data.get('symbol', '').upper()
+    if symbol:
         crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_id).first()
         if not crypto:
-             crypto = Cryptocurrency(coingecko_id=coin_id, symbol=symbol)
-             db.session.add(crypto)
+            crypto = Cryptocurrency(coingecko_id=coin_id, symbol=symbol)
+            db.session.add(crypto)
 
         crypto.symbol = symbol
         crypto.name = data.get('name', '')
@@ -143,359 +337,1015 @@ def gecko_coin_detail_proxy(coin_id):
             crypto.price_change_24h = data['market_data'].get('price_change_percentage_24h')
         crypto.last_updated = datetime.utcnow()
         db.session.commit()
-        
-        return jsonify(data), 200
-        
-    except requests.exceptions.RequestException:
-        crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_id).first()
-        if crypto:
-            return jsonify({
-                'id': crypto.coingecko_id,
-                'symbol': crypto.symbol,
-                'name': crypto.name,
-                'image': {'large': ''},
-                'description': {'en': 'Could not load description from CoinGecko.'},
-                'market_data': {
-                    'current_price': {'usd': crypto.current_price},
-                    'price_change_percentage_24h': crypto.price_change_24h,
-                    'market_cap': {'usd': crypto.market_cap},
-                    'total_volume': {'usd': crypto.volume_24h}
-                }
-            }), 200
-        else:
-            return jsonify(error="Coin not found in cache"), 404
+        price_cache.set(coin_id, crypto.current_price)
+    return data
 
-@app.route('/api/buy', methods=['POST'])
+@api.route('/api/buy', methods=['POST'])
 @jwt_required()
+@rate_limited('trade')
 def buy_crypto():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 401
-    
+    user = current_user
     data = request.json
     coingecko_id = data.get('coingecko_id')
-    amount = float(data.get('amount', 0))
+    try:
+        amount = money.parse(data.get('amount', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid amount'}), 400
     
     if amount <= 0:
         return jsonify({'error': 'Invalid amount'}), 400
 
-    try:
-        response = requests.get(f'https://api.coingecko.com/api/v3/coins/{coingecko_id}')
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to get cryptocurrency data'}), 404
-        coin_data = response.json()
-        current_price = coin_data['market_data']['current_price']['usd']
-        symbol = coin_data['symbol'].upper()
-        name = coin_data['name']
-    except Exception:
-        return jsonify({'error': 'Error when requesting from CoinGecko'}), 500
-
     crypto = Cryptocurrency.query.filter_by(coingecko_id=coingecko_id).first()
-    if not crypto:
-        crypto = Cryptocurrency(symbol=symbol, name=name, coingecko_id=coingecko_id)
-        db.session.add(crypto)
-    else:
-        crypto.name = name
-        crypto.symbol = symbol
-    
-    crypto.current_price = current_price
+    current_price = price_cache.get_price(crypto) if crypto else None
+
+    if current_price is None:
+        try:
+            quote = fetch_coin_quote(coingecko_id)
+        except requests.exceptions.RequestException:
+            current_price = price_cache.last_known(crypto) if crypto else None
+            if current_price is None:
+                return price_unavailable()
+        else:
+            if not quote:
+                return jsonify({'error': 'Failed to get cryptocurrency data'}), 404
+            current_price = quote['price']
+
+            if not crypto:
+                crypto = Cryptocurrency(symbol=quote['symbol'], name=quote['name'], coingecko_id=coingecko_id)
+                db.session.add(crypto)
+            else:
+                crypto.name = quote['name']
+                crypto.symbol = quote['symbol']
+            crypto.current_price = current_price
+            crypto.last_updated = datetime.utcnow()
+            db.session.commit()
     
-    base_cost = amount * current_price
-    fee = base_cost * COMMISSION_RATE
+    crypto_id = crypto.id
+    amount = money.quantity(amount, crypto.quantity_decimals or money.QUANTITY_DECIMALS)
+    current_price = money.price(current_price)
+    base_cost = money.notional(amount, current_price)
+    if base_cost <= 0:
+        return jsonify({'error': 'Amount is too small'}), 400
+    fee = money.commission(base_cost)
     total_cost = base_cost + fee
-    
-    if user.balance_usd < total_cost:
-        return jsonify({'error': 'Insufficient funds'}), 400
-    
-    user.balance_usd -= total_cost
-    
-    holding = Holdings.query.filter_by(user_id=user_id, crypto_id=crypto.id).first()
-    if not holding:
-        holding = Holdings(user_id=user_id, crypto_id=crypto.id, amount=0)
-        db.session.add(holding)
-    holding.amount += amount
-    
-    transaction = Transaction(
-        user_id=user_id,
-        crypto_id=crypto.id,
-        transaction_type='buy',
-        amount=amount,
-        price_at_transaction=crypto.current_price,
-        fee=fee,
-        total_cost=total_cost
-    )
-    db.session.add(transaction)
-    db.session.commit()
-    
+
+    try:
+        new_balance = run_in_transaction(
+            lambda: spot_buy(user.id, crypto_id, amount, current_price, fee, total_cost)
+        )
+    except TradeError as exc:
+        return jsonify({'error': exc.message}), exc.status
+
+    publish_fill(user.id, 'buy', coingecko_id, amount, current_price)
     return jsonify({
         'message': 'Purchase successful',
         'transaction': {
             'amount': amount,
-            'price': crypto.current_price,
+            'price': current_price,
             'fee': fee,
             'total_cost': total_cost,
-            'new_balance': user.balance_usd
+            'new_balance': new_balance
         }
     }), 200
 
-@app.route('/api/sell', methods=['POST'])
+@api.route('/api/sell', methods=['POST'])
 @jwt_required()
+@rate_limited('trade')
 def sell_crypto():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 401
-    
+    user = current_user
     data = request.json
     coingecko_id = data.get('coingecko_id')
-    amount = float(data.get('amount', 0))
+    try:
+        amount = money.parse(data.get('amount', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid amount'}), 400
 
     if amount <= 0:
         return jsonify({'error': 'Invalid amount'}), 400
 
-    try:
-        response = requests.get(f'https://api.coingecko.com/api/v3/coins/{coingecko_id}')
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to get cryptocurrency data'}), 404
-        coin_data = response.json()
-        current_price = coin_data['market_data']['current_price']['usd']
-        symbol = coin_data['symbol'].upper()
-    except Exception:
-        return jsonify({'error': 'Error when requesting from CoinGecko'}), 500
-
     crypto = Cryptocurrency.query.filter_by(coingecko_id=coingecko_id).first()
     if not crypto:
         return jsonify({'error': 'Cryptocurrency not found in your database'}), 404
 
-    holding = Holdings.query.filter_by(user_id=user_id, crypto_id=crypto.id).first()
-    if not holding or holding.amount < amount:
-        return jsonify({'error': 'Not enough cryptocurrency to sell'}), 400
+    current_price = price_cache.get_price(crypto)
+    if current_price is None:
+        try:
+            quote = fetch_coin_quote(coingecko_id)
+        except requests.exceptions.RequestException:
+            current_price = price_cache.last_known(crypto)
+            if current_price is None:
+                return price_unavailable()
+        else:
+            if not quote:
+                return jsonify({'error': 'Failed to get cryptocurrency data'}), 404
+            current_price = quote['price']
+            crypto.current_price = current_price
+            crypto.last_updated = datetime.utcnow()
+            db.session.commit()
 
-    base_revenue = amount * current_price
-    fee = base_revenue * COMMISSION_RATE
+    crypto_id = crypto.id
+    amount = money.quantity(amount, crypto.quantity_decimals or money.QUANTITY_DECIMALS)
+    current_price = money.price(current_price)
+    base_revenue = money.notional(amount, current_price)
+    if base_revenue <= 0:
+        return jsonify({'error': 'Amount is too small'}), 400
+    fee = money.commission(base_revenue)
     total_revenue = base_revenue - fee
-    
-    user.balance_usd += total_revenue
-    holding.amount -= amount
-    
-    if holding.amount == 0:
-        db.session.delete(holding)
-    
-    transaction = Transaction(
-        user_id=user_id,
-        crypto_id=crypto.id,
-        transaction_type='sell',
-        amount=amount,
-        price_at_transaction=crypto.current_price,
-        fee=fee,
-        total_cost=total_revenue
-    )
-    db.session.add(transaction)
-    db.session.commit()
-    
+
+    try:
+        new_balance = run_in_transaction(
+            lambda: spot_sell(user.id, crypto_id, amount, current_price, fee, total_revenue)
+        )
+    except TradeError as exc:
+        return jsonify({'error': exc.message}), exc.status
+
+    publish_fill(user.id, 'sell', coingecko_id, amount, current_price)
     return jsonify({
         'message': 'Sale successful',
         'transaction': {
             'amount': amount,
-            'price': crypto.current_price,
+            'price': current_price,
             'fee': fee,
             'total_revenue': total_revenue,
-            'new_balance': user.balance_usd
+            'new_balance': new_balance
         }
     }), 200
 
-@app.route('/api/portfolio', methods=['GET'])
+def spot_buy(user_id, crypto_id, amount, price, fee, total_cost, release=0):
+    """Buy ``amount`` coins at ``price`` for ``total_cost`` (fee included); the caller commits.
+
+    ``release`` is USD the user had reserved for this trade (a triggered buy).
+    """
+    new_balance = debit_usd(user_id, total_cost, release=release)
+    add_holding(user_id, crypto_id, amount, total_cost)
+    record_trade(crypto_id, float(price), float(amount))
+    db.session.add(Transaction(
+        user_id=user_id,
+        crypto_id=crypto_id,
+        transaction_type='buy',
+        amount=amount,
+        price_at_transaction=price,
+        fee=fee,
+        total_cost=total_cost
+    ))
+    return new_balance
+
+def spot_sell(user_id, crypto_id, amount, price, fee, total_revenue, release=0):
+    """Sell ``amount`` coins at ``price`` for ``total_revenue`` (fee deducted); the caller commits.
+
+    ``release`` is coins the user had reserved for this trade (a triggered sell).
+    """
+    # Users before holdings, matching the lock order of every other write path.
+    new_balance = credit_usd(user_id, total_revenue)
+    remove_holding(user_id, crypto_id, amount, total_revenue, release=release)
+    record_trade(crypto_id, float(price), float(amount))
+    db.session.add(Transaction(
+        user_id=user_id,
+        crypto_id=crypto_id,
+        transaction_type='sell',
+        amount=amount,
+        price_at_transaction=price,
+        fee=fee,
+        total_cost=total_revenue
+    ))
+    return new_balance
+
+@api.route('/api/prices/cache', methods=['GET'])
+def price_cache_stats():
+    stats = price_cache.stats()
+    stats['upstream'] = coingecko.stats()
+    stats['market_ingestion'] = market_ingestor.stats()
+    stats['trade_ticks'] = trade_ticks.stats()
+    stats['portfolio_valuation'] = portfolio_valuator.stats()
+    stats['stream'] = broker.stats()
+    stats['stream_tickets'] = stream_tickets.stats()
+    stats['identity_cache'] = identity_cache.stats()
+    stats['password_hashing'] = password_hasher.stats()
+    stats['response_cache'] = response_cache.stats()
+    stats['compressed_responses'] = serialization.compressed_cache.stats()
+    stats['triggers'] = trigger_engine.stats()
+    stats['journal'] = journal.snapshotter.stats()
+    stats['rate_limits'] = rate_limiter.stats()
+    stats['admission'] = load_shedder.stats()
+    return jsonify(stats), 200
+
+def user_changed(user_id):
+    """A committed write moved this user's balances, holdings or reservations."""
+    write_tracker.mark(user_id)
+    response_cache.invalidate(f'portfolio:{user_id}')
+
+@api.after_request
+def forget_caller_views(response):
+    if request.method != 'GET' and response.status_code < 400:
+        try:
+            user_changed(int(get_jwt_identity()))
+        except (RuntimeError, TypeError, ValueError):
+            pass
+    return response
+
+def publish_fill(user_id, side, coingecko_id, quantity, price, order_id=None):
+    """Push a committed execution to the user's ``fills`` stream."""
+    user_changed(user_id)
+    broker.publish(f'fills:{user_id}', 'fill', {
+        'side': side,
+        'crypto_id': coingecko_id,
+        'quantity': float(quantity),
+        'price': float(price),
+        'order_id': order_id
+    }, conflate=False)
+
+@api.route('/api/stream/ticket', methods=['POST'])
+@jwt_required()
+@rate_limited('market')
+def stream_ticket():
+    """A single-use ticket that opens one ``fills`` stream for the caller."""
+    try:
+        ticket = stream_tickets.issue(current_user.id)
+    except stream_tickets.backend.errors:
+        return refuse(503, 'Stream tickets are unavailable, try again shortly', 1)
+    return jsonify({'ticket': ticket, 'expires_in': stream_tickets.ttl}), 201
+
+@api.route('/api/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events: ``?topics=prices,book:<coin_id>,fills``.
+
+    Each topic starts with a snapshot and then receives deltas. ``fills``
+    needs ``?ticket=`` from ``POST /api/stream/ticket``, because EventSource
+    cannot send headers and an access token in the URL would be logged.
+    """
+    requested = [t for t in request.args.get('topics', 'prices').split(',') if t]
+    topics = {}
+    for topic in requested:
+        if topic == 'prices':
+            topics['prices'] = 'prices'
+        elif topic.startswith('book:'):
+            crypto = Cryptocurrency.query.filter_by(coingecko_id=topic[5:]).first()
+            if not crypto:
+                return jsonify({'message': f'Unknown topic: {topic}'}), 404
+            topics[f'book:{crypto.id}'] = topic
+        elif topic == 'fills':
+            user_id = stream_tickets.redeem(request.args.get('ticket'))
+            if user_id is None:
+                return jsonify({'message': 'A valid stream ticket is required for fills'}), 401
+            topics[f'fills:{user_id}'] = 'fills'
+        else:
+            return jsonify({'message': f'Unknown topic: {topic}'}), 400
+
+    try:
+        subscription = broker.subscribe(topics)
+    except TooManySubscribers as exc:
+        return jsonify({'message': str(exc)}), 503
+
+    # Snapshots are taken after subscribing; deltas carry absolute values, so
+    # any delta queued in between is still correct when applied on top.
+    snapshot = []
+    for topic, name in topics.items():
+        if topic == 'prices':
+            snapshot.append((name, 'prices', price_cache.snapshot()))
+        elif topic.startswith('book:'):
+            depth = matching_engine.book(int(topic[5:])).depth(limit=500)
+            snapshot.append((name, 'reset', {}))
+            snapshot.append((name, 'book', {
+                side: {level['price']: level['quantity'] for level in levels}
+                for side, levels in depth.items()
+            }))
+
+    def events():
+        try:
+            yield f'retry: {int(STREAM_HEARTBEAT * 1000)}\n\n'
+            for name, kind, data in snapshot:
+                yield format_event(None, name, kind, data)
+            while not subscription.closed:
+                pending = subscription.drain(STREAM_HEARTBEAT)
+                if not pending:
+                    yield ': keepalive\n\n'
+                for event_id, topic, kind, data in pending:
+                    yield format_event(event_id, topics.get(topic), kind, data)
+                if pending and STREAM_BATCH_INTERVAL:
+                    # Let deltas conflate instead of waking up for every publish.
+                    time.sleep(STREAM_BATCH_INTERVAL)
+        finally:
+            broker.unsubscribe(subscription)
+
+    # Not wrapped in stream_with_context: the request context (and its database
+    # session) is released here, so request metrics end at the headers.
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@api.route('/api/candles/<coin_id>', methods=['GET'])
+@rate_limited('market')
+def get_candles(coin_id):
+    """OHLCV candles for ``interval`` (1m, 5m, 1h, 1d) between optional ``start``/``end``.
+
+    ``start`` and ``end`` accept ISO 8601 or Unix seconds (UTC).
+    """
+    interval = request.args.get('interval', '1h')
+    if interval not in INTERVALS:
+        return jsonify({'error': f'interval must be one of {", ".join(INTERVALS)}'}), 400
+
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'Invalid start or end'}), 400
+
+    crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_id).first()
+    if not crypto:
+        return jsonify({'error': 'Coin not found'}), 404
+
+    limit = request.args.get('limit', 500, type=int)
+    candles = candles_for(crypto.id, interval, start, end, limit)
+    return jsonify([candle.to_dict() for candle in candles]), 200
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@api.route('/api/portfolio', methods=['GET'])
 @jwt_required()
 def get_portfolio():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 401
-        
-    holdings = Holdings.query.filter_by(user_id=user_id).all()
-    
-    portfolio_value = sum(h.amount * (h.cryptocurrency.current_price or 0) for h in holdings)
-    
-    return jsonify({
-        'balance_usd': user.balance_usd,
-        'portfolio_value': portfolio_value,
-        'total_value': user.balance_usd + portfolio_value,
-        'holdings': [h.to_dict() for h in holdings]
-    }), 200
+    user_id = current_user.id
+
+    def load():
+        # Balances are not part of the cached identity; read the row itself.
+        with replica_reads(user_id):
+            user = db.session.get(User, user_id)
+            if user is not None:
+                return user_portfolio(user)
+        # A replica that has not caught up with a new signup yet.
+        return user_portfolio(db.session.get(User, user_id))
 
-@app.route('/api/transactions', methods=['GET'])
+    return serialization.json_body(response_cache.get_encoded(
+        f'portfolio:{user_id}', load, PORTFOLIO_CACHE_TTL, CACHE_STALE_TTL
+    ))
+
+@api.route('/api/leaderboard', methods=['GET'])
+@jwt_required()
+def get_leaderboard():
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_LEADERBOARD))
+    return serialization.json_body(response_cache.get_encoded(
+        f'leaderboard:{limit}', lambda: portfolio_valuator.leaderboard(limit), portfolio_valuator.max_age, CACHE_STALE_TTL
+    ))
+
+@api.route('/api/transactions', methods=['GET'])
 @jwt_required()
 def get_transactions():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 401
-        
-    transactions = Transaction.query.filter_by(user_id=user_id).order_by(Transaction.created_at.desc()).limit(50).all()
-    
-    return jsonify([{
-        'id': t.id,
-        'type': t.transaction_type,
-        'crypto': t.cryptocurrency.symbol,
-        'amount': t.amount,
-        'price': t.price_at_transaction,
-        'fee': t.fee,
-        'total': t.total_cost,
-        'date': t.created_at.isoformat()
-    } for t in transactions]), 200
-
-@app.route('/api/orders', methods=['GET', 'POST'])
+    """The user's transactions, newest first, with keyset pagination.
+
+    Query params: ``start``/``end`` (ISO 8601 or epoch seconds), ``type``
+    (``buy``/``sell``), ``crypto_id`` (CoinGecko id), ``limit`` and ``cursor``
+    (from the ``X-Next-Cursor`` header of the previous page).
+    """
+    user_id = current_user.id
+    try:
+        filters = transaction_filters()
+        limit = page_size(request.args.get('limit', 50, type=int))
+        query = transaction_query(user_id, **filters)
+        with replica_reads(user_id):
+            rows, next_cursor = paginate_desc(
+                query, Transaction.created_at, Transaction.id, request.args.get('cursor'), limit
+            )
+    except (ValueError, InvalidCursor) as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    response = jsonify([transaction_dict(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+@api.route('/api/transactions/export', methods=['GET'])
+@jwt_required()
+def export_transactions():
+    """Full history, oldest first, streamed as ``format=csv`` (default) or ``ndjson``.
+
+    Accepts the same filters as ``/api/transactions``.
+    """
+    user_id = current_user.id
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        filters = transaction_filters()
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    chunks = export_chunks(export_rows(user_id, **filters), fmt)
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename=transactions.{fmt}'
+    })
+
+def transaction_filters():
+    transaction_type = request.args.get('type')
+    if transaction_type and transaction_type not in ('buy', 'sell'):
+        raise ValueError('type must be buy or sell')
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError:
+        raise ValueError('Invalid start or end') from None
+    return {
+        'start': start,
+        'end': end,
+        'transaction_type': transaction_type,
+        'coingecko_id': request.args.get('crypto_id')
+    }
+
+@api.route('/api/orders', methods=['GET', 'POST'])
 @jwt_required()
 def handle_orders():
     if request.method == 'POST':
         return create_order()
     
-    query = Order.query.filter_by(is_active=True).order_by(Order.timestamp.desc())
-    orders = query.all()
-    
-    output = []
-    for o in orders:
-        user = User.query.get(o.user_id)
-        crypto = Cryptocurrency.query.get(o.crypto_id)
-        if user and crypto:
-            output.append({
-                'id': o.id,
-                'user': user.username,
-                'crypto_symbol': crypto.symbol,
-                'crypto_name': crypto.name,
-                'quantity': o.quantity,
-                'price': o.price,
-                'order_type': o.order_type,
-                'timestamp': o.timestamp.isoformat()
-            })
-
-    return jsonify(output)
+    return list_orders()
 
-def create_order():
-    data = request.get_json()
-    current_user_id = get_jwt_identity()
+def list_orders():
+    """Active orders, newest first, with keyset pagination.
 
+    Query params: ``crypto_id`` (CoinGecko id), ``order_type``, ``kind``, ``min_price``,
+    ``max_price``, ``limit`` and ``cursor`` (from the ``X-Next-Cursor`` header
+    of the previous page). Worst case is one SQL statement per request: users
+    and cryptocurrencies are joined in, and the page size is capped.
+    """
+    try:
+        min_price = request.args.get('min_price', type=float)
+        max_price = request.args.get('max_price', type=float)
+        limit = page_size(request.args.get('limit', type=int))
+
+        query = db.session.query(
+            Order.id,
+            Order.quantity,
+            Order.filled_quantity,
+            Order.price,
+            Order.order_type,
+            Order.kind,
+            Order.trigger_price,
+            Order.timestamp,
+            User.username,
+            Cryptocurrency.coingecko_id,
+            Cryptocurrency.symbol,
+            Cryptocurrency.name
+        ).join(User, User.id == Order.user_id).join(
+            Cryptocurrency, Cryptocurrency.id == Order.crypto_id
+        ).filter(Order.is_active.is_(True))
+
+        if request.args.get('crypto_id'):
+            query = query.filter(Cryptocurrency.coingecko_id == request.args['crypto_id'])
+        if request.args.get('order_type'):
+            query = query.filter(Order.order_type == request.args['order_type'])
+        if request.args.get('kind'):
+            query = query.filter(Order.kind == request.args['kind'])
+        if min_price is not None:
+            query = query.filter(Order.price >= min_price)
+        if max_price is not None:
+            query = query.filter(Order.price <= max_price)
+
+        with replica_reads(current_user.id):
+            rows, next_cursor = paginate_desc(query, Order.timestamp, Order.id, request.args.get('cursor'), limit)
+    except InvalidCursor:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    response = jsonify([{
+        'id': row.id,
+        'user': row.username,
+        'crypto_id': row.coingecko_id,
+        'crypto_symbol': row.symbol,
+        'crypto_name': row.name,
+        'quantity': row.quantity,
+        'filled_quantity': row.filled_quantity,
+        'price': row.price,
+        'order_type': row.order_type,
+        'kind': row.kind,
+        'trigger_price': row.trigger_price,
+        'timestamp': row.timestamp.isoformat()
+    } for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def parse_order(data):
+    """Validate the fields of one new order; returns ``(coingecko_id, order_type, quantity, price)``."""
     crypto_id = data.get('crypto_id')
     order_type = data.get('order_type')
 
     try:
-        quantity = float(data.get('quantity'))
-        price = float(data.get('price'))
-    except (ValueError, TypeError):
-        return jsonify({'message': 'Invalid number format for quantity or price'}), 400
+        quantity = money.parse(data.get('quantity'))
+        price = money.price(data.get('price'))
+    except ValueError:
+        raise TradeError('Invalid number format for quantity or price')
 
     if not all([crypto_id, quantity, price, order_type]):
-        return jsonify({'message': 'Missing required fields'}), 400
+        raise TradeError('Missing required fields')
+
+    if quantity <= 0 or price <= 0:
+        raise TradeError('Quantity and price must be positive')
 
     if order_type not in ['buy', 'sell']:
-        return jsonify({'message': 'Invalid order type'}), 400
-    
-    user = User.query.get(current_user_id)
-    cryptocurrency = Cryptocurrency.query.filter_by(coingecko_id=crypto_id).first()
+        raise TradeError('Invalid order type')
+    return crypto_id, order_type, quantity, price
+
+def check_order_funds(order_type, quantity, price, balance, position):
+    """Reject an order the unreserved ``balance`` or ``position`` cannot cover."""
+    if quantity <= 0:
+        raise TradeError('Quantity is below the precision of this coin')
+    if order_type == 'sell':
+        if position is None or position < quantity:
+            raise InsufficientHoldings('Insufficient funds to place sell order')
+    elif balance < reservation('buy', quantity, price):
+        raise InsufficientFunds('Insufficient funds to place buy order')
+
+def report_fills(user_id, order_type, coingecko_id, order_id, fills):
+    """Publish both sides of each fill of a new order and return them for the response."""
+    maker_side = 'sell' if order_type == 'buy' else 'buy'
+    executed = []
+    for maker, fill_units, price_units in fills:
+        fill_quantity = money.from_units(fill_units, money.QUANTITY_DECIMALS)
+        fill_price = money.from_units(price_units, money.PRICE_DECIMALS)
+        executed.append({'order_id': maker.id, 'quantity': fill_quantity, 'price': fill_price})
+        publish_fill(user_id, order_type, coingecko_id, fill_quantity, fill_price, order_id)
+        publish_fill(maker.user_id, maker_side, coingecko_id, fill_quantity, fill_price, maker.id)
+    return executed
+
+@rate_limited('trade')
+def create_order():
+    """Place a limit order, or with ``kind`` ``stop``/``take_profit`` and ``trigger_price`` a triggered one."""
+    data = request.get_json()
+    user = current_user
+
+    kind = data.get('kind', LIMIT)
+    if kind not in ORDER_KINDS:
+        return jsonify({'message': 'Invalid order kind'}), 400
+    if kind != LIMIT:
+        data = dict(data, price=data.get('trigger_price'))
+    try:
+        crypto_id, order_type, quantity, price = parse_order(data)
+    except TradeError as exc:
+        return jsonify({'message': exc.message}), exc.status
 
-    if not user or not cryptocurrency:
+    cryptocurrency = Cryptocurrency.query.filter_by(coingecko_id=crypto_id).first()
+    if not cryptocurrency:
         return jsonify({'message': 'User or cryptocurrency not found'}), 404
 
-    if order_type == 'sell':
-        portfolio_item = Holdings.query.filter_by(user_id=current_user_id, crypto_id=cryptocurrency.id).first()
-        if not portfolio_item or portfolio_item.amount < quantity:
-            return jsonify({'message': 'Insufficient funds to place sell order'}), 400
-
-    new_order = Order(
-        user_id=current_user_id,
-        crypto_id=cryptocurrency.id,
-        quantity=quantity,
-        price=price,
-        order_type=order_type
-    )
+    quantity = money.quantity(quantity, cryptocurrency.quantity_decimals or money.QUANTITY_DECIMALS)
+    if quantity <= 0:
+        return jsonify({'message': 'Quantity is below the precision of this coin'}), 400
+    if kind != LIMIT:
+        return create_trigger_order(user.id, cryptocurrency, order_type, kind, quantity, price)
 
-    db.session.add(new_order)
-    db.session.commit()
+    crypto_id = cryptocurrency.id
+    book = matching_engine.book(crypto_id)
+
+    def execute():
+        # The conditional UPDATE is the funds check: it fails unless the
+        # unreserved balance or position covers the order.
+        reserve_order(user.id, crypto_id, order_type, quantity, price)
+        new_order = Order(
+            user_id=user.id,
+            crypto_id=crypto_id,
+            quantity=quantity,
+            filled_quantity=0,
+            price=price,
+            order_type=order_type
+        )
+        db.session.add(new_order)
+        db.session.flush()
+        journal.order_placed(new_order)
+        fills = book.submit(BookOrder.from_model(new_order), settle_fill)
+        return new_order, fills
+
+    with book.lock:
+        try:
+            new_order, fills = run_in_transaction(execute, on_retry=lambda: reload_order_book(crypto_id))
+        except (InsufficientFunds, InsufficientHoldings) as exc:
+            return jsonify({'message': exc.message}), exc.status
+        except Exception:
+            db.session.rollback()
+            reload_order_book(crypto_id)
+            raise
+
+    result = new_order.to_dict()
+    result['fills'] = report_fills(user.id, order_type, cryptocurrency.coingecko_id, new_order.id, fills)
+    return jsonify(result), 201
 
+def create_trigger_order(user_id, cryptocurrency, order_type, kind, quantity, trigger_price):
+    """Reserve for and store a stop or take-profit order, then index it by its trigger price."""
+    trigger_units = money.to_units(trigger_price, money.PRICE_DECIMALS)
+    current_price = price_cache.get_price(cryptocurrency)
+    if current_price is not None and is_crossed(
+        order_type, kind, trigger_units, money.to_units(money.price(current_price), money.PRICE_DECIMALS)
+    ):
+        return jsonify({'message': 'The market is already past the trigger price'}), 400
+
+    def execute():
+        reserve_order(user_id, cryptocurrency.id, order_type, quantity, trigger_price, kind)
+        new_order = Order(
+            user_id=user_id,
+            crypto_id=cryptocurrency.id,
+            quantity=quantity,
+            filled_quantity=0,
+            price=trigger_price,
+            trigger_price=trigger_price,
+            order_type=order_type,
+            kind=kind
+        )
+        db.session.add(new_order)
+        db.session.flush()
+        journal.order_placed(new_order)
+        return new_order
+
+    try:
+        new_order = run_in_transaction(execute)
+    except (InsufficientFunds, InsufficientHoldings) as exc:
+        return jsonify({'message': exc.message}), exc.status
+
+    trigger_engine.add(new_order.id, cryptocurrency.coingecko_id, order_type, kind, trigger_units)
+    # A price that moved past the trigger since the check above fires it now.
+    latest = price_cache.get(cryptocurrency.coingecko_id)
+    if latest is not None:
+        trigger_engine.on_prices({cryptocurrency.coingecko_id: latest})
     return jsonify(new_order.to_dict()), 201
 
-@app.route('/api/orders/<int:order_id>/execute', methods=['POST'])
+def execute_trigger(order_id, price):
+    """Run a fired stop or take-profit order as a spot trade at the price that fired it."""
+    order = db.session.get(Order, order_id)
+    if order is None or not order.is_active:
+        return
+    user_id, crypto_id, side = order.user_id, order.crypto_id, order.order_type
+    coingecko_id = order.cryptocurrency.coingecko_id
+    quantity = order.quantity - order.filled_quantity
+    price = money.price(price)
+    gross = money.notional(quantity, price)
+    fee = money.commission(gross)
+    reserved = reservation(side, quantity, order.price, order.kind)
+
+    def execute():
+        lock_users([user_id])
+        lock_holdings(crypto_id, [user_id])
+        fill_order(order_id, quantity)
+        if side == 'buy':
+            spot_buy(user_id, crypto_id, quantity, price, fee, gross + fee, release=reserved)
+        else:
+            spot_sell(user_id, crypto_id, quantity, price, fee, gross - fee, release=quantity)
+
+    try:
+        run_in_transaction(execute)
+    except OrderUnavailable:
+        return  # cancelled, or executed by another worker
+    except TradeError:
+        # A buy whose price gapped past what it reserved; give the reservation back.
+        run_in_transaction(lambda: deactivate_order(order_id))
+        user_changed(user_id)
+        return
+    publish_fill(user_id, side, coingecko_id, quantity, price, order_id)
+
+@api.route('/api/orders/batch', methods=['POST'])
 @jwt_required()
-def execute_order_route(order_id):
-    buyer_id = get_jwt_identity()
-    order = Order.query.get(order_id)
+@rate_limited('trade')
+def batch_orders():
+    """Create and cancel up to ``ORDER_BATCH_MAX`` orders in one request.
 
-    if not order or not order.is_active:
-        return jsonify({'message': 'Order not found or already executed'}), 404
+    Body: ``{"operations": [{"action": "create", "crypto_id", "order_type",
+    "quantity", "price"} or {"action": "cancel", "order_id"}, ...]}``.
+    Inside one transaction the user's balance and positions are locked and
+    read once; cancels release their reservations first, so a requote can
+    reuse them, then each create reserves from what is left in request order.
+    Operations that fail validation or do not fit are rejected individually;
+    the rest reach the order books in request order. Returns one result per
+    operation with the status code the single-order endpoint would answer.
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'message': 'operations must be a non-empty list'}), 400
+    if len(operations) > ORDER_BATCH_MAX:
+        return jsonify({'message': f'At most {ORDER_BATCH_MAX} operations per batch'}), 400
 
-    if order.order_type != 'sell':
-        return jsonify({'message': 'This order is not a sell order'}), 400
+    user = current_user
 
-    seller_id = order.user_id
-    if str(seller_id) == str(buyer_id):
-        return jsonify({'message': 'You cannot buy your own order'}), 400
+    results = [None] * len(operations)
+    creates, cancels = {}, {}
+    for index, operation in enumerate(operations):
+        action = operation.get('action') if isinstance(operation, dict) else None
+        if action == 'create' and operation.get('kind', LIMIT) != LIMIT:
+            results[index] = {'status': 400, 'message': 'Batches only accept limit orders'}
+        elif action == 'create':
+            try:
+                creates[index] = parse_order(operation)
+            except TradeError as exc:
+                results[index] = {'status': exc.status, 'message': exc.message}
+        elif action == 'cancel' and type(operation.get('order_id')) is int:
+            cancels[index] = operation['order_id']
+        else:
+            results[index] = {'status': 400, 'message': 'Invalid operation'}
 
-    buyer = User.query.get(buyer_id)
-    seller = User.query.get(seller_id)
-    crypto = Cryptocurrency.query.get(order.crypto_id)
+    coins = {coin.coingecko_id: coin for coin in Cryptocurrency.query.filter(
+        Cryptocurrency.coingecko_id.in_({fields[0] for fields in creates.values()})
+    )} if creates else {}
+    resting = {order.id: order for order in Order.query.filter(Order.id.in_(set(cancels.values())))} if cancels else {}
 
-    if not buyer or not seller or not crypto:
-        return jsonify({'message': 'Internal error: user or crypto not found'}), 500
+    accepted = []
+    for index in range(len(operations)):
+        if index in creates:
+            coingecko_id, order_type, quantity, price = creates[index]
+            coin = coins.get(coingecko_id)
+            if coin is None:
+                results[index] = {'status': 404, 'message': 'User or cryptocurrency not found'}
+                continue
+            quantity = money.quantity(quantity, coin.quantity_decimals or money.QUANTITY_DECIMALS)
+            if quantity <= 0:
+                results[index] = {'status': 400, 'message': 'Quantity is below the precision of this coin'}
+                continue
+            accepted.append((index, coin.id, {'order_type': order_type, 'quantity': quantity, 'price': price}))
+        elif index in cancels:
+            order = resting.pop(cancels[index], None)
+            if not order or not order.is_active:
+                results[index] = {'status': 404, 'message': 'Order not found or already executed'}
+            elif order.user_id != user.id:
+                results[index] = {'status': 403, 'message': 'You can only cancel your own orders'}
+            else:
+                accepted.append((index, order.crypto_id, order.id))
 
-    total_cost = order.quantity * order.price
-    commission = total_cost * COMMISSION_RATE
+    crypto_ids = sorted({crypto_id for _, crypto_id, _ in accepted})
+    coin_names = {coin.id: (coin.coingecko_id, coin.symbol, coin.name) for coin in coins.values()}
+    username = user.username
+    timestamp = datetime.utcnow()
 
-    if buyer.balance_usd < total_cost:
-        return jsonify({'message': 'Insufficient USD balance to execute this order'}), 400
+    def reload_books():
+        for crypto_id in crypto_ids:
+            reload_order_book(crypto_id)
 
-    buyer.balance_usd -= total_cost
+    def execute():
+        available_usd, positions = lock_account(user.id, [crypto_id for _, crypto_id, item in accepted
+                                                         if isinstance(item, dict)])
+        cancelled = deactivate_orders([item for _, _, item in accepted if not isinstance(item, dict)], user.id)
+        for crypto_id, order_type, released in cancelled.values():
+            if order_type == 'buy':
+                available_usd += released
+            elif crypto_id in positions:
+                positions[crypto_id] += released
 
-    buyer_holding = Holdings.query.filter_by(user_id=buyer_id, crypto_id=crypto.id).first()
-    if not buyer_holding:
-        buyer_holding = Holdings(user_id=buyer_id, crypto_id=crypto.id, amount=0)
-        db.session.add(buyer_holding)
-    buyer_holding.amount += order.quantity
+        applied, new_orders = {}, {}
+        reserved_usd, reserved_amounts = 0, {}
+        for index, crypto_id, item in accepted:
+            if not isinstance(item, dict):
+                continue
+            try:
+                check_order_funds(item['order_type'], item['quantity'], item['price'],
+                                  available_usd, positions.get(crypto_id))
+            except TradeError as exc:
+                applied[index] = exc
+                continue
+            amount = reservation(item['order_type'], item['quantity'], item['price'])
+            if item['order_type'] == 'buy':
+                available_usd -= amount
+                reserved_usd += amount
+            else:
+                positions[crypto_id] -= amount
+                reserved_amounts[crypto_id] = reserved_amounts.get(crypto_id, 0) + amount
+            new_orders[index] = Order(user_id=user.id, crypto_id=crypto_id, filled_quantity=0,
+                                      timestamp=timestamp, **item)
+        shift_locked(user.id, reserved_usd, reserved_amounts)
+        db.session.add_all(new_orders.values())
+        db.session.flush()
+        for new_order in new_orders.values():
+            journal.order_placed(new_order)
 
-    seller_holding = Holdings.query.filter_by(user_id=seller_id, crypto_id=crypto.id).first()
-    if not seller_holding or seller_holding.amount < order.quantity:
-        order.is_active = False
-        db.session.commit()
-        return jsonify({'message': 'Seller has insufficient funds. The order has been cancelled.'}), 400
+        for index, crypto_id, item in accepted:
+            book = matching_engine.book(crypto_id)
+            if index in new_orders:
+                book_order = BookOrder.from_model(new_orders[index])
+                applied[index] = (new_orders[index].id, book_order, book.submit(book_order, settle_fill))
+            elif not isinstance(item, dict) and item in cancelled:
+                book.cancel(item)
+                trigger_engine.remove(item)
+                applied[index] = item
+        return applied
 
-    seller.balance_usd += (total_cost - commission)
-    seller_holding.amount -= order.quantity
-    if seller_holding.amount == 0:
-        db.session.delete(seller_holding)
+    # Book locks are taken in ascending coin order; every other path holds at most one.
+    with ExitStack() as stack:
+        for crypto_id in crypto_ids:
+            stack.enter_context(matching_engine.book(crypto_id).lock)
+        try:
+            applied = run_in_transaction(execute, on_retry=reload_books) if accepted else {}
+        except Exception:
+            db.session.rollback()
+            reload_books()
+            raise
 
-    order.is_active = False
+    for index, crypto_id, item in accepted:
+        outcome = applied.get(index)
+        if outcome is None:
+            results[index] = {'status': 404, 'message': 'Order not found or already executed'}
+        elif isinstance(outcome, TradeError):
+            results[index] = {'status': outcome.status, 'message': outcome.message}
+        elif isinstance(item, dict):
+            order_id, book_order, fills = outcome
+            coingecko_id, symbol, name = coin_names[crypto_id]
+            results[index] = {'status': 201, 'order': {
+                'id': order_id,
+                'user_id': user.id,
+                'crypto_id': crypto_id,
+                'quantity': item['quantity'],
+                'filled_quantity': item['quantity'] - money.from_units(book_order.remaining, money.QUANTITY_DECIMALS),
+                'price': item['price'],
+                'order_type': item['order_type'],
+                'kind': LIMIT,
+                'trigger_price': None,
+                'timestamp': timestamp.isoformat(),
+                'is_active': book_order.active,
+                'user': username,
+                'crypto_symbol': symbol,
+                'crypto_name': name,
+                'fills': report_fills(user.id, item['order_type'], coingecko_id, order_id, fills)
+            }}
+        else:
+            results[index] = {'status': 200, 'order_id': item}
+
+    return jsonify({'results': results}), 200
+
+def reload_order_book(crypto_id):
+    orders = Order.query.filter_by(crypto_id=crypto_id, is_active=True, kind=LIMIT).order_by(Order.timestamp, Order.id)
+    matching_engine.rebuild(orders, crypto_id=crypto_id)
+
+def settle_fill(taker, maker, quantity_units, price_units):
+    """Persist one match between an incoming order and a resting one.
+
+    Called by the order book with its lock held; the caller commits. Rows are
+    locked users -> holdings -> orders, the same order every trade path uses.
+    """
+    if taker.user_id == maker.user_id:
+        deactivate_order(maker.id)
+        return MAKER_REJECTED
+
+    buy_side, sell_side = (taker, maker) if taker.side == 'buy' else (maker, taker)
+    crypto_id = taker.crypto_id
+    quantity = money.from_units(quantity_units, money.QUANTITY_DECIMALS)
+    price = money.from_units(price_units, money.PRICE_DECIMALS)
+    total_cost = money.fill_notional(quantity, price)
+    commission = money.commission(total_cost)
+
+    # Both orders reserved what this fill needs when they were placed: the
+    # seller's coins exactly, the buyer's USD at its limit price, which is never
+    # below the fill price. Reservations round up and fills round down, so the
+    # part of the reservation released here always covers the cost.
+    limit = money.from_units(buy_side.price, money.PRICE_DECIMALS)
+    buy_release = (
+        reservation('buy', money.from_units(buy_side.remaining, money.QUANTITY_DECIMALS), limit)
+        - reservation('buy', money.from_units(buy_side.remaining - quantity_units, money.QUANTITY_DECIMALS), limit)
+    )
+    lock_users([buy_side.user_id, sell_side.user_id])
+    lock_holdings(crypto_id, [buy_side.user_id, sell_side.user_id])
 
-    buy_transaction = Transaction(
-        user_id=buyer_id,
-        crypto_id=crypto.id,
+    debit_usd(buy_side.user_id, total_cost, release=buy_release)
+    credit_usd(sell_side.user_id, total_cost - commission)
+    add_holding(buy_side.user_id, crypto_id, quantity, total_cost)
+    remove_holding(sell_side.user_id, crypto_id, quantity, total_cost - commission, release=quantity)
+    fill_order(buy_side.id, quantity)
+    fill_order(sell_side.id, quantity)
+    record_trade(crypto_id, float(price), float(quantity))
+
+    db.session.add(Transaction(
+        user_id=buy_side.user_id,
+        crypto_id=crypto_id,
         transaction_type='buy',
-        amount=order.quantity,
-        price_at_transaction=order.price,
+        amount=quantity,
+        price_at_transaction=price,
         fee=0,
         total_cost=total_cost
-    )
-    sell_transaction = Transaction(
-        user_id=seller_id,
-        crypto_id=crypto.id,
+    ))
+    db.session.add(Transaction(
+        user_id=sell_side.user_id,
+        crypto_id=crypto_id,
         transaction_type='sell',
-        amount=order.quantity,
-        price_at_transaction=order.price,
+        amount=quantity,
+        price_at_transaction=price,
         fee=commission,
         total_cost=(total_cost - commission)
-    )
-    db.session.add(buy_transaction)
-    db.session.add(sell_transaction)
+    ))
+    return FILLED
 
-    db.session.commit()
+@api.route('/api/orders/<int:order_id>', methods=['DELETE'])
+@jwt_required()
+@rate_limited('trade')
+def cancel_order_route(order_id):
+    order = Order.query.get(order_id)
 
+    if not order or not order.is_active:
+        return jsonify({'message': 'Order not found or already executed'}), 404
+
+    if order.user_id != current_user.id:
+        return jsonify({'message': 'You can only cancel your own orders'}), 403
+
+    book = matching_engine.book(order.crypto_id)
+    with book.lock:
+        # A fill may have closed the order since the check above.
+        if not run_in_transaction(lambda: deactivate_order(order_id)):
+            return jsonify({'message': 'Order not found or already executed'}), 404
+        book.cancel(order_id)
+        trigger_engine.remove(order_id)
+
+    return jsonify(order.to_dict()), 200
+
+@api.route('/api/orders/book/<coin_id>', methods=['GET'])
+def order_book_depth(coin_id):
+    crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_id).first()
+    if not crypto:
+        return jsonify({'message': 'Cryptocurrency not found'}), 404
+
+    limit = min(request.args.get('depth', 20, type=int), 500)
+    return jsonify(matching_engine.book(crypto.id).depth(limit)), 200
+
+@api.route('/api/orders/<int:order_id>/execute', methods=['POST'])
+@jwt_required()
+@rate_limited('trade')
+def execute_order_route(order_id):
+    buyer = current_user
+    order = Order.query.get(order_id)
+
+    if not order or not order.is_active:
+        return jsonify({'message': 'Order not found or already executed'}), 404
+
+    if order.order_type != 'sell':
+        return jsonify({'message': 'This order is not a sell order'}), 400
+
+    if order.kind != LIMIT:
+        return jsonify({'message': 'Only limit orders can be executed directly'}), 400
+
+    seller_id = order.user_id
+    if seller_id == buyer.id:
+        return jsonify({'message': 'You cannot buy your own order'}), 400
+
+    # The seller exists: the orders.user_id foreign key guarantees it.
+    crypto = Cryptocurrency.query.get(order.crypto_id)
+    if not crypto:
+        return jsonify({'message': 'Internal error: user or crypto not found'}), 500
+
+    quantity = order.quantity - (order.filled_quantity or 0)
+    price = order.price
+    total_cost = money.fill_notional(quantity, price)
+    commission = money.commission(total_cost)
+    crypto_id = crypto.id
+
+    def execute():
+        available = lock_users([buyer.id, seller_id])
+        if available[buyer.id] < total_cost:
+            raise InsufficientFunds('Insufficient USD balance to execute this order')
+        lock_holdings(crypto_id, [buyer.id, seller_id])
+
+        fill_order(order_id, quantity)
+        new_balance = debit_usd(buyer.id, total_cost)
+        credit_usd(seller_id, total_cost - commission)
+        add_holding(buyer.id, crypto_id, quantity, total_cost)
+        # The sell order reserved these coins when it was placed, so the seller cannot be short.
+        remove_holding(seller_id, crypto_id, quantity, total_cost - commission, release=quantity)
+        record_trade(crypto_id, float(price), float(quantity))
+
+        db.session.add(Transaction(
+            user_id=buyer.id,
+            crypto_id=crypto_id,
+            transaction_type='buy',
+            amount=quantity,
+            price_at_transaction=price,
+            fee=0,
+            total_cost=total_cost
+        ))
+        db.session.add(Transaction(
+            user_id=seller_id,
+            crypto_id=crypto_id,
+            transaction_type='sell',
+            amount=quantity,
+            price_at_transaction=price,
+            fee=commission,
+            total_cost=(total_cost - commission)
+        ))
+        return new_balance
+
+    book = matching_engine.book(crypto_id)
+    with book.lock:
+        try:
+            new_balance = run_in_transaction(execute)
+        except TradeError as exc:
+            return jsonify({'message': exc.message}), exc.status
+        book.cancel(order_id)
+
+    publish_fill(buyer.id, 'buy', crypto.coingecko_id, quantity, price, order_id)
+    publish_fill(seller_id, 'sell', crypto.coingecko_id, quantity, price, order_id)
     return jsonify({
         'message': 'Order executed successfully',
-        'new_balance': buyer.balance_usd
+        'new_balance': new_balance
     }), 200
 
-
 if __name__ == '__main__':
+    app = create_app(start_services=False)
     with app.app_context():
-        db.create_all()
-    
+        upgrade_db()
+    start_background_services(app)
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,190 @@
+"""Authentication helpers: a cached identity for JWT requests and bounded password hashing.
+
+Authenticated endpoints only need to know that the token's user still exists,
+so the JWT user loader answers from a small LRU cache of ``(id, username)``
+instead of selecting the user row on every request. Balances are never
+cached: every write path locks and reads them inside its transaction, so a
+trade cannot make an entry stale. Entries expire after ``IDENTITY_CACHE_TTL``
+seconds, which bounds how long a deleted user keeps working.
+
+Password hashes are deliberately slow. They run on a pool of
+``PASSWORD_HASH_WORKERS`` threads (hashlib releases the GIL, so this is real
+parallelism) with at most ``PASSWORD_HASH_QUEUE`` more waiting; beyond that
+logins are turned away at once instead of tying up request threads that
+trades need. ``PASSWORD_HASH_METHOD`` sets the cost of new hashes; stored
+hashes carry their own method, and a login rehashes a password stored with a
+different one. Under gevent the pool is gevent's, whose threads are real OS
+threads, so a hash never blocks the worker's other connections.
+
+EventSource cannot send an ``Authorization`` header, so ``/api/stream``
+authenticates with a ticket from ``POST /api/stream/ticket`` instead of the
+access token. Tickets end up in access logs as part of the URL; they are
+random, expire after ``STREAM_TICKET_TTL`` seconds and are good for one
+stream, so a logged ticket is worthless.
+"""
+from flask import jsonify
+from database import db
+from models import User
+from shared_cache import CACHE_PREFIX, CACHE_URL, backend_from_url
+from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import secrets
+import time
+import os
+
+Identity = namedtuple('Identity', ['id', 'username'])
+
+
+class HashingBusy(Exception):
+    """Every hashing worker is busy and the wait queue is full."""
+
+
+class IdentityCache:
+    """LRU of ``user_id -> (Identity, fetched_at)`` with a time-to-live."""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size if max_size is not None else int(os.environ.get('IDENTITY_CACHE_SIZE', '10000'))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('IDENTITY_CACHE_TTL', '300'))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The user's ``Identity``, or ``None`` if there is no such user."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        row = db.session.query(User.id, User.username).filter(User.id == user_id).first()
+        if row is None:
+            self.invalidate(user_id)
+            return None
+        identity = Identity(row.id, row.username)
+        self.put(identity, now)
+        return identity
+
+    def put(self, identity, now=None):
+        with self._lock:
+            self._entries[identity.id] = (identity, time.monotonic() if now is None else now)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class PasswordHasher:
+    """Runs werkzeug hashing on a bounded thread pool."""
+
+    def __init__(self, workers=None, queue=None, method=None):
+        self.workers = workers if workers is not None else int(os.environ.get('PASSWORD_HASH_WORKERS', '1'))
+        queue = queue if queue is not None else int(os.environ.get('PASSWORD_HASH_QUEUE', '2'))
+        self.method = method or os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2')
+        self._prefix = None
+        self._slots = threading.BoundedSemaphore(self.workers + queue)
+        self._pool = _os_thread_pool(self.workers, 'password-hash')
+        self.rejected = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with a different method or cost than configured."""
+        if self._prefix is None:
+            # The method string is expanded with werkzeug's defaults, e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000'.
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def stats(self):
+        return {'workers': self.workers, 'method': self.method, 'rejected': self.rejected}
+
+
+def _os_thread_pool(workers, name):
+    """An executor running on OS threads, even where gevent has patched ``threading``."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        monkey = None
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+        return GeventThreadPoolExecutor(workers)
+    return ThreadPoolExecutor(workers, thread_name_prefix=name)
+
+
+class StreamTickets:
+    """Single-use tickets standing in for the access token on ``/api/stream``."""
+
+    def __init__(self, backend=None, ttl=None):
+        self.backend = backend if backend is not None else backend_from_url(CACHE_URL)
+        self.ttl = ttl if ttl is not None else float(os.environ.get('STREAM_TICKET_TTL', '30'))
+        self.prefix = CACHE_PREFIX + 'ticket:'
+        self.issued = 0
+        self.refused = 0
+
+    def issue(self, user_id):
+        ticket = secrets.token_urlsafe(24)
+        self.backend.set(self.prefix + ticket, str(user_id).encode(), self.ttl)
+        self.issued += 1
+        return ticket
+
+    def redeem(self, ticket):
+        """The user a ticket was issued to, or ``None`` if it is unknown, expired or already used."""
+        user_id = None
+        if ticket:
+            try:
+                user_id = self.backend.pop(self.prefix + ticket)
+            except self.backend.errors:
+                pass
+        if user_id is None:
+            self.refused += 1
+            return None
+        return int(user_id)
+
+    def stats(self):
+        return {'ttl': self.ttl, 'issued': self.issued, 'refused': self.refused}
+
+
+identity_cache = IdentityCache()
+password_hasher = PasswordHasher()
+stream_tickets = StreamTickets()
+
+
+def init_auth(jwt):
+    """Resolve ``current_user`` for every ``@jwt_required`` request from the identity cache."""
+
+    @jwt.user_lookup_loader
+    def load_identity(jwt_header, jwt_data):
+        try:
+            return identity_cache.get(int(jwt_data['sub']))
+        except (TypeError, ValueError):
+            return None
+
+    @jwt.user_lookup_error_loader
+    def identity_not_found(jwt_header, jwt_data):
+        return jsonify({'error': 'User not found'}), 401
@@ -0,0 +1,88 @@
+"""Stream transaction exports of growing size and report peak Python memory.
+
+Usage (from ``backend``)::
+
+    python bench/bench_export.py --sizes 10000 100000 1000000
+    DATABASE_URL=postgresql://... python bench/bench_export.py
+
+One user is given ``size`` transactions, then ``/api/transactions/export`` is
+consumed chunk by chunk. Peak traced memory should stay flat as size grows.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'export.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+INSERT_BATCH = 50000
+
+
+def seed(user_id, crypto_id, count, offset, rng):
+    from database import db
+    from models import Transaction
+
+    start = datetime(2020, 1, 1)
+    for batch_start in range(offset, offset + count, INSERT_BATCH):
+        db.session.execute(Transaction.__table__.insert(), [{
+            'user_id': user_id, 'crypto_id': crypto_id,
+            'transaction_type': 'buy' if i % 2 else 'sell',
+            'amount': rng.uniform(0.001, 5), 'price_at_transaction': rng.uniform(100, 50000),
+            'fee': 1.0, 'total_cost': rng.uniform(1, 10000),
+            'created_at': start + timedelta(seconds=i)
+        } for i in range(batch_start, min(batch_start + INSERT_BATCH, offset + count))])
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import db, upgrade_db
+    from models import User, Cryptocurrency
+    from flask_jwt_extended import create_access_token
+
+    app = create_app(start_services=False)
+    rng = random.Random(42)
+    with app.app_context():
+        upgrade_db()
+        user = User(username='exporter', email='exporter@example.com', password_hash='-')
+        crypto = Cryptocurrency(symbol='BTC', name='Bitcoin', coingecko_id='bitcoin', current_price=1.0)
+        db.session.add_all([user, crypto])
+        db.session.commit()
+        user_id, crypto_id = user.id, crypto.id
+        token = create_access_token(identity=str(user_id))
+
+    client = app.test_client()
+    print(f'{"rows":>9} {"MB out":>8} {"seconds":>8} {"peak MB":>8}')
+    seeded = 0
+    for size in sorted(args.sizes):
+        with app.app_context():
+            seed(user_id, crypto_id, size - seeded, seeded, rng)
+        seeded = size
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(f'/api/transactions/export?format={args.format}',
+                              headers={'Authorization': f'Bearer {token}'}, buffered=False)
+        written = sum(len(chunk) for chunk in response.response)
+        response.close()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{size:>9} {written / 1e6:>8.1f} {elapsed:>8.1f} {peak / 1e6:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Time market ingestion: per-row ORM loop versus set-based upsert.
+
+Usage (from ``backend``)::
+
+    python bench/bench_ingest.py --sizes 250 1000 10000
+    DATABASE_URL=postgresql://... python bench/bench_ingest.py
+
+Each size is ingested into an empty table (inserts) and then again with new
+prices (updates). The per-row path reproduces the loop the markets endpoint
+used to run inside the request.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'ingest.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+
+
+def synthetic_markets(n, rng):
+    return [{
+        'id': f'coin-{i}',
+        'symbol': f'c{i}',
+        'name': f'Coin {i}',
+        'image': f'https://example.com/coin-{i}.png',
+        'current_price': rng.uniform(0.001, 50000),
+        'market_cap': rng.uniform(1e5, 1e12),
+        'market_cap_rank': i + 1,
+        'total_volume': rng.uniform(1e3, 1e10),
+        'price_change_percentage_24h': rng.uniform(-20, 20)
+    } for i in range(n)]
+
+
+def ingest_per_row(coins):
+    from datetime import datetime
+    from database import db
+    from models import Cryptocurrency
+
+    for coin_data in coins:
+        crypto = Cryptocurrency.query.filter_by(coingecko_id=coin_data['id']).first()
+        if not crypto:
+            crypto = Cryptocurrency(coingecko_id=coin_data['id'], symbol=coin_data['symbol'].upper())
+            db.session.add(crypto)
+        crypto.symbol = coin_data['symbol'].upper()
+        crypto.name = coin_data.get('name', '')
+        crypto.current_price = coin_data.get('current_price')
+        crypto.market_cap = coin_data.get('market_cap')
+        crypto.volume_24h = coin_data.get('total_volume')
+        crypto.price_change_24h = coin_data.get('price_change_percentage_24h')
+        crypto.last_updated = datetime.utcnow()
+    db.session.commit()
+
+
+def ingest_bulk(coins):
+    from database import db
+    from market_data import upsert_markets
+
+    upsert_markets(coins)
+    db.session.commit()
+
+
+def timed(fn, coins):
+    start = time.perf_counter()
+    fn(coins)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 1000, 10000])
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import db, upgrade_db
+    from models import Cryptocurrency
+
+    app = create_app(start_services=False)
+    rng = random.Random(42)
+    print(f'{"coins":>7} {"path":>8} {"insert ms":>10} {"update ms":>10}')
+    with app.app_context():
+        upgrade_db()
+        for size in args.sizes:
+            for name, fn in (('per-row', ingest_per_row), ('bulk', ingest_bulk)):
+                Cryptocurrency.query.delete()
+                db.session.commit()
+                insert = timed(fn, synthetic_markets(size, rng))
+                update = timed(fn, synthetic_markets(size, rng))
+                print(f'{size:>7} {name:>8} {insert * 1000:>10.1f} {update * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Time recovering the ledger from the whole journal against a snapshot plus its tail.
+
+Usage (from ``backend``)::
+
+    python bench/bench_journal.py --users 10000 --events 1000000 --tail 10000
+    DATABASE_URL=postgresql://... python bench/bench_journal.py
+
+Writes ``--events`` synthetic trade events (debits, credits and position
+changes) for ``--users`` accounts over ``--coins`` coins straight into the
+journal, snapshots them, appends ``--tail`` more, then replays the ledger
+once from the first event and once from the snapshot. Both replays must
+agree. A snapshot costs about the size of the ledger, the full replay the
+length of the journal. Without ``DATABASE_URL`` a throwaway SQLite file is
+used.
+"""
+from datetime import datetime
+from decimal import Decimal
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'journal.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+
+BATCH = 10000
+
+
+def write_events(count, users, coins, rng, deposits=0):
+    """Insert ``count`` events: a deposit for each of the first ``deposits`` users, then random trades."""
+    from database import db
+    from journal import events, _COLUMNS
+    from sqlalchemy import insert
+
+    now = datetime.utcnow()
+    rows = []
+    for index in range(count):
+        row = dict.fromkeys(_COLUMNS)
+        if index < deposits:
+            user_id = index + 1
+            row.update(event='deposit', usd=Decimal('10000.00'))
+        else:
+            user_id = rng.randint(1, users)
+            cents = Decimal(rng.randint(1, 100000)).scaleb(-2)
+            row.update(event=rng.choice(['debit', 'credit', 'add_holding']), usd=cents if rng.random() < 0.5 else -cents,
+                       crypto_id=rng.randint(1, coins), amount=Decimal(rng.randint(1, 10 ** 8)).scaleb(-8), cost=cents)
+        row.update(user_id=user_id, created_at=now)
+        rows.append(row)
+        if len(rows) == BATCH:
+            db.session.execute(insert(events), rows)
+            db.session.commit()
+            rows = []
+    if rows:
+        db.session.execute(insert(events), rows)
+        db.session.commit()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--coins', type=int, default=5)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--tail', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import upgrade_db
+    import journal
+
+    app = create_app(start_services=False)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        upgrade_db()
+        _, seconds = timed(lambda: write_events(args.events, args.users, args.coins, rng, args.users))
+        print(f'wrote {args.events} events in {seconds:.1f}s')
+        snapshot, seconds = timed(journal.take_snapshot)
+        print(f'snapshot at sequence {snapshot.seq} in {seconds:.2f}s')
+        write_events(args.tail, args.users, args.coins, rng)
+
+        state = journal.LedgerState()
+        _, full_seconds = timed(state.apply)
+        recovered, tail_seconds = timed(journal.replay)
+        assert (recovered.seq, recovered.users, recovered.holdings) == (state.seq, state.users, state.holdings)
+        print(f'replay from the first event: {full_seconds:.2f}s')
+        print(f'replay from snapshot + {args.tail} events: {tail_seconds:.2f}s ({full_seconds / tail_seconds:.0f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
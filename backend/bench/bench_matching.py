@@ -0,0 +1,93 @@
+"""Compare matching throughput with integer minor units versus Decimal values.
+
+Usage (from ``backend``)::
+
+    python bench/bench_matching.py --resting 20000 --incoming 20000
+
+The same order flow is matched by the in-memory order book three ways:
+
+- ``int``: book orders in integer minor units, as the engine runs them
+- ``Decimal``: book orders holding ``Decimal`` prices and quantities
+- ``int + ledger``: integer matching plus the per-fill ``Decimal`` notional
+  and commission that ``settle_fill`` computes before touching the database
+
+No database is involved; settlement always succeeds.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def order_flow(resting, incoming, rng):
+    """``(side, price, quantity)`` tuples as 8-decimal strings, resting orders first."""
+    flow = []
+    for i in range(resting + incoming):
+        side = 'sell' if i < resting else 'buy'
+        mid = 100.0 if side == 'sell' else 100.5
+        price = f'{mid + rng.uniform(-1, 1):.8f}'
+        quantity = f'{rng.uniform(0.001, 2):.8f}'
+        flow.append((side, price, quantity))
+    return flow
+
+
+def run(flow, convert, settle):
+    from order_book import OrderBook, BookOrder
+
+    book = OrderBook(crypto_id=0)
+    orders = [
+        BookOrder(i, i, 0, side, convert(price, 8), convert(quantity, 8))
+        for i, (side, price, quantity) in enumerate(flow)
+    ]
+    fills = 0
+    start = time.perf_counter()
+    for order in orders:
+        fills += len(book.submit(order, settle))
+    return fills, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resting', type=int, default=20000)
+    parser.add_argument('--incoming', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    import money
+    from order_book import FILLED
+
+    def to_int(value, decimals):
+        return money.to_units(Decimal(value), decimals)
+
+    def to_decimal(value, decimals):
+        return Decimal(value)
+
+    def settle_noop(taker, maker, quantity, price):
+        return FILLED
+
+    def settle_ledger(taker, maker, quantity, price):
+        total = money.fill_notional(money.from_units(quantity, money.QUANTITY_DECIMALS),
+                                    money.from_units(price, money.PRICE_DECIMALS))
+        money.commission(total)
+        return FILLED
+
+    flow = order_flow(args.resting, args.incoming, random.Random(42))
+    print(f'{"mode":>14} {"fills":>8} {"ms":>8} {"fills/s":>10}')
+    for name, convert, settle in (
+        ('int', to_int, settle_noop),
+        ('Decimal', to_decimal, settle_noop),
+        ('int + ledger', to_int, settle_ledger),
+    ):
+        best = None
+        for _ in range(args.repeat):
+            fills, elapsed = run(flow, convert, settle)
+            best = elapsed if best is None else min(best, elapsed)
+        print(f'{name:>14} {fills:>8} {best * 1000:>8.1f} {fills / best:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Compare order placement and cancellation throughput: one request per order versus batches.
+
+Usage (from ``backend``)::
+
+    python bench/bench_orders.py --orders 2000 --batch 200
+    DATABASE_URL=postgresql://... python bench/bench_orders.py
+
+A market maker quotes ``--orders`` non-crossing levels around a mid price and
+then pulls them again, first through ``POST /api/orders`` and
+``DELETE /api/orders/<id>``, then through ``POST /api/orders/batch`` in
+batches of ``--batch`` operations. Requests go through the Flask test client,
+so the numbers exclude network round trips and favour the single-order path.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'orders.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+os.environ.setdefault('MARKET_INGEST_ENABLED', '0')
+
+
+def quotes(count):
+    """Alternating bids below and asks above 100, one level apart."""
+    return [{
+        'crypto_id': 'bench-coin',
+        'order_type': 'buy' if i % 2 else 'sell',
+        'quantity': 0.01,
+        'price': round(100 - 0.01 * (i // 2 + 1), 2) if i % 2 else round(100 + 0.01 * (i // 2 + 1), 2)
+    } for i in range(count)]
+
+
+def timed(label, count, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>22} {count:>7} {elapsed:>8.2f} {count / elapsed:>10.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=200, help='operations per batch request')
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import db, upgrade_db
+    from models import User, Cryptocurrency, Holdings
+    from flask_jwt_extended import create_access_token
+
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+        user = User(username='maker', email='maker@example.com', password_hash='-', balance_usd=10 ** 9)
+        crypto = Cryptocurrency(symbol='BNC', name='Bench Coin', coingecko_id='bench-coin', current_price=100.0)
+        db.session.add_all([user, crypto])
+        db.session.flush()
+        db.session.add(Holdings(user_id=user.id, crypto_id=crypto.id, amount=10 ** 6, cost_basis=0))
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+    client = app.test_client()
+    orders = quotes(args.orders)
+
+    def post_single(ids):
+        for order in orders:
+            response = client.post('/api/orders', json=order, headers=headers)
+            assert response.status_code == 201, response.json
+            ids.append(response.json['id'])
+
+    def cancel_single(ids):
+        for order_id in ids:
+            response = client.delete(f'/api/orders/{order_id}', headers=headers)
+            assert response.status_code == 200, response.json
+
+    def post_batches(ids):
+        for start in range(0, len(orders), args.batch):
+            operations = [dict(order, action='create') for order in orders[start:start + args.batch]]
+            response = client.post('/api/orders/batch', json={'operations': operations}, headers=headers)
+            for result in response.json['results']:
+                assert result['status'] == 201, result
+                ids.append(result['order']['id'])
+
+    def cancel_batches(ids):
+        for start in range(0, len(ids), args.batch):
+            operations = [{'action': 'cancel', 'order_id': order_id} for order_id in ids[start:start + args.batch]]
+            response = client.post('/api/orders/batch', json={'operations': operations}, headers=headers)
+            assert all(result['status'] == 200 for result in response.json['results'])
+
+    print(f'{"path":>22} {"orders":>7} {"seconds":>8} {"orders/s":>10}')
+    ids = []
+    timed('single create', args.orders, lambda: post_single(ids))
+    timed('single cancel', args.orders, lambda: cancel_single(ids))
+    ids = []
+    timed(f'batch create ({args.batch})', args.orders, lambda: post_batches(ids))
+    timed(f'batch cancel ({args.batch})', args.orders, lambda: cancel_batches(ids))
+
+
+if __name__ == '__main__':
+    main()
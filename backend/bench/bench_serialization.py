@@ -0,0 +1,139 @@
+"""Compare bytes and microseconds per response for the old and new JSON paths.
+
+Usage (from ``backend``)::
+
+    python bench/bench_serialization.py --rows 100 250 --iterations 2000
+
+For a markets page of ``--rows`` coins it times:
+
+- encoding with the standard library (what ``jsonify`` did) and with orjson;
+- a shared-cache hit, which used to decode the stored JSON and encode it again
+  and now hands the stored bytes back as they are;
+- gzip (and brotli when installed) per request against the per-ETag
+  compressed cache.
+
+It then serves the same page through the Flask test client, plain, gzipped
+and as a ``304`` revalidation, against a throwaway SQLite database. Those
+timings are mostly Flask's own per-request work; what gzip and ``304`` save
+is bytes on the wire.
+"""
+from datetime import datetime
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'serialization.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import serialization
+
+
+def make_rows(count, rng):
+    now = datetime.utcnow().isoformat()
+    return [{
+        'id': f'coin-{rank}',
+        'symbol': f'c{rank}',
+        'name': f'Coin {rank}',
+        'image': f'https://assets.coingecko.com/coins/images/{rank}/large/coin-{rank}.png',
+        'current_price': round(rng.uniform(0.01, 50000), 6),
+        'market_cap': rng.uniform(1e6, 1e12),
+        'market_cap_rank': rank,
+        'total_volume': rng.uniform(1e4, 1e10),
+        'price_change_percentage_24h': rng.uniform(-20, 20),
+        'last_updated': now
+    } for rank in range(1, count + 1)]
+
+
+def per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return (time.perf_counter() - started) / iterations * 1e6, result
+
+
+def stdlib_dumps(obj):
+    # Flask's default provider: sorted keys, compact separators.
+    return json.dumps(obj, default=serialization._default, sort_keys=True, separators=(',', ':')).encode()
+
+
+def micro(rows, iterations):
+    print(f'{"":<36} {"bytes":>8} {"us":>9}')
+
+    def report(label, fn):
+        us, body = per_call(fn, iterations)
+        print(f'{label:<36} {len(body):>8} {us:>9.1f}')
+        return body
+
+    stored = stdlib_dumps(rows)
+    report('encode, json (before)', lambda: stdlib_dumps(rows))
+    body = report('encode, orjson', lambda: serialization.dumps(rows))
+    report('cache hit, decode + encode (before)', lambda: stdlib_dumps(json.loads(stored)))
+    report('cache hit, stored bytes', lambda: body)
+
+    etag = serialization.etag_for(body)
+    cache = serialization.CompressedCache()
+    for encoding in serialization.ENCODINGS:
+        report(f'{encoding}, every request', lambda: serialization.compress(body, encoding))
+        report(f'{encoding}, compressed cache', lambda: cache.get(etag, encoding, body))
+    print(f'{"304 Not Modified":<36} {0:>8} {"-":>9}')
+
+
+def seed(count, rng):
+    from database import db
+    from models import Cryptocurrency
+
+    now = datetime.utcnow()
+    db.session.add_all(Cryptocurrency(
+        symbol=row['symbol'].upper(), name=row['name'], coingecko_id=row['id'], image=row['image'],
+        current_price=row['current_price'], market_cap=row['market_cap'], market_cap_rank=row['market_cap_rank'],
+        volume_24h=row['total_volume'], price_change_24h=row['price_change_percentage_24h'], last_updated=now
+    ) for row in make_rows(count, rng))
+    db.session.commit()
+
+
+def end_to_end(app, rows, iterations):
+    client = app.test_client()
+    url = f'/api/gecko/markets?per_page={rows}'
+    etag = client.get(url).headers['ETag']
+    print(f'{"GET " + url:<36} {"bytes":>8} {"us":>9}')
+    variants = [('identity', {})]
+    variants += [(encoding, {'Accept-Encoding': encoding}) for encoding in serialization.ENCODINGS]
+    variants.append(('If-None-Match', {'If-None-Match': etag}))
+    for label, headers in variants:
+        per_call(lambda: client.get(url, headers=headers), iterations // 10 + 1)
+        us, response = per_call(lambda: client.get(url, headers=headers), iterations)
+        print(f'{label:<36} {len(response.data):>8} {us:>9.1f}  ({response.status_code})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 250])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import upgrade_db
+
+    print(f'orjson: {"yes" if serialization.orjson is not None else "no"}, encodings: {", ".join(serialization.ENCODINGS)}')
+    rng = random.Random(args.seed)
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+        seed(max(args.rows), rng)
+    for rows in args.rows:
+        print(f'\n{rows} rows')
+        micro(make_rows(rows, rng), args.iterations)
+        print()
+        end_to_end(app, rows, args.iterations)
+
+
+if __name__ == '__main__':
+    main()
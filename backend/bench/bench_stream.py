@@ -0,0 +1,85 @@
+"""Measure broker fan-out: publish rate, delivery latency and slow-consumer buffering.
+
+Usage (from ``backend``)::
+
+    python bench/bench_stream.py --subscribers 2000 --events 500
+
+Events are published at ``--rate`` per second. Every subscriber listens to
+``prices``; a fraction of them never read, to show that their buffers stay
+bounded (conflated to one pending delta) while fast readers keep receiving
+updates.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--coins', type=int, default=100, help='coins changed per price event')
+    parser.add_argument('--slow', type=float, default=0.1, help='fraction of subscribers that never read')
+    parser.add_argument('--batch-interval', type=float, default=0.25,
+                        help='pause after each delivered batch, like STREAM_BATCH_INTERVAL')
+    parser.add_argument('--rate', type=float, default=50, help='price events published per second')
+    args = parser.parse_args()
+
+    from stream import Broker
+
+    broker = Broker(max_subscribers=args.subscribers + 1)
+    n_slow = int(args.subscribers * args.slow)
+    fast = [broker.subscribe(['prices']) for _ in range(args.subscribers - n_slow)]
+    slow = [broker.subscribe(['prices']) for _ in range(n_slow)]
+
+    latencies = []
+    received = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def reader(subscription):
+        while not done.is_set():
+            events = subscription.drain(0.5)
+            for _, _, _, data in events:
+                with lock:
+                    latencies.append(time.perf_counter() - data['sent_at'])
+                    received[0] += 1
+            if events and args.batch_interval:
+                time.sleep(args.batch_interval)
+
+    threads = [threading.Thread(target=reader, args=(s,), daemon=True) for s in fast]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    publish_time = 0.0
+    for i in range(args.events):
+        changes = {f'coin-{c}': i + c / 1000 for c in range(args.coins)}
+        changes['sent_at'] = time.perf_counter()
+        sent = time.perf_counter()
+        broker.publish('prices', 'prices', changes)
+        publish_time += time.perf_counter() - sent
+        time.sleep(max(0.0, start + (i + 1) / args.rate - time.perf_counter()))
+    time.sleep(1)
+    done.set()
+
+    pending = [len(s._pending) for s in slow]
+    print(f'{args.subscribers} subscribers ({n_slow} never read), {args.events} events x {args.coins} coins')
+    print(f'publish: {publish_time / args.events * 1000:.1f} ms per event '
+          f'({publish_time / args.events / args.subscribers * 1e6:.2f} us per delivery) at {args.rate:g} events/s')
+    if latencies:
+        latencies.sort()
+        print(f'delivered {received[0]} conflated events to fast readers; latency '
+              f'p50 {statistics.median(latencies) * 1000:.1f} ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+    if pending:
+        print(f'slow readers: max {max(pending)} pending event(s) each')
+
+
+if __name__ == '__main__':
+    main()
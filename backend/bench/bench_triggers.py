@@ -0,0 +1,94 @@
+"""Compare firing stop and take-profit orders from the sorted trigger index against scanning them all.
+
+Usage (from ``backend``)::
+
+    python bench/bench_triggers.py --pending 10000 100000 1000000 --updates 2000
+
+``--pending`` orders spread over ``--coins`` coins wait on trigger prices
+within 20% of a starting price of 100. Each coin then follows a random walk
+of small moves for ``--updates`` price updates in total. Both approaches must
+fire the same orders; the scan checks every pending order of the updated
+coin, which is what polling the orders table on each tick amounts to.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from triggers import STOP, TAKE_PROFIT, TriggerEngine, is_crossed
+
+SCALE = 10 ** 8
+
+
+def make_orders(count, coins, rng):
+    orders = []
+    for order_id in range(1, count + 1):
+        trigger = int(rng.uniform(80, 120) * SCALE)
+        side = rng.choice(('buy', 'sell'))
+        # Only orders that are not already crossed at the starting price of 100 can be placed.
+        kind = STOP if (side == 'sell') == (trigger < 100 * SCALE) else TAKE_PROFIT
+        orders.append((order_id, f'coin-{rng.randrange(coins)}', side, kind, trigger))
+    return orders
+
+
+def make_updates(count, coins, rng):
+    prices = {f'coin-{i}': 100 * SCALE for i in range(coins)}
+    updates = []
+    for _ in range(count):
+        coin = f'coin-{rng.randrange(coins)}'
+        prices[coin] = int(prices[coin] * rng.uniform(0.995, 1.005))
+        updates.append((coin, prices[coin]))
+    return updates
+
+
+def run_index(orders, updates):
+    engine = TriggerEngine()
+    for order in orders:
+        engine.add(*order)
+    start = time.perf_counter()
+    fired = [engine.crossed(coin, price) for coin, price in updates]
+    return time.perf_counter() - start, fired
+
+
+def run_scan(orders, updates):
+    pending = {}
+    for order_id, coin, side, kind, trigger in orders:
+        pending.setdefault(coin, {})[order_id] = (side, kind, trigger)
+    start = time.perf_counter()
+    fired = []
+    for coin, price in updates:
+        waiting = pending.get(coin, {})
+        crossed = [order_id for order_id, (side, kind, trigger) in waiting.items()
+                   if is_crossed(side, kind, trigger, price)]
+        for order_id in crossed:
+            del waiting[order_id]
+        fired.append(crossed)
+    return time.perf_counter() - start, fired
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pending', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--coins', type=int, default=50)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f'{"pending":>9} {"fired":>8} {"index ms":>10} {"scan ms":>10} {"us/update":>10} {"speedup":>8}')
+    for count in args.pending:
+        rng = random.Random(args.seed)
+        orders = make_orders(count, args.coins, rng)
+        updates = make_updates(args.updates, args.coins, rng)
+        index_seconds, index_fired = run_index(orders, updates)
+        scan_seconds, scan_fired = run_scan(orders, updates)
+        assert [sorted(ids) for ids in index_fired] == [sorted(ids) for ids in scan_fired]
+        fired = sum(len(ids) for ids in index_fired)
+        print(f'{count:>9} {fired:>8} {index_seconds * 1000:>10.1f} {scan_seconds * 1000:>10.1f} '
+              f'{index_seconds / len(updates) * 1e6:>10.1f} {scan_seconds / index_seconds:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Time a full "value every account" pass (the leaderboard computation).
+
+Usage (from ``backend``)::
+
+    python bench/bench_valuation.py --users 100000 --holdings 5 --coins 250
+    DATABASE_URL=postgresql://... python bench/bench_valuation.py
+
+Seeds synthetic users with random positions, then runs the vectorized
+valuator and, for comparison, the per-user ORM loop the portfolio endpoint
+used to run on a sample of accounts.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'valuation.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+
+
+def seed(n_users, per_user, n_coins, rng):
+    from database import db
+    from models import User, Cryptocurrency, Holdings
+
+    db.session.execute(Cryptocurrency.__table__.insert(), [{
+        'id': i + 1, 'coingecko_id': f'coin-{i}', 'symbol': f'C{i}', 'name': f'Coin {i}',
+        'current_price': rng.uniform(0.01, 50000)
+    } for i in range(n_coins)])
+    db.session.execute(User.__table__.insert(), [{
+        'id': i + 1, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': '-',
+        'balance_usd': rng.uniform(0, 10000), 'realized_pnl': 0.0
+    } for i in range(n_users)])
+    rows = []
+    for user_id in range(1, n_users + 1):
+        for crypto_id in rng.sample(range(1, n_coins + 1), per_user):
+            amount = rng.uniform(0.001, 10)
+            rows.append({'user_id': user_id, 'crypto_id': crypto_id, 'amount': amount,
+                         'cost_basis': amount * rng.uniform(0.01, 50000)})
+    db.session.execute(Holdings.__table__.insert(), rows)
+    db.session.commit()
+
+
+def per_user_loop(user_ids):
+    from models import Holdings
+
+    totals = {}
+    for user_id in user_ids:
+        positions = Holdings.query.filter_by(user_id=user_id).all()
+        totals[user_id] = sum(float(h.amount) * (h.cryptocurrency.current_price or 0) for h in positions)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--holdings', type=int, default=5, help='positions per user')
+    parser.add_argument('--coins', type=int, default=250)
+    parser.add_argument('--sample', type=int, default=1000, help='accounts valued by the per-user loop')
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import upgrade_db
+    from portfolio import PortfolioValuator
+
+    app = create_app(start_services=False)
+    rng = random.Random(42)
+    with app.app_context():
+        upgrade_db()
+        start = time.perf_counter()
+        seed(args.users, min(args.holdings, args.coins), args.coins, rng)
+        print(f'seeded {args.users} users x {args.holdings} holdings in {time.perf_counter() - start:.1f}s')
+
+        valuator = PortfolioValuator(max_age=0)
+        start = time.perf_counter()
+        board = valuator.leaderboard(10)
+        elapsed = time.perf_counter() - start
+        print(f'vectorized: {args.users} accounts in {elapsed * 1000:.0f} ms (leader {board[0]["username"]})')
+
+        sample = list(range(1, min(args.sample, args.users) + 1))
+        start = time.perf_counter()
+        per_user_loop(sample)
+        elapsed = time.perf_counter() - start
+        print(f'per-user loop: {len(sample)} accounts in {elapsed * 1000:.0f} ms '
+              f'(~{elapsed / len(sample) * args.users:.1f}s extrapolated to {args.users})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Measure requests/sec of the gunicorn deployment as workers are added.
+
+Usage (from ``backend``)::
+
+    python bench/load_workers.py --workers 1 2 4 8 --clients 32 --duration 15
+
+Seeds a database (a throwaway SQLite file unless ``DATABASE_URL`` is set),
+then for each worker count boots ``gunicorn -c gunicorn.conf.py wsgi:app`` and
+drives a read-heavy mix (order listing, order book depth, portfolio) from
+``--clients`` threads with keep-alive sessions.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import requests
+
+
+def seed(n_users, n_orders):
+    from app import create_app
+    from database import db, upgrade_db
+    from models import User, Cryptocurrency, Order
+    from flask_jwt_extended import create_access_token
+
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+        crypto = Cryptocurrency(coingecko_id='bitcoin', symbol='BTC', name='Bitcoin', current_price=100.0)
+        db.session.add(crypto)
+        users = []
+        for i in range(n_users):
+            user = User(username=f'load{i}', email=f'load{i}@example.com', password_hash='x')
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        for i in range(n_orders):
+            db.session.add(Order(
+                user_id=users[i % n_users].id,
+                crypto_id=crypto.id,
+                quantity=1.0,
+                filled_quantity=0.0,
+                price=100.0 + (i % 50) * (1 if i % 2 else -1),
+                order_type='sell' if i % 2 else 'buy'
+            ))
+        db.session.commit()
+        return [create_access_token(identity=str(user.id)) for user in users]
+
+
+def wait_ready(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/orders/book/bitcoin', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('gunicorn did not become ready')
+
+
+def client_loop(base_url, token, deadline):
+    session = requests.Session()
+    session.headers['Authorization'] = f'Bearer {token}'
+    paths = ['/api/orders?limit=50', '/api/orders/book/bitcoin', '/api/portfolio']
+    done = errors = 0
+    while time.time() < deadline:
+        response = session.get(base_url + paths[done % len(paths)])
+        done += 1
+        if response.status_code != 200:
+            errors += 1
+    return done, errors
+
+
+def run(workers, threads, clients, duration, tokens, port):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               PORT=str(port), RUN_MIGRATIONS='0', GUNICORN_ACCESS_LOG='', ALLOW_MULTIPLE_WORKERS='1')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(base_url)
+        deadline = time.time() + duration
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(lambda i: client_loop(base_url, tokens[i % len(tokens)], deadline), range(clients)))
+    finally:
+        server.terminate()
+        server.wait()
+    total = sum(done for done, _ in results)
+    errors = sum(err for _, err in results)
+    return total / duration, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    tokens = seed(args.users, args.orders)
+    baseline = None
+    print(f'{"workers":>8} {"req/s":>10} {"speedup":>8} {"errors":>7}')
+    for workers in args.workers:
+        rps, errors = run(workers, args.threads, args.clients, args.duration, tokens, args.port)
+        baseline = baseline or rps
+        print(f'{workers:>8} {rps:>10.1f} {rps / baseline:>7.2f}x {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""Reproducible mixed-workload load test with per-endpoint latency percentiles.
+
+Usage (from ``backend``)::
+
+    python bench/loadtest.py --clients 32 --duration 30 --output run.json
+    python bench/loadtest.py --compare run.json --output new.json
+    DATABASE_URL=postgresql://... python bench/loadtest.py --workers 1 --threads 16
+
+Boots ``gunicorn -c gunicorn.conf.py wsgi:app`` against a fresh database (a
+throwaway SQLite file unless ``DATABASE_URL`` is set). CoinGecko is replaced
+by ``stub_coingecko`` running in this process, by ``--upstream URL``, or by
+a recording made with ``MARKET_RECORD_PATH`` (``--replay FILE``), which the
+server plays back itself and the harness takes its coins and prices from. The
+harness seeds ``--users`` accounts with balances and positions in
+``--traded-coins`` coins, and rests ``--orders`` non-crossing orders through
+the batch endpoint. ``--clients`` threads then replay a weighted mix of
+operations (``--mix name=weight,...``) for ``--duration`` seconds after
+``--warmup``.
+
+Every operation reports its count, throughput, 2xx/4xx/error split and
+p50/p90/p99/max latency. ``--output`` writes the same numbers as JSON, along
+with the run parameters and git revision. ``--compare`` checks a baseline
+file and exits with status 1 when any endpoint's p99 grew, or its
+throughput fell, by more than ``--tolerance``. The random stream is fixed by
+``--seed``, so every client replays the same operation sequence on each run.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loadtest.db'))
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import requests
+import stub_coingecko
+from market_store import FrameFile
+
+PASSWORD = 'loadtest-password'
+
+DEFAULT_MIX = {
+    'portfolio': 15, 'markets': 15, 'book': 10, 'orders_list': 10, 'transactions': 5, 'candles': 3,
+    'buy': 10, 'sell': 8, 'order_create': 12, 'order_execute': 5, 'login': 5, 'register': 2
+}
+
+
+class RecordedMarket:
+    """Coins and prices from the first frame of a recording, shaped like ``StubMarket``."""
+
+    def __init__(self, path):
+        frames = FrameFile(path)
+        try:
+            self.coins = frames.frame(0).coins
+        finally:
+            frames.close()
+
+    def ids(self):
+        return [coin['id'] for coin in self.coins]
+
+    def price(self, index):
+        return self.coins[index]['current_price']
+
+    def market(self, index):
+        return self.coins[index]
+
+
+def seed_database(n_users, market, traded, balance):
+    """Users, coins and positions straight into the database; returns ``[(user_id, username, token)]``."""
+    from app import create_app
+    from database import db, upgrade_db
+    from models import User, Cryptocurrency, Holdings
+    from werkzeug.security import generate_password_hash
+    from flask_jwt_extended import create_access_token
+
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+        db.session.execute(Cryptocurrency.__table__.insert(), [{
+            'coingecko_id': coin['id'], 'symbol': coin['symbol'].upper(), 'name': coin['name']
+        } for coin in map(market.market, range(len(market.ids())))])
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(User.__table__.insert(), [{
+            'username': f'load{i}', 'email': f'load{i}@example.com', 'password_hash': password_hash,
+            'balance_usd': balance, 'realized_pnl': 0, 'locked_usd': 0
+        } for i in range(n_users)])
+        users = db.session.query(User.id, User.username).order_by(User.id).all()
+        coin_ids = [row.id for row in db.session.query(Cryptocurrency.id).order_by(Cryptocurrency.id).limit(traded)]
+        db.session.execute(Holdings.__table__.insert(), [{
+            'user_id': user.id, 'crypto_id': crypto_id, 'amount': 1000, 'cost_basis': 0, 'locked_amount': 0
+        } for user in users for crypto_id in coin_ids])
+        db.session.commit()
+        return [(user.id, user.username, create_access_token(identity=str(user.id))) for user in users]
+
+
+def seed_orders(base_url, users, market, traded, n_orders, rng):
+    """Rest non-crossing orders around each coin's price through the batch endpoint."""
+    coin_ids = market.ids()
+    per_user = {}
+    for i in range(n_orders):
+        index = rng.randrange(traded)
+        side = 'buy' if i % 2 else 'sell'
+        offset = 0.002 * (1 + rng.randrange(50))
+        price = market.price(index) * (1 - offset if side == 'buy' else 1 + offset)
+        per_user.setdefault(i % len(users), []).append({
+            'action': 'create', 'crypto_id': coin_ids[index], 'order_type': side,
+            'quantity': round(rng.uniform(0.01, 1), 4), 'price': round(price, 8)
+        })
+    for user_index, operations in per_user.items():
+        headers = {'Authorization': f'Bearer {users[user_index][2]}'}
+        for start in range(0, len(operations), 200):
+            response = requests.post(f'{base_url}/api/orders/batch', json={'operations': operations[start:start + 200]},
+                                     headers=headers, timeout=60)
+            response.raise_for_status()
+
+
+class Client:
+    """One simulated user: a keep-alive session and a seeded random stream."""
+
+    def __init__(self, base_url, user, market, traded, rng, run_id, number):
+        self.base_url = base_url
+        self.user_id, self.username, token = user
+        self.market = market
+        self.coin_ids = market.ids()
+        self.traded = traded
+        self.rng = rng
+        self.run_id = run_id
+        self.number = number
+        self.registrations = itertools.count()
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def coin(self):
+        index = self.rng.randrange(self.traded)
+        return index, self.coin_ids[index]
+
+    def get(self, path):
+        return self.session.get(self.base_url + path, timeout=30)
+
+    def post(self, path, body):
+        return self.session.post(self.base_url + path, json=body, timeout=30)
+
+    def portfolio(self):
+        return self.get('/api/portfolio')
+
+    def markets(self):
+        return self.get('/api/gecko/markets?per_page=100')
+
+    def book(self):
+        return self.get(f'/api/orders/book/{self.coin()[1]}')
+
+    def orders_list(self):
+        return self.get(f'/api/orders?crypto_id={self.coin()[1]}&limit=50')
+
+    def transactions(self):
+        return self.get('/api/transactions?limit=50')
+
+    def candles(self):
+        return self.get(f'/api/candles/{self.coin()[1]}?interval=1m')
+
+    def buy(self):
+        index, coin_id = self.coin()
+        return self.post('/api/buy', {'coingecko_id': coin_id, 'amount': round(50 / self.market.price(index), 8)})
+
+    def sell(self):
+        index, coin_id = self.coin()
+        return self.post('/api/sell', {'coingecko_id': coin_id, 'amount': round(40 / self.market.price(index), 8)})
+
+    def order_create(self):
+        index, coin_id = self.coin()
+        side = self.rng.choice(['buy', 'sell'])
+        # Mostly resting orders, about one in five crossing the spread.
+        offset = self.rng.uniform(-0.002, 0.01)
+        price = self.market.price(index) * (1 - offset if side == 'buy' else 1 + offset)
+        return self.post('/api/orders', {
+            'crypto_id': coin_id, 'order_type': side,
+            'quantity': round(self.rng.uniform(0.01, 0.5), 4), 'price': round(price, 8)
+        })
+
+    def order_execute(self):
+        # Timed together with the listing it picks from, as the frontend does.
+        listing = self.get(f'/api/orders?crypto_id={self.coin()[1]}&order_type=sell&limit=20').json()
+        candidates = [order['id'] for order in listing if order['user'] != self.username]
+        if not candidates:
+            return None
+        return self.post(f'/api/orders/{self.rng.choice(candidates)}/execute', {})
+
+    def login(self):
+        return requests.post(self.base_url + '/api/login', json={'username': self.username, 'password': PASSWORD},
+                             timeout=30)
+
+    def register(self):
+        name = f'new-{self.run_id}-{self.number}-{next(self.registrations)}'
+        return requests.post(self.base_url + '/api/register', json={
+            'username': name, 'email': f'{name}@example.com', 'password': PASSWORD
+        }, timeout=30)
+
+
+def client_loop(client, mix, warmup_until, deadline):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    while True:
+        name = client.rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            response = getattr(client, name)()
+            status = response.status_code if response is not None else None
+        except requests.RequestException:
+            status = 'error'
+        finished = time.perf_counter()
+        now = time.time()
+        if now >= deadline:
+            return samples
+        if status is not None and now >= warmup_until:
+            samples[name].append((finished - started, status))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(samples, duration):
+    """Per-operation counts, rates and latency percentiles in milliseconds."""
+    def stats(entries):
+        latencies = sorted(latency * 1000 for latency, _ in entries)
+        ok = sum(1 for _, status in entries if status != 'error' and status < 400)
+        rejected = sum(1 for _, status in entries if status != 'error' and 400 <= status < 500)
+        return {
+            'count': len(entries),
+            'rps': round(len(entries) / duration, 2),
+            'ok': ok,
+            'rejected': rejected,
+            'errors': len(entries) - ok - rejected,
+            'p50_ms': percentile(latencies, 0.50),
+            'p90_ms': percentile(latencies, 0.90),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1] if latencies else None
+        }
+
+    endpoints = {name: stats(entries) for name, entries in sorted(samples.items()) if entries}
+    endpoints['total'] = stats([entry for entries in samples.values() for entry in entries])
+    return endpoints
+
+
+def print_table(endpoints):
+    print(f'{"operation":>14} {"count":>7} {"req/s":>8} {"ok":>6} {"4xx":>5} {"err":>4} '
+          f'{"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name, row in endpoints.items():
+        print(f'{name:>14} {row["count"]:>7} {row["rps"]:>8.1f} {row["ok"]:>6} {row["rejected"]:>5} {row["errors"]:>4} '
+              f'{row["p50_ms"]:>8.1f} {row["p90_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {row["max_ms"]:>8.1f}')
+
+
+def compare(baseline, endpoints, mix, tolerance):
+    """Print changes against a baseline run; returns the operations that regressed."""
+    regressions = []
+    if baseline['meta'].get('mix') != mix:
+        print('\nnote: the baseline ran a different operation mix; totals are not comparable')
+    print(f'\n{"operation":>14} {"req/s":>16} {"p99 ms":>18}')
+    for name, row in endpoints.items():
+        old = baseline['endpoints'].get(name)
+        if not old:
+            continue
+        rps_change = row['rps'] / old['rps'] - 1 if old['rps'] else 0
+        p99_change = row['p99_ms'] / old['p99_ms'] - 1 if old['p99_ms'] else 0
+        flag = ''
+        if rps_change < -tolerance or p99_change > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:>14} {old["rps"]:>7.1f} {rps_change:>+7.0%} {old["p99_ms"]:>8.1f} {p99_change:>+8.0%}{flag}')
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_ready(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/prices/cache', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('gunicorn did not become ready')
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    if value:
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            if not hasattr(Client, name):
+                raise SystemExit(f'unknown operation {name!r}; choose from {", ".join(DEFAULT_MIX)}')
+            mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds run before measuring')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--coins', type=int, default=250)
+    parser.add_argument('--traded-coins', type=int, default=5)
+    parser.add_argument('--orders', type=int, default=2000, help='resting orders seeded before the run')
+    parser.add_argument('--balance', type=float, default=1000000.0)
+    parser.add_argument('--mix', help='comma-separated name=weight pairs; default: ' +
+                        ','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()))
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=5066)
+    parser.add_argument('--upstream', help='CoinGecko-compatible base URL instead of the in-process stub')
+    parser.add_argument('--replay', help='recorded market data file the server replays instead of calling CoinGecko')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='seconds the stub waits per response')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier --output')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change before a regression')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    env = dict(os.environ, WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+               PORT=str(args.port), GUNICORN_ACCESS_LOG='', ALLOW_MULTIPLE_WORKERS='1')
+    if args.replay:
+        market = RecordedMarket(args.replay)
+        env['UPSTREAM_REPLAY_PATH'] = os.path.abspath(args.replay)
+    else:
+        market = stub_coingecko.StubMarket(args.coins, args.seed, latency=args.upstream_latency)
+        upstream = args.upstream
+        if not upstream:
+            _, upstream = stub_coingecko.start(market)
+        env['COINGECKO_API_URL'] = upstream
+    traded = min(args.traded_coins, len(market.ids()))
+
+    users = seed_database(args.users, market, traded, args.balance)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        wait_ready(base_url)
+        seed_orders(base_url, users, market, traded, args.orders, random.Random(args.seed))
+        run_id = f'{args.seed}-{int(time.time())}'
+        clients = [Client(base_url, users[i % len(users)], market, traded, random.Random(args.seed + i), run_id, i)
+                   for i in range(args.clients)]
+        warmup_until = time.time() + args.warmup
+        deadline = warmup_until + args.duration
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(lambda client: client_loop(client, mix, warmup_until, deadline), clients))
+    finally:
+        server.terminate()
+        server.wait()
+
+    samples = {name: [entry for result in results for entry in result[name]] for name in mix}
+    endpoints = summarize(samples, args.duration)
+    print_table(endpoints)
+
+    report = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+            'python': platform.python_version(),
+            'args': vars(args),
+            'mix': mix
+        },
+        'endpoints': endpoints
+    }
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(json.load(handle), endpoints, mix, args.tolerance)
+        if regressions:
+            print(f'\nregressed beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Fake asynchronous replication between two SQLite files, for trying replica routing locally.
+
+Usage (from ``backend``)::
+
+    python bench/sqlite_replica.py /tmp/primary.db /tmp/replica.db --interval 2
+    DATABASE_URL=sqlite:////tmp/primary.db \\
+        DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db python app.py
+
+Copies the primary into the replica with SQLite's online backup API every
+``--interval`` seconds, so the replica lags by up to that long. Keep
+``REPLICA_STICKY_SECONDS`` above the interval for read-your-writes to hold.
+``--once`` copies a single time and exits.
+"""
+import argparse
+import sqlite3
+import time
+
+
+def copy(primary_path, replica_path):
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('primary')
+    parser.add_argument('replica')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between copies')
+    parser.add_argument('--once', action='store_true')
+    args = parser.parse_args()
+
+    while True:
+        started = time.perf_counter()
+        copy(args.primary, args.replica)
+        if args.once:
+            return
+        print(f'replicated in {(time.perf_counter() - started) * 1000:.1f} ms')
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Fire thousands of concurrent trades at the API and check that money is conserved.
+
+Usage (from ``backend``)::
+
+    python bench/stress_trades.py --threads 32 --trades 5000
+    DATABASE_URL=postgresql://... python bench/stress_trades.py
+
+Without ``DATABASE_URL`` a throwaway SQLite file is used. For every user the
+final balance must equal the initial balance adjusted by their Transaction
+rows, every position must equal net bought minus sold, nothing may go
+negative, no order may be filled beyond its quantity and the reserved
+balances must match what the active orders still hold back. Finally the
+trade journal, replayed from scratch and again from a fresh snapshot, must
+reproduce every balance, position and open order.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from decimal import Decimal
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'stress.db'))
+os.environ.setdefault('PRICE_REFRESH_ENABLED', '0')
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+COINS = {'bitcoin': ('BTC', 100.0), 'ethereum': ('ETH', 10.0), 'dogecoin': ('DOGE', 0.5)}
+INITIAL_BALANCE = Decimal('10000.00')
+
+
+def seed(app, n_users):
+    from database import db
+    from models import User, Cryptocurrency
+    from price_cache import price_cache
+    import journal
+
+    with app.app_context():
+        for gecko_id, (symbol, price) in COINS.items():
+            db.session.add(Cryptocurrency(coingecko_id=gecko_id, symbol=symbol, name=symbol, current_price=price))
+            price_cache.set(gecko_id, price)
+        users = []
+        for i in range(n_users):
+            user = User(username=f'stress{i}', email=f'stress{i}@example.com', balance_usd=INITIAL_BALANCE)
+            user.password_hash = 'x'
+            db.session.add(user)
+            users.append(user)
+        db.session.flush()
+        for user in users:
+            journal.record('deposit', user.id, usd=INITIAL_BALANCE)
+        db.session.commit()
+        return [user.id for user in users]
+
+
+def worker(app, user_ids, trades, seed_value):
+    from flask_jwt_extended import create_access_token
+
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    statuses = Counter()
+    with app.app_context():
+        tokens = {uid: create_access_token(identity=str(uid)) for uid in user_ids}
+
+    for _ in range(trades):
+        uid = rng.choice(user_ids)
+        headers = {'Authorization': f'Bearer {tokens[uid]}'}
+        gecko_id = rng.choice(list(COINS))
+        base_price = COINS[gecko_id][1]
+        action = rng.random()
+        if action < 0.35:
+            response = client.post('/api/buy', json={'coingecko_id': gecko_id, 'amount': rng.uniform(0.1, 5)}, headers=headers)
+        elif action < 0.6:
+            response = client.post('/api/sell', json={'coingecko_id': gecko_id, 'amount': rng.uniform(0.1, 5)}, headers=headers)
+        elif action < 0.85:
+            response = client.post('/api/orders', json={
+                'crypto_id': gecko_id,
+                'order_type': rng.choice(['buy', 'sell']),
+                'quantity': rng.uniform(0.1, 3),
+                'price': round(base_price * rng.uniform(0.95, 1.05), 2)
+            }, headers=headers)
+        elif action < 0.95:
+            listing = client.get(f'/api/orders?crypto_id={gecko_id}&order_type=sell&limit=5', headers=headers).get_json() or []
+            if not listing:
+                continue
+            response = client.post(f'/api/orders/{rng.choice(listing)["id"]}/execute', headers=headers)
+        else:
+            listing = client.get(f'/api/orders?crypto_id={gecko_id}&limit=50', headers=headers).get_json() or []
+            own = [order['id'] for order in listing if order['user'] == f'stress{user_ids.index(uid)}']
+            if not own:
+                continue
+            response = client.delete(f'/api/orders/{rng.choice(own)}', headers=headers)
+        statuses[(response.request.path.split('/')[2], response.status_code)] += 1
+    return statuses
+
+
+def verify(app, user_ids):
+    from database import db
+    from models import User, Holdings, Transaction, Order
+    from sqlalchemy import func
+    import journal
+    import money
+
+    errors = []
+    with app.app_context():
+        for user in User.query.filter(User.id.in_(user_ids)):
+            spent = db.session.query(func.coalesce(func.sum(Transaction.total_cost), 0)).filter_by(
+                user_id=user.id, transaction_type='buy').scalar()
+            earned = db.session.query(func.coalesce(func.sum(Transaction.total_cost), 0)).filter_by(
+                user_id=user.id, transaction_type='sell').scalar()
+            expected = INITIAL_BALANCE - spent + earned
+            if user.balance_usd != expected:
+                errors.append(f'user {user.id}: balance {user.balance_usd} != {expected}')
+            if user.balance_usd < 0:
+                errors.append(f'user {user.id}: negative balance {user.balance_usd}')
+
+        net = {}
+        for t in Transaction.query.filter(Transaction.user_id.in_(user_ids)):
+            sign = 1 if t.transaction_type == 'buy' else -1
+            key = (t.user_id, t.crypto_id)
+            net[key] = net.get(key, 0) + sign * t.amount
+        positions = {(h.user_id, h.crypto_id): h.amount for h in Holdings.query.filter(Holdings.user_id.in_(user_ids))}
+        for key in set(net) | set(positions):
+            if net.get(key, 0) != positions.get(key, 0):
+                errors.append(f'holding {key}: {positions.get(key, 0)} != {net.get(key, 0)}')
+            if positions.get(key, 0) <= 0:
+                errors.append(f'holding {key}: empty or negative position left behind')
+
+        locked_usd, locked_amounts = {}, {}
+        for order in Order.query.all():
+            if order.filled_quantity > order.quantity:
+                errors.append(f'order {order.id}: filled {order.filled_quantity} of {order.quantity}')
+            if not order.is_active:
+                continue
+            remaining = order.quantity - order.filled_quantity
+            if order.order_type == 'buy':
+                locked_usd[order.user_id] = locked_usd.get(order.user_id, 0) + money.reserved_notional(remaining, order.price)
+            else:
+                key = (order.user_id, order.crypto_id)
+                locked_amounts[key] = locked_amounts.get(key, 0) + remaining
+
+        for user in User.query.filter(User.id.in_(user_ids)):
+            if user.locked_usd != locked_usd.get(user.id, 0):
+                errors.append(f'user {user.id}: locked {user.locked_usd} != {locked_usd.get(user.id, 0)}')
+            if user.locked_usd > user.balance_usd:
+                errors.append(f'user {user.id}: locked {user.locked_usd} exceeds balance {user.balance_usd}')
+        for holding in Holdings.query.filter(Holdings.user_id.in_(user_ids)):
+            key = (holding.user_id, holding.crypto_id)
+            if holding.locked_amount != locked_amounts.pop(key, 0):
+                errors.append(f'holding {key}: locked {holding.locked_amount} does not match its sell orders')
+            if holding.locked_amount > holding.amount:
+                errors.append(f'holding {key}: locked {holding.locked_amount} exceeds {holding.amount}')
+        for key in locked_amounts:
+            errors.append(f'holding {key}: sell orders active without a position')
+
+        errors.extend(f'journal replay: {problem}' for problem in journal.audit())
+        journal.take_snapshot()
+        errors.extend(f'journal snapshot: {problem}' for problem in journal.audit())
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--trades', type=int, default=2000, help='total trades across all threads')
+    args = parser.parse_args()
+
+    from app import create_app
+    from database import upgrade_db
+
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+
+    user_ids = seed(app, args.users)
+    per_thread = args.trades // args.threads
+    totals = Counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for statuses in pool.map(lambda n: worker(app, user_ids, per_thread, n), range(args.threads)):
+            totals.update(statuses)
+
+    for (endpoint, status), count in sorted(totals.items()):
+        print(f'{endpoint:>8} {status}: {count}')
+
+    errors = verify(app, user_ids)
+    for error in errors:
+        print('FAIL', error)
+    print('conservation check:', 'FAILED' if errors else 'OK')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""A local stand-in for the CoinGecko endpoints the backend calls.
+
+Usage (from ``backend``)::
+
+    python bench/stub_coingecko.py --coins 250 --port 5099
+    COINGECKO_API_URL=http://127.0.0.1:5099 python app.py
+
+Serves ``/coins/markets``, ``/coins/<id>`` and ``/simple/price`` for coins
+``coin-0`` ... ``coin-<n-1>``. Prices follow a seeded random walk that
+advances once per ``--tick`` seconds, so runs are reproducible and no real
+rate limits are hit. ``--latency`` adds a fixed delay per response to mimic
+the real API.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import json
+import random
+import threading
+import time
+
+
+class StubMarket:
+    def __init__(self, coins=250, seed=42, tick=1.0, latency=0.0):
+        rng = random.Random(seed)
+        self.base = [rng.uniform(0.05, 50000) for _ in range(coins)]
+        self.seed = seed
+        self.tick = tick
+        self.latency = latency
+        self.started = time.monotonic()
+        self.requests = 0
+
+    def ids(self):
+        return [f'coin-{i}' for i in range(len(self.base))]
+
+    def price(self, index):
+        step = int((time.monotonic() - self.started) / self.tick) if self.tick else 0
+        drift = random.Random(self.seed * 1000003 + index * 7919 + step).uniform(-0.01, 0.01)
+        return round(self.base[index] * (1 + drift), 8)
+
+    def market(self, index):
+        price = self.price(index)
+        return {
+            'id': f'coin-{index}',
+            'symbol': f'c{index}',
+            'name': f'Coin {index}',
+            'image': f'https://example.com/coin-{index}.png',
+            'current_price': price,
+            'market_cap': price * 1e6,
+            'market_cap_rank': index + 1,
+            'total_volume': price * 1e4,
+            'price_change_percentage_24h': round((price / self.base[index] - 1) * 100, 4)
+        }
+
+    def handle(self, path, query):
+        """``(status, body)`` for one request."""
+        self.requests += 1
+        parts = path.strip('/').split('/')
+        if parts == ['coins', 'markets']:
+            page = int(query.get('page', ['1'])[0])
+            per_page = int(query.get('per_page', ['100'])[0])
+            start = (page - 1) * per_page
+            return 200, [self.market(i) for i in range(start, min(start + per_page, len(self.base)))]
+        if parts == ['simple', 'price']:
+            ids = query.get('ids', [''])[0].split(',')
+            return 200, {coin_id: {'usd': self.price(index)} for coin_id, index in self._indexes(ids)}
+        if len(parts) == 2 and parts[0] == 'coins':
+            found = list(self._indexes([parts[1]]))
+            if not found:
+                return 404, {'error': 'coin not found'}
+            market = self.market(found[0][1])
+            return 200, {
+                'id': market['id'],
+                'symbol': market['symbol'],
+                'name': market['name'],
+                'image': {'large': market['image']},
+                'description': {'en': ''},
+                'market_data': {
+                    'current_price': {'usd': market['current_price']},
+                    'market_cap': {'usd': market['market_cap']},
+                    'total_volume': {'usd': market['total_volume']},
+                    'price_change_percentage_24h': market['price_change_percentage_24h']
+                }
+            }
+        return 404, {'error': 'unknown endpoint'}
+
+    def _indexes(self, ids):
+        for coin_id in ids:
+            if coin_id.startswith('coin-') and coin_id[5:].isdigit() and int(coin_id[5:]) < len(self.base):
+                yield coin_id, int(coin_id[5:])
+
+
+def make_handler(market):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            status, body = market.handle(url.path, parse_qs(url.query))
+            if market.latency:
+                time.sleep(market.latency)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start(market, port=0):
+    """Serve ``market`` from a daemon thread; returns ``(server, base_url)``."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(market))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coins', type=int, default=250)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tick', type=float, default=1.0, help='seconds between price moves')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+
+    server, base_url = start(StubMarket(args.coins, args.seed, args.tick, args.latency), args.port)
+    print(f'serving {args.coins} coins at {base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
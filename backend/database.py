@@ -1,9 +1,160 @@
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from flask_migrate import Migrate, upgrade, stamp
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from contextlib import contextmanager
 from datetime import datetime
+import random
+import threading
+import time
+import os
 
-db = SQLAlchemy()
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+LAST_WRITE_COOKIE = 'last_write'
+
+
+class RoutingSession(Session):
+    """Sends plain reads to a replica inside ``replica_reads``; everything else to the primary.
+
+    Writes, ``SELECT ... FOR UPDATE`` and anything after the first write in
+    the session stay on the primary, so a request never reads around its own
+    uncommitted changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is not None and bind is None:
+            if self._flushing or self.info.get('wrote') or _is_write(clause):
+                self.info['wrote'] = True
+            else:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_write(clause):
+    if clause is None:
+        return False
+    return getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate(render_as_batch=True)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+BASELINE_REVISION = '0001_baseline'
 
 def init_db(app):
+    if REPLICA_URLS:
+        app.config.setdefault('SQLALCHEMY_BINDS', {}).update({
+            f'replica_{index}': url for index, url in enumerate(REPLICA_URLS)
+        })
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR)
+    if REPLICA_URLS:
+        app.after_request(_remember_write)
+
+
+class WriteTracker:
+    """When each user last changed data, so their next reads can skip lagging replicas.
+
+    Kept per process for users touched by a trade (including counterparties),
+    and echoed to the client in the ``last_write`` cookie so the guarantee
+    also holds when the next request lands on another worker.
+    """
+
+    def __init__(self, window=REPLICA_STICKY_SECONDS):
+        self.window = window
+        self._writes = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._writes[user_id] = now
+            if len(self._writes) > 10000:
+                self._writes = {uid: at for uid, at in self._writes.items() if now - at < self.window}
+
+    def recent(self, user_id):
+        now = time.time()
+        with self._lock:
+            last = self._writes.get(user_id, 0)
+        if has_request_context():
+            try:
+                last = max(last, float(request.cookies.get(LAST_WRITE_COOKIE, 0)))
+            except ValueError:
+                pass
+        return now - last < self.window
+
+
+write_tracker = WriteTracker()
+
+
+def _remember_write(response):
+    """Successful writes by an authenticated user pin their next reads to the primary."""
+    if request.method == 'GET' or response.status_code >= 400:
+        return response
+    try:
+        user_id = int(get_jwt_identity())
+    except (RuntimeError, TypeError, ValueError):
+        return response
+    write_tracker.mark(user_id)
+    response.set_cookie(LAST_WRITE_COOKIE, f'{time.time():.3f}', max_age=int(REPLICA_STICKY_SECONDS) + 1,
+                        httponly=True, samesite='Lax')
+    return response
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    """Route this block's reads to a random replica.
+
+    Falls through to the primary when no replica is configured, when
+    ``user_id`` wrote within ``REPLICA_STICKY_SECONDS`` (read-your-writes), or
+    outside a request, such as a cache entry refreshed in the background.
+    """
+    if not REPLICA_URLS or not has_request_context() or (user_id is not None and write_tracker.recent(user_id)):
+        yield
+        return
+    g.db_replica = db.engines[f'replica_{random.randrange(len(REPLICA_URLS))}']
+    try:
+        yield
+    finally:
+        g.db_replica = None
+
+def upgrade_db():
+    # Databases created by the old db.create_all() have the baseline tables but
+    # no alembic_version table; mark them as baseline before upgrading.
+    tables = inspect(db.engine).get_table_names()
+    if 'users' in tables and 'alembic_version' not in tables:
+        stamp(directory=MIGRATIONS_DIR, revision=BASELINE_REVISION)
+    upgrade(directory=MIGRATIONS_DIR)
+    check_schema()
+
+
+def check_schema():
+    """Refuse to run against a database missing tables or columns the models use.
+
+    A model change shipped without its migration otherwise only shows up as
+    failing queries once requests arrive.
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        missing.extend(f'{table.name}.{column.name}' for column in table.columns if column.name not in present)
+    if missing:
+        raise RuntimeError(f'Database schema is behind the models, missing {", ".join(missing)}; '
+                           'add a migration for them')
+
+def dialect_insert(table):
+    """INSERT construct supporting ``on_conflict_do_update`` for the bound dialect."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
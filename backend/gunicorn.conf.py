@@ -0,0 +1,75 @@
+import tempfile
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Order books, trigger orders and stream subscribers live in each worker's
+# memory: an order placed through one worker is never matched against a book
+# held by another. Scale with GUNICORN_WORKER_CONNECTIONS (or GUNICORN_THREADS
+# under GUNICORN_WORKER_CLASS=gthread); more workers are only allowed with
+# ALLOW_MULTIPLE_WORKERS=1, e.g. for read-only benchmarks.
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+if workers > 1 and os.environ.get('ALLOW_MULTIPLE_WORKERS', '0') != '1':
+    raise SystemExit(f'WEB_CONCURRENCY={workers}: the matching engine is per worker, so orders in different '
+                     'workers would never match. Run one worker, or set ALLOW_MULTIPLE_WORKERS=1.')
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# An open /api/stream connection holds whatever serves it until the client
+# leaves, so a few browser tabs would use up a threaded worker's threads. The
+# gevent worker serves every connection from a greenlet, up to
+# GUNICORN_WORKER_CONNECTIONS at once; GUNICORN_THREADS only applies to
+# GUNICORN_WORKER_CLASS=gthread.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+if worker_class == 'gevent':
+    # Patch before the app is imported, here in the master too (on_starting
+    # migrates), so every lock and socket it creates is cooperative, and let
+    # psycopg2 wait for the database without blocking the other greenlets.
+    from gevent import monkey
+    monkey.patch_all()
+    if os.environ.get('DATABASE_URL', 'postgresql:').startswith('postgres'):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+# Metrics are kept per worker; prometheus_client aggregates them for /metrics
+# from files in this directory. It has to be set before the app is imported.
+if workers > 1 and not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='prometheus-')
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Each worker opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections; keep
+# workers * (pool_size + max_overflow) below the database's max_connections.
+
+
+def on_starting(server):
+    """Apply migrations once in the master before any worker is forked."""
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        # Files left by a previous run would be added to this run's totals.
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(metrics_dir, name))
+
+    if os.environ.get('RUN_MIGRATIONS', '1') != '1':
+        return
+    from app import create_app
+    from database import db, upgrade_db
+
+    app = create_app(start_services=False)
+    with app.app_context():
+        upgrade_db()
+        db.engine.dispose()
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
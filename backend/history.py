@@ -0,0 +1,100 @@
+from database import db
+from models import Transaction, Cryptocurrency
+from sqlalchemy import select
+import csv
+import io
+import json
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_COLUMNS = ['id', 'date', 'type', 'crypto', 'amount', 'price', 'fee', 'total']
+EXPORT_BATCH_SIZE = 1000
+
+transactions = Transaction.__table__
+cryptocurrencies = Cryptocurrency.__table__
+
+
+def transaction_columns():
+    return (
+        transactions.c.id,
+        transactions.c.created_at,
+        transactions.c.transaction_type,
+        cryptocurrencies.c.symbol,
+        transactions.c.amount,
+        transactions.c.price_at_transaction,
+        transactions.c.fee,
+        transactions.c.total_cost
+    )
+
+
+def filter_transactions(statement, user_id, start=None, end=None, transaction_type=None, coingecko_id=None):
+    """Restrict to one user's transactions, optionally by date range, type and coin."""
+    statement = statement.join(cryptocurrencies, cryptocurrencies.c.id == transactions.c.crypto_id).where(
+        transactions.c.user_id == user_id
+    )
+    if start is not None:
+        statement = statement.where(transactions.c.created_at >= start)
+    if end is not None:
+        statement = statement.where(transactions.c.created_at <= end)
+    if transaction_type:
+        statement = statement.where(transactions.c.transaction_type == transaction_type)
+    if coingecko_id:
+        statement = statement.where(cryptocurrencies.c.coingecko_id == coingecko_id)
+    return statement
+
+
+def transaction_query(user_id, **filters):
+    """ORM query of the user's transactions with the coin symbol joined in (no lazy loads)."""
+    query = db.session.query(*transaction_columns()).select_from(transactions)
+    return filter_transactions(query, user_id, **filters)
+
+
+def transaction_dict(row):
+    return {
+        'id': row.id,
+        'type': row.transaction_type,
+        'crypto': row.symbol,
+        'amount': row.amount,
+        'price': row.price_at_transaction,
+        'fee': row.fee,
+        'total': row.total_cost,
+        'date': row.created_at.isoformat()
+    }
+
+
+def export_rows(user_id, **filters):
+    """Yield the user's matching transactions oldest first from a server-side cursor.
+
+    ``stream_results`` makes psycopg2 use a named cursor, so at most
+    ``EXPORT_BATCH_SIZE`` rows are held in memory regardless of history size.
+    """
+    statement = filter_transactions(select(*transaction_columns()), user_id, **filters).order_by(
+        transactions.c.created_at, transactions.c.id
+    )
+    result = db.session.execute(statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+    yield from result.partitions()
+
+
+def export_chunks(batches, fmt):
+    """Encode batches of transaction rows as CSV or NDJSON text chunks.
+
+    Amounts keep their exact decimal text in both formats: NDJSON writes
+    ``Decimal`` values as strings rather than rounding them through floats.
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(EXPORT_COLUMNS)
+        for batch in batches:
+            writer.writerows(
+                (row.id, row.created_at.isoformat(), row.transaction_type, row.symbol,
+                 row.amount, row.price_at_transaction, row.fee, row.total_cost)
+                for row in batch
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for batch in batches:
+            yield ''.join(json.dumps(transaction_dict(row), separators=(',', ':'), default=str) + '\n' for row in batch)
@@ -0,0 +1,326 @@
+"""Append-only journal of every balance, position and order change, with snapshots.
+
+The write primitives in ``trading.py``, order placement and sign-up call
+``record`` with the deltas they applied. Events are buffered on the session
+and written with one multi-row INSERT just before the transaction commits,
+so an event is durable exactly when the change it describes is, and a
+rolled-back or retried transaction leaves nothing behind. ``journal.id`` is
+the sequence number.
+
+A snapshot folds the events since the previous one into the balances,
+positions and open orders they add up to, and stores them compressed.
+``replay`` loads the newest snapshot and folds only the events after it, so
+recovering the ledger costs one snapshot plus a short tail however long the
+journal has grown. ``audit`` compares the replayed ledger with the live
+tables.
+"""
+from database import db, RoutingSession
+from models import JournalEvent, JournalSnapshot, User, Holdings, Order
+from money import USD_DECIMALS, QUANTITY_DECIMALS, PRICE_DECIMALS
+from sqlalchemy import delete, event, func, insert, or_, select, text
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_EVEN
+import threading
+import json
+import time
+import zlib
+import os
+
+SNAPSHOT_INTERVAL = float(os.environ.get('JOURNAL_SNAPSHOT_INTERVAL', '300'))
+SNAPSHOTS_KEPT = int(os.environ.get('JOURNAL_SNAPSHOTS_KEPT', '24'))
+
+PENDING = 'journal_pending'
+
+events = JournalEvent.__table__
+snapshots = JournalSnapshot.__table__
+users = User.__table__
+holdings = Holdings.__table__
+orders = Order.__table__
+
+_COLUMNS = [column.name for column in events.columns if column.name != 'id']
+
+OpenOrder = namedtuple('OpenOrder', ['id', 'user_id', 'crypto_id', 'order_type', 'kind', 'quantity',
+                                     'filled_quantity', 'price'])
+
+
+def record(name, user_id, **fields):
+    """Journal one change made by the current transaction; zero deltas are left out."""
+    row = dict.fromkeys(_COLUMNS)
+    row.update((column, value) for column, value in fields.items() if value)
+    row.update(event=name, user_id=user_id, created_at=datetime.utcnow())
+    db.session.info.setdefault(PENDING, []).append(row)
+
+
+def order_placed(order):
+    """Journal a new order; call after the flush that gave it an id."""
+    record('order_placed', order.user_id, crypto_id=order.crypto_id, order_id=order.id,
+           side=order.order_type, kind=order.kind, quantity=order.quantity, price=order.price)
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _write_pending(session):
+    rows = session.info.pop(PENDING, None)
+    if rows:
+        session.execute(insert(events), rows)
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING, None)
+
+
+def _exact(value, decimals):
+    # SQLite sums NUMERIC columns as floats; the ledger only ever holds whole minor units.
+    return Decimal(value).quantize(Decimal(1).scaleb(-decimals), ROUND_HALF_EVEN)
+
+
+def _add(current, delta, decimals):
+    return current if delta is None else _exact(current + delta, decimals)
+
+
+class LedgerState:
+    """Balances, positions and open orders as the journal describes them up to ``seq``.
+
+    ``users`` maps ``user_id -> [balance_usd, locked_usd, realized_pnl]``,
+    ``holdings`` maps ``(user_id, crypto_id) -> [amount, locked_amount,
+    cost_basis]`` and ``orders`` maps ``order_id -> [user_id, crypto_id,
+    side, kind, quantity, filled_quantity, price]`` in placement order.
+    """
+
+    def __init__(self, seq=0, users=None, holdings=None, orders=None):
+        self.seq = seq
+        self.users = users if users is not None else {}
+        self.holdings = holdings if holdings is not None else {}
+        self.orders = orders if orders is not None else {}
+
+    def apply(self, upto=None):
+        """Fold the committed events after ``seq`` up to ``upto`` (default: all); returns how many."""
+        if upto is None:
+            upto = db.session.execute(select(func.max(events.c.id))).scalar() or 0
+        if upto <= self.seq:
+            return 0
+        window = (events.c.id > self.seq, events.c.id <= upto)
+        count = db.session.execute(select(func.count()).select_from(events).where(*window)).scalar()
+
+        for row in db.session.execute(
+            select(events.c.user_id, func.sum(events.c.usd), func.sum(events.c.locked_usd), func.sum(events.c.pnl))
+            .where(*window).group_by(events.c.user_id)
+        ):
+            zero = _exact(0, USD_DECIMALS)
+            balances = self.users.setdefault(row[0], [zero, zero, zero])
+            for index, delta in enumerate(row[1:]):
+                balances[index] = _add(balances[index], delta, USD_DECIMALS)
+
+        for row in db.session.execute(
+            select(events.c.user_id, events.c.crypto_id, func.sum(events.c.amount),
+                   func.sum(events.c.locked_amount), func.sum(events.c.cost))
+            .where(*window, events.c.crypto_id.isnot(None),
+                   or_(events.c.amount.isnot(None), events.c.locked_amount.isnot(None), events.c.cost.isnot(None)))
+            .group_by(events.c.user_id, events.c.crypto_id)
+        ):
+            key = (row[0], row[1])
+            position = self.holdings.get(key) or [
+                _exact(0, QUANTITY_DECIMALS), _exact(0, QUANTITY_DECIMALS), _exact(0, USD_DECIMALS)
+            ]
+            position = [_add(position[0], row[2], QUANTITY_DECIMALS), _add(position[1], row[3], QUANTITY_DECIMALS),
+                        _add(position[2], row[4], USD_DECIMALS)]
+            # A fully sold position is deleted from holdings, so it leaves the ledger too.
+            if any(position):
+                self.holdings[key] = position
+            else:
+                self.holdings.pop(key, None)
+
+        for row in db.session.execute(
+            select(events.c.order_id, events.c.user_id, events.c.crypto_id, events.c.side, events.c.kind,
+                   events.c.quantity, events.c.price)
+            .where(*window, events.c.event == 'order_placed').order_by(events.c.id)
+        ):
+            self.orders[row.order_id] = [row.user_id, row.crypto_id, row.side, row.kind,
+                                         _exact(row.quantity, QUANTITY_DECIMALS), _exact(0, QUANTITY_DECIMALS),
+                                         _exact(row.price, PRICE_DECIMALS)]
+        for order_id, filled in db.session.execute(
+            select(events.c.order_id, func.sum(events.c.quantity))
+            .where(*window, events.c.event == 'order_filled').group_by(events.c.order_id)
+        ):
+            if order_id in self.orders:
+                self.orders[order_id][5] = _add(self.orders[order_id][5], filled, QUANTITY_DECIMALS)
+        for (order_id,) in db.session.execute(
+            select(events.c.order_id).where(*window, events.c.event == 'order_closed')
+        ):
+            self.orders.pop(order_id, None)
+
+        self.seq = upto
+        return count
+
+    def open_orders(self, kind=None):
+        """Open orders in placement order, shaped like ``Order`` rows for ``matching_engine.rebuild``."""
+        return [OpenOrder(order_id, *fields) for order_id, fields in self.orders.items()
+                if kind is None or fields[3] == kind]
+
+    def dumps(self):
+        return zlib.compress(json.dumps({
+            'users': [[user_id, *map(str, balances)] for user_id, balances in self.users.items()],
+            'holdings': [[*key, *map(str, position)] for key, position in self.holdings.items()],
+            'orders': [[order_id, *fields[:4], *map(str, fields[4:])] for order_id, fields in self.orders.items()]
+        }, separators=(',', ':')).encode())
+
+    @classmethod
+    def loads(cls, seq, blob):
+        data = json.loads(zlib.decompress(blob))
+        return cls(
+            seq,
+            {row[0]: list(map(Decimal, row[1:])) for row in data['users']},
+            {(row[0], row[1]): list(map(Decimal, row[2:])) for row in data['holdings']},
+            {row[0]: [*row[1:5], *map(Decimal, row[5:])] for row in data['orders']}
+        )
+
+
+def latest_snapshot(upto=None):
+    """The newest snapshot (at or before ``upto``) as a ``LedgerState``; an empty one if there is none."""
+    query = select(snapshots.c.last_seq, snapshots.c.state).order_by(snapshots.c.last_seq.desc()).limit(1)
+    if upto is not None:
+        query = query.where(snapshots.c.last_seq <= upto)
+    row = db.session.execute(query).first()
+    return LedgerState() if row is None else LedgerState.loads(row.last_seq, row.state)
+
+
+def replay(upto=None):
+    """Rebuild the ledger as of sequence number ``upto`` (default: now) from a snapshot and the tail."""
+    state = latest_snapshot(upto)
+    state.apply(upto)
+    return state
+
+
+def settled_seq():
+    """The highest sequence number at or below which no event can still be committed.
+
+    Sequence numbers are handed out at insert time, so a transaction that
+    inserted earlier may commit later. On PostgreSQL a SHARE lock waits for
+    every transaction that has written events and holds new writers back for
+    the instant it takes to read the maximum. SQLite has one writer at a time.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('LOCK TABLE journal IN SHARE MODE'))
+    seq = db.session.execute(select(func.max(events.c.id))).scalar() or 0
+    db.session.commit()
+    return seq
+
+
+def take_snapshot():
+    """Fold the settled events since the newest snapshot into a new one; ``None`` if there were none."""
+    upto = settled_seq()
+    state = latest_snapshot()
+    folded = state.apply(upto)
+    if not folded:
+        db.session.rollback()
+        return None
+    db.session.execute(insert(snapshots).values(
+        last_seq=state.seq, events=folded, state=state.dumps(), created_at=datetime.utcnow()
+    ))
+    stale = select(snapshots.c.id).order_by(snapshots.c.last_seq.desc()).offset(SNAPSHOTS_KEPT)
+    db.session.execute(delete(snapshots).where(snapshots.c.id.in_(stale.scalar_subquery())))
+    db.session.commit()
+    return state
+
+
+def audit():
+    """Every difference between the replayed ledger and the live tables; empty when they agree.
+
+    Runs in a transaction of its own; on PostgreSQL a repeatable-read one,
+    so the journal and the tables are read at the same instant.
+    """
+    db.session.rollback()
+    if db.engine.dialect.name == 'postgresql':
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    try:
+        state = replay()
+        problems = []
+        for row in db.session.execute(select(users.c.id, users.c.balance_usd, users.c.locked_usd, users.c.realized_pnl)):
+            expected = state.users.pop(row.id, None)
+            actual = [_exact(value or 0, USD_DECIMALS) for value in row[1:]]
+            if expected is None:
+                problems.append(f'user {row.id}: not in the journal')
+            elif actual != expected:
+                problems.append(f'user {row.id}: balance/locked/pnl {actual} != journal {expected}')
+        problems.extend(f'user {user_id}: in the journal but not in users' for user_id in state.users)
+
+        for row in db.session.execute(select(holdings.c.user_id, holdings.c.crypto_id, holdings.c.amount,
+                                             holdings.c.locked_amount, holdings.c.cost_basis)):
+            key = (row.user_id, row.crypto_id)
+            expected = state.holdings.pop(key, None)
+            actual = [_exact(row.amount, QUANTITY_DECIMALS), _exact(row.locked_amount, QUANTITY_DECIMALS),
+                      _exact(row.cost_basis, USD_DECIMALS)]
+            if expected is None:
+                problems.append(f'holding {key}: not in the journal')
+            elif actual != expected:
+                problems.append(f'holding {key}: amount/locked/cost {actual} != journal {expected}')
+        problems.extend(f'holding {key}: in the journal but not in holdings' for key in state.holdings)
+
+        for row in db.session.execute(select(orders.c.id, orders.c.filled_quantity).where(orders.c.is_active.is_(True))):
+            expected = state.orders.pop(row.id, None)
+            actual = _exact(row.filled_quantity, QUANTITY_DECIMALS)
+            if expected is None:
+                problems.append(f'order {row.id}: active but closed in the journal')
+            elif actual != expected[5]:
+                problems.append(f'order {row.id}: filled {actual} != journal {expected[5]}')
+        problems.extend(f'order {order_id}: open in the journal but not active' for order_id in state.orders)
+        return problems
+    finally:
+        db.session.rollback()
+
+
+class Snapshotter:
+    """Background job that takes a snapshot every ``JOURNAL_SNAPSHOT_INTERVAL`` seconds (``0`` disables it)."""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else SNAPSHOT_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.errors = 0
+        self.last_seq = None
+        self.last_duration = None
+
+    def start(self, app):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='journal-snapshotter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def due(self):
+        """Whether no worker has taken a snapshot for most of an interval."""
+        newest = db.session.execute(select(func.max(snapshots.c.created_at))).scalar()
+        return newest is None or (datetime.utcnow() - newest).total_seconds() >= self.interval / 2
+
+    def _run(self, app):
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    if self.due():
+                        started = time.perf_counter()
+                        state = take_snapshot()
+                        self.runs += 1
+                        self.last_duration = time.perf_counter() - started
+                        if state is not None:
+                            self.last_seq = state.seq
+                except Exception:
+                    self.errors += 1
+                    db.session.rollback()
+                    app.logger.exception('Journal snapshot failed')
+                finally:
+                    db.session.remove()
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_seq': self.last_seq,
+            'last_duration': self.last_duration
+        }
+
+
+snapshotter = Snapshotter()
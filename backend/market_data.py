@@ -0,0 +1,184 @@
+from database import db, dialect_insert
+from models import Cryptocurrency
+from price_cache import price_cache
+from upstream import coingecko
+from price_history import record_ticks
+from sqlalchemy import func
+from datetime import datetime
+import market_store
+import threading
+import os
+
+UPSERT_BATCH_SIZE = 500
+MAX_PER_PAGE = 250
+
+cryptocurrencies = Cryptocurrency.__table__
+
+
+def market_row(coin, now):
+    coingecko_id = coin.get('id')
+    symbol = (coin.get('symbol') or '').upper()
+    if not coingecko_id or not symbol:
+        return None
+    return {
+        'coingecko_id': coingecko_id,
+        'symbol': symbol[:10],
+        'name': coin.get('name') or '',
+        'image': coin.get('image'),
+        'current_price': coin.get('current_price'),
+        'market_cap': coin.get('market_cap'),
+        'market_cap_rank': coin.get('market_cap_rank'),
+        'volume_24h': coin.get('total_volume'),
+        'price_change_24h': coin.get('price_change_percentage_24h'),
+        'last_updated': now
+    }
+
+
+def upsert_markets(coins, fetched_at=None):
+    """Write a /coins/markets payload with one INSERT ... ON CONFLICT per batch.
+
+    Each batch is an executemany of one compiled statement (sent as multi-row
+    VALUES on psycopg2). Rows and price ticks are stamped ``fetched_at`` (now
+    by default). Does not commit, and leaves updating the price cache to the
+    caller once it has. Returns ``{coingecko_id: price}`` of the rows.
+    """
+    now = fetched_at or datetime.utcnow()
+    rows = {}
+    for coin in coins:
+        row = market_row(coin, now)
+        if row:
+            rows[row['coingecko_id']] = row
+    rows = list(rows.values())
+
+    stmt = dialect_insert(cryptocurrencies)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[cryptocurrencies.c.coingecko_id],
+        set_={
+            name: stmt.excluded[name]
+            for name in ('symbol', 'name', 'image', 'current_price', 'market_cap',
+                         'market_cap_rank', 'volume_24h', 'price_change_24h', 'last_updated')
+        }
+    )
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        db.session.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+
+    prices = {row['coingecko_id']: row['current_price'] for row in rows}
+    ids = db.session.query(Cryptocurrency.coingecko_id, Cryptocurrency.id).filter(
+        Cryptocurrency.coingecko_id.in_(list(prices))
+    ).all() if prices else []
+    record_ticks([(crypto_id, prices[gecko_id], 0.0) for gecko_id, crypto_id in ids], 'refresh', now)
+    return prices
+
+
+def ingest_markets(pages=None, per_page=MAX_PER_PAGE):
+    """Fetch and store /coins/markets page by page, then save what was fetched to disk."""
+    pages = pages or int(os.environ.get('MARKET_INGEST_PAGES', '1'))
+    fetched_at = datetime.utcnow()
+    fetched = []
+    total = 0
+    for page in range(1, pages + 1):
+        coins = coingecko.get_json('/coins/markets', params={
+            'vs_currency': 'usd',
+            'order': 'market_cap_desc',
+            'per_page': per_page,
+            'page': page,
+            'sparkline': 'false'
+        })
+        prices = upsert_markets(coins)
+        db.session.commit()
+        price_cache.set_many(prices)
+        total += len(prices)
+        fetched.extend(coins)
+        if len(coins) < per_page:
+            break
+    market_store.save(fetched, fetched_at)
+    return total
+
+
+def load_snapshot():
+    """Store the on-disk snapshot if it is newer than the stored markets; returns the coins loaded.
+
+    Rows keep the snapshot's fetch time, so prices from it are only traded at
+    while they are recent (see ``PriceCache.get_price``).
+    """
+    frame = market_store.read_snapshot()
+    if frame is None:
+        return 0
+    newest = db.session.query(func.max(Cryptocurrency.last_updated)).scalar()
+    if newest is not None and newest >= frame.fetched_at:
+        return 0
+    upsert_markets(frame.coins, frame.fetched_at)
+    db.session.commit()
+    return len(frame.coins)
+
+
+def market_snapshot(page=1, per_page=100):
+    """Stored market data in CoinGecko /coins/markets shape, ranked by market cap."""
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    cryptos = Cryptocurrency.query.filter(Cryptocurrency.current_price.isnot(None)).order_by(
+        Cryptocurrency.market_cap_rank.is_(None),
+        Cryptocurrency.market_cap_rank,
+        Cryptocurrency.market_cap.desc()
+    ).offset((page - 1) * per_page).limit(per_page).all()
+
+    return [{
+        'id': crypto.coingecko_id,
+        'symbol': crypto.symbol.lower(),
+        'name': crypto.name,
+        'image': crypto.image,
+        'current_price': crypto.current_price,
+        'market_cap': crypto.market_cap,
+        'market_cap_rank': crypto.market_cap_rank,
+        'total_volume': crypto.volume_24h,
+        'price_change_percentage_24h': crypto.price_change_24h,
+        'last_updated': crypto.last_updated.isoformat() if crypto.last_updated else None
+    } for crypto in cryptos]
+
+
+class MarketIngestor:
+    """Background job that pulls /coins/markets and bulk-upserts it on a schedule."""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else float(os.environ.get('MARKET_INGEST_INTERVAL', '60'))
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+        self.last_count = 0
+
+    def start(self, app):
+        if self._thread is not None or os.environ.get('MARKET_INGEST_ENABLED', '1') != '1':
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='market-ingestor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    self.last_count = ingest_markets()
+                    self.runs += 1
+                    self.last_run = datetime.utcnow()
+                except Exception:
+                    self.errors += 1
+                    db.session.rollback()
+                    app.logger.exception('Market ingestion failed')
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_count': self.last_count
+        }
+
+
+market_ingestor = MarketIngestor()
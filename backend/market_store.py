@@ -0,0 +1,113 @@
+"""Market data on disk: the startup snapshot and recordings of CoinGecko.
+
+Every ingestion run writes the ``/coins/markets`` rows it fetched to
+``MARKET_SNAPSHOT_PATH``, replacing the previous snapshot. With
+``MARKET_RECORD_PATH`` every run is also appended to a recording, which
+``UPSTREAM_REPLAY_PATH`` (see ``upstream.ReplayClient``) can play back
+later without network access. Nothing is written while replaying.
+
+A file is a sequence of frames. Each frame is a fixed header (magic, format
+version, fetch time, payload length) followed by the zlib-compressed JSON
+list of coins exactly as CoinGecko returned them. ``FrameFile`` maps a file
+into memory and indexes the frames, so a long recording is decompressed one
+frame at a time. Files of another format version are refused; a frame cut
+short by a crash at the end of a file is ignored.
+"""
+from serialization import dumps, loads
+from collections import namedtuple
+from datetime import datetime, timedelta
+import threading
+import struct
+import mmap
+import zlib
+import os
+
+MAGIC = b'CXMD'
+FORMAT_VERSION = 1
+SNAPSHOT_PATH = os.environ.get('MARKET_SNAPSHOT_PATH', '')
+RECORD_PATH = os.environ.get('MARKET_RECORD_PATH', '')
+REPLAY_PATH = os.environ.get('UPSTREAM_REPLAY_PATH', '')
+
+EPOCH = datetime(1970, 1, 1)
+_HEADER = struct.Struct('<4sHdI')
+
+Frame = namedtuple('Frame', ['fetched_at', 'coins'])
+
+
+class FormatError(ValueError):
+    """Not a market data file of this format version."""
+
+
+def encode_frame(coins, fetched_at):
+    payload = zlib.compress(dumps(coins))
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, (fetched_at - EPOCH).total_seconds(), len(payload)) + payload
+
+
+class FrameFile:
+    """The frames of a market data file, mapped read-only."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size < _HEADER.size:
+                raise FormatError(f'{path} holds no frames')
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self._spans = []
+        self.times = []
+        offset = 0
+        while offset + _HEADER.size <= len(self._map):
+            magic, version, fetched_at, length = _HEADER.unpack_from(self._map, offset)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                self.close()
+                raise FormatError(f'{path} is not a version {FORMAT_VERSION} market data file')
+            start = offset + _HEADER.size
+            if start + length > len(self._map):
+                break
+            self._spans.append((start, length))
+            self.times.append(fetched_at)
+            offset = start + length
+        if not self._spans:
+            self.close()
+            raise FormatError(f'{path} holds no frames')
+
+    def __len__(self):
+        return len(self._spans)
+
+    def frame(self, index):
+        start, length = self._spans[index]
+        try:
+            coins = loads(zlib.decompress(self._map[start:start + length]))
+        except zlib.error as exc:
+            raise FormatError(f'frame {index} of {self.path} is corrupt') from exc
+        return Frame(EPOCH + timedelta(seconds=self.times[index]), coins)
+
+    def close(self):
+        self._map.close()
+
+
+def read_snapshot(path=None):
+    """The newest frame of the snapshot file, or ``None`` if there is none."""
+    path = path or SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return None
+    frames = FrameFile(path)
+    try:
+        return frames.frame(len(frames) - 1)
+    finally:
+        frames.close()
+
+
+def save(coins, fetched_at):
+    """Replace the snapshot with ``coins`` and append them to the recording, where configured."""
+    if REPLAY_PATH or not coins:
+        return
+    data = encode_frame(coins, fetched_at)
+    if SNAPSHOT_PATH:
+        # Workers may save at the same time; each writes its own file and renames it into place.
+        partial = f'{SNAPSHOT_PATH}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(partial, 'wb') as handle:
+            handle.write(data)
+        os.replace(partial, SNAPSHOT_PATH)
+    if RECORD_PATH:
+        with open(RECORD_PATH, 'ab') as handle:
+            handle.write(data)
@@ -0,0 +1,215 @@
+"""Per-request instrumentation: Prometheus metrics and opt-in profiling.
+
+Each request records its latency and how much of it went to SQL, commits,
+upstream HTTP calls and JSON encoding. SQL is observed through SQLAlchemy
+engine events and commits through session events, so every query is counted
+whichever code path issues it. Work done outside a request (background
+refreshers) is only counted in the upstream totals.
+
+With several gunicorn workers, set ``PROMETHEUS_MULTIPROC_DIR`` (the gunicorn
+config does) so ``/metrics`` aggregates all of them.
+
+Profiling is off unless ``PROFILE_REQUESTS=1``. Then requests sending
+``X-Profile: 1``, plus a random ``PROFILE_SAMPLE_RATE`` fraction of all
+requests, are profiled. Each profile is written to ``PROFILE_DIR``: a
+cProfile ``.prof`` file, or a speedscope JSON file with
+``PROFILER=pyinstrument`` (which must then be installed).
+"""
+from flask import Response, request
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+import cProfile
+import random
+import re
+import tempfile
+import threading
+import time
+import os
+
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'profiles')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+
+PHASES = ('sql', 'commit', 'upstream', 'json')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Time from request start to the end of the response; to the headers for /api/stream',
+    ['method', 'endpoint', 'status']
+)
+REQUEST_PHASE = Histogram(
+    'http_request_phase_seconds', 'Time spent per request in SQL, commits, upstream calls and JSON encoding',
+    ['endpoint', 'phase'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    'http_request_sql_statements', 'SQL statements executed per request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+)
+UPSTREAM_LATENCY = Histogram(
+    'upstream_request_duration_seconds', 'Outbound HTTP calls to the market data API, per attempt',
+    ['path', 'status']
+)
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time waited for a pooled database connection',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+RATE_LIMITED = Counter('rate_limited_requests', 'Requests refused with 429 by a rate limit', ['limit'])
+SHED_REQUESTS = Counter('shed_requests', 'Requests refused with 503 by load shedding', ['reason'])
+PROFILES_WRITTEN = Counter('profiles_written', 'Request profiles written to PROFILE_DIR')
+
+# Coin ids in upstream paths would make one label value per coin.
+_COIN_PATH = re.compile(r'^/?coins/(?!markets$)[^/]+')
+
+_current = threading.local()
+
+
+class RequestStats:
+    __slots__ = ('start', 'sql_statements', 'phases', 'status', 'profiler')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_statements = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.status = 500
+        self.profiler = None
+
+
+def current():
+    """Stats of the request running on this thread, or ``None``."""
+    return getattr(_current, 'stats', None)
+
+
+def add_time(phase, seconds):
+    stats = current()
+    if stats is not None:
+        stats.phases[phase] += seconds
+
+
+def observe_upstream(path, status, seconds):
+    """Record one outbound attempt; ``status`` is the HTTP code or ``'error'``."""
+    UPSTREAM_LATENCY.labels(_COIN_PATH.sub('/coins/{id}', path), str(status)).observe(seconds)
+    add_time('upstream', seconds)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_start'].pop()
+    stats = current()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.phases['sql'] += time.perf_counter() - started
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    session.info['metrics_commit_start'] = time.perf_counter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    started = session.info.pop('metrics_commit_start', None)
+    if started is not None:
+        add_time('commit', time.perf_counter() - started)
+
+
+def endpoint_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _should_profile():
+    if not PROFILE_REQUESTS:
+        return False
+    return request.headers.get('X-Profile') == '1' or random.random() < PROFILE_SAMPLE_RATE
+
+
+def _start_profiler():
+    if PROFILER == 'pyinstrument':
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _write_profile(profiler, endpoint):
+    slug = re.sub(r'\W+', '_', endpoint).strip('_') or 'root'
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{slug}-{os.getpid()}-{threading.get_ident()}'
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if PROFILER == 'pyinstrument':
+        from pyinstrument.renderers import SpeedscopeRenderer
+        profiler.stop()
+        path = os.path.join(PROFILE_DIR, name + '.speedscope.json')
+        with open(path, 'w') as handle:
+            handle.write(profiler.output(SpeedscopeRenderer()))
+    else:
+        profiler.disable()
+        path = os.path.join(PROFILE_DIR, name + '.prof')
+        profiler.dump_stats(path)
+    PROFILES_WRITTEN.inc()
+    return path
+
+
+def _before_request():
+    stats = _current.stats = RequestStats()
+    if _should_profile():
+        stats.profiler = _start_profiler()
+
+
+def _after_request(response):
+    stats = current()
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    """Runs when the request context is popped.
+
+    That is after the body only for generators wrapped in
+    ``stream_with_context`` (the transaction export). ``/api/stream`` is left
+    unwrapped so a long-lived stream does not hold its request context and
+    database session, and is recorded once its headers are sent.
+    """
+    stats = current()
+    if stats is None:
+        return
+    _current.stats = None
+    endpoint = endpoint_label()
+    if stats.profiler is not None:
+        _write_profile(stats.profiler, endpoint)
+    REQUEST_LATENCY.labels(request.method, endpoint, str(stats.status)).observe(time.perf_counter() - stats.start)
+    REQUEST_SQL_STATEMENTS.labels(endpoint).observe(stats.sql_statements)
+    for phase, seconds in stats.phases.items():
+        REQUEST_PHASE.labels(endpoint, phase).observe(seconds)
+
+
+def metrics_view():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_metrics(app):
+    if PROFILE_REQUESTS and PROFILER == 'pyinstrument':
+        import pyinstrument  # noqa: F401 -- fail at startup rather than on the first profiled request
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
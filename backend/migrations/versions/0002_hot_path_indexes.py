@@ -0,0 +1,63 @@
+"""Order fill tracking, hot path indexes and unique holdings per user/coin
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18 10:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_path_indexes'
+down_revision = '0001_baseline'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    order_columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('orders')]
+    if 'filled_quantity' not in order_columns:
+        with op.batch_alter_table('orders') as batch_op:
+            batch_op.add_column(sa.Column('filled_quantity', sa.Float(), nullable=False, server_default='0'))
+
+    # Fold duplicate (user_id, crypto_id) holdings into the oldest row so the
+    # unique constraint can be created.
+    op.execute("""
+        UPDATE holdings SET amount = (
+            SELECT SUM(h2.amount) FROM holdings h2
+            WHERE h2.user_id = holdings.user_id AND h2.crypto_id = holdings.crypto_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM holdings GROUP BY user_id, crypto_id HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM holdings WHERE id NOT IN (
+            SELECT MIN(id) FROM holdings GROUP BY user_id, crypto_id
+        )
+    """)
+
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.create_unique_constraint('uq_holdings_user_crypto', ['user_id', 'crypto_id'])
+
+    op.create_index('ix_transactions_user_created', 'transactions', ['user_id', 'created_at'])
+    op.create_index(
+        'ix_orders_active_timestamp', 'orders', ['timestamp', 'id'],
+        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active')
+    )
+    op.create_index(
+        'ix_orders_active_book', 'orders', ['crypto_id', 'order_type', 'price'],
+        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active')
+    )
+
+
+def downgrade():
+    op.drop_index('ix_orders_active_book', table_name='orders')
+    op.drop_index('ix_orders_active_timestamp', table_name='orders')
+    op.drop_index('ix_transactions_user_created', table_name='transactions')
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.drop_constraint('uq_holdings_user_crypto', type_='unique')
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.drop_column('filled_quantity')
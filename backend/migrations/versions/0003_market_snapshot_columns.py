@@ -0,0 +1,30 @@
+"""Store coin image and market cap rank for the markets snapshot
+
+Revision ID: 0003_market_snapshot_columns
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_market_snapshot_columns'
+down_revision = '0002_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('cryptocurrencies') as batch_op:
+        batch_op.add_column(sa.Column('image', sa.String(length=512), nullable=True))
+        batch_op.add_column(sa.Column('market_cap_rank', sa.Integer(), nullable=True))
+    op.create_index('ix_cryptocurrencies_market_cap_rank', 'cryptocurrencies', ['market_cap_rank'])
+
+
+def downgrade():
+    op.drop_index('ix_cryptocurrencies_market_cap_rank', table_name='cryptocurrencies')
+    with op.batch_alter_table('cryptocurrencies') as batch_op:
+        batch_op.drop_column('market_cap_rank')
+        batch_op.drop_column('image')
@@ -0,0 +1,57 @@
+"""Price ticks and OHLCV candles
+
+Revision ID: 0004_price_history
+Revises: 0003_market_snapshot_columns
+Create Date: 2026-10-18 11:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_price_history'
+down_revision = '0003_market_snapshot_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'price_ticks',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('crypto_id', sa.Integer(), nullable=False),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('volume', sa.Float(), nullable=False),
+        sa.Column('source', sa.String(length=10), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['crypto_id'], ['cryptocurrencies.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_price_ticks_crypto_timestamp', 'price_ticks', ['crypto_id', 'timestamp'])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_price_ticks_timestamp_brin', 'price_ticks', ['timestamp'], postgresql_using='brin')
+    else:
+        op.create_index('ix_price_ticks_timestamp_brin', 'price_ticks', ['timestamp'])
+
+    op.create_table(
+        'candles',
+        sa.Column('crypto_id', sa.Integer(), nullable=False),
+        sa.Column('interval', sa.String(length=3), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('open', sa.Float(), nullable=False),
+        sa.Column('high', sa.Float(), nullable=False),
+        sa.Column('low', sa.Float(), nullable=False),
+        sa.Column('close', sa.Float(), nullable=False),
+        sa.Column('volume', sa.Float(), nullable=False),
+        sa.Column('ticks', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['crypto_id'], ['cryptocurrencies.id']),
+        sa.PrimaryKeyConstraint('crypto_id', 'interval', 'bucket_start')
+    )
+
+
+def downgrade():
+    op.drop_table('candles')
+    op.drop_index('ix_price_ticks_timestamp_brin', table_name='price_ticks')
+    op.drop_index('ix_price_ticks_crypto_timestamp', table_name='price_ticks')
+    op.drop_table('price_ticks')
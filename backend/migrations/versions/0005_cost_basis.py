@@ -0,0 +1,72 @@
+"""Cost basis per holding and realized P&L per user
+
+Revision ID: 0005_cost_basis
+Revises: 0004_price_history
+Create Date: 2026-10-18 12:15:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_cost_basis'
+down_revision = '0004_price_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.add_column(sa.Column('cost_basis', sa.Float(), nullable=False, server_default='0'))
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('realized_pnl', sa.Float(), nullable=False, server_default='0'))
+    backfill()
+
+
+def backfill():
+    """Replay transaction history with the average-cost method.
+
+    Buys add their total (fees included) to the position's cost; sells release
+    the average cost of the amount sold and book ``proceeds - released`` as
+    realized P&L. The replayed average cost is then applied to each holding's
+    current amount.
+    """
+    bind = op.get_bind()
+    transactions = bind.execute(sa.text(
+        'SELECT user_id, crypto_id, transaction_type, amount, total_cost FROM transactions '
+        'ORDER BY user_id, crypto_id, created_at, id'
+    ))
+
+    positions = {}
+    realized = {}
+    for user_id, crypto_id, transaction_type, amount, total in transactions:
+        held, cost = positions.get((user_id, crypto_id), (0.0, 0.0))
+        if transaction_type == 'buy':
+            held, cost = held + amount, cost + total
+        elif held > 0:
+            sold = min(amount, held)
+            released = cost * sold / held
+            realized[user_id] = realized.get(user_id, 0.0) + total - released
+            held, cost = held - sold, cost - released
+        positions[(user_id, crypto_id)] = (held, cost)
+
+    holdings = bind.execute(sa.text('SELECT id, user_id, crypto_id, amount FROM holdings')).all()
+    basis = []
+    for holding_id, user_id, crypto_id, amount in holdings:
+        held, cost = positions.get((user_id, crypto_id), (0.0, 0.0))
+        if held > 0:
+            basis.append({'id': holding_id, 'cost_basis': cost / held * amount})
+    if basis:
+        bind.execute(sa.text('UPDATE holdings SET cost_basis = :cost_basis WHERE id = :id'), basis)
+    if realized:
+        bind.execute(sa.text('UPDATE users SET realized_pnl = :pnl WHERE id = :id'), [
+            {'id': user_id, 'pnl': pnl} for user_id, pnl in realized.items()
+        ])
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('realized_pnl')
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.drop_column('cost_basis')
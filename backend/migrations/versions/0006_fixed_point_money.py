@@ -0,0 +1,64 @@
+"""Fixed-point NUMERIC ledger columns and per-coin quantity precision
+
+Revision ID: 0006_fixed_point_money
+Revises: 0005_cost_basis
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_fixed_point_money'
+down_revision = '0005_cost_basis'
+branch_labels = None
+depends_on = None
+
+USD = (20, 2)
+PRICE = (28, 8)
+QUANTITY = (28, 8)
+
+COLUMNS = {
+    'users': {'balance_usd': USD, 'realized_pnl': USD},
+    'holdings': {'amount': QUANTITY, 'cost_basis': USD},
+    'transactions': {'amount': QUANTITY, 'price_at_transaction': PRICE, 'fee': USD, 'total_cost': USD},
+    'orders': {'quantity': QUANTITY, 'filled_quantity': QUANTITY, 'price': PRICE},
+}
+
+
+def upgrade():
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column, (precision, scale) in columns.items():
+                batch_op.alter_column(
+                    column,
+                    existing_type=sa.Float(),
+                    type_=sa.Numeric(precision, scale),
+                    postgresql_using=f'round({column}::numeric, {scale})'
+                )
+
+    if op.get_bind().dialect.name != 'postgresql':
+        # Only PostgreSQL rounds while converting (USING above); SQLite keeps the stored REALs.
+        for table, columns in COLUMNS.items():
+            op.execute(f'UPDATE {table} SET ' + ', '.join(
+                f'{column} = ROUND({column}, {scale})' for column, (_, scale) in columns.items()
+            ))
+
+    with op.batch_alter_table('cryptocurrencies') as batch_op:
+        batch_op.add_column(sa.Column('quantity_decimals', sa.Integer(), nullable=False, server_default='8'))
+
+    # Float residue such as 1e-15 rounds to zero now; drop the dust it left behind.
+    op.execute('DELETE FROM holdings WHERE amount <= 0')
+    op.execute(sa.text('UPDATE orders SET is_active = :inactive WHERE is_active AND quantity - filled_quantity <= 0')
+               .bindparams(inactive=False))
+
+
+def downgrade():
+    with op.batch_alter_table('cryptocurrencies') as batch_op:
+        batch_op.drop_column('quantity_decimals')
+
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column, (precision, scale) in columns.items():
+                batch_op.alter_column(column, existing_type=sa.Numeric(precision, scale), type_=sa.Float())
@@ -0,0 +1,91 @@
+"""Funds and coins reserved by active orders
+
+Revision ID: 0007_locked_balances
+Revises: 0006_fixed_point_money
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+from decimal import Decimal, ROUND_CEILING
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_locked_balances'
+down_revision = '0006_fixed_point_money'
+branch_labels = None
+depends_on = None
+
+CENT = Decimal('0.01')
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('locked_usd', sa.Numeric(20, 2), nullable=False, server_default='0'))
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.add_column(sa.Column('locked_amount', sa.Numeric(28, 8), nullable=False, server_default='0'))
+    backfill()
+
+
+def to_decimal(value):
+    # SQLite hands NUMERIC back as float; go through str like money.parse does.
+    return Decimal(str(value))
+
+
+def backfill():
+    """Reserve for every active order, oldest first.
+
+    Orders placed before reservations existed may promise more than the user
+    owns. Those that no longer fit are deactivated, so the book only keeps
+    orders that are guaranteed to settle.
+    """
+    bind = op.get_bind()
+    available_usd = {row.id: to_decimal(row.balance_usd) for row in bind.execute(sa.text(
+        'SELECT id, balance_usd FROM users'
+    ))}
+    available_amount = {(row.user_id, row.crypto_id): to_decimal(row.amount) for row in bind.execute(sa.text(
+        'SELECT user_id, crypto_id, amount FROM holdings'
+    ))}
+    active = bind.execute(sa.text(
+        'SELECT id, user_id, crypto_id, order_type, quantity, filled_quantity, price FROM orders '
+        'WHERE is_active ORDER BY timestamp, id'
+    )).all()
+
+    locked_usd, locked_amount, dropped = {}, {}, []
+    for row in active:
+        remaining = to_decimal(row.quantity) - to_decimal(row.filled_quantity or 0)
+        if row.order_type == 'buy':
+            needed = (remaining * to_decimal(row.price)).quantize(CENT, ROUND_CEILING)
+            if available_usd.get(row.user_id, 0) < needed:
+                dropped.append({'id': row.id, 'inactive': False})
+                continue
+            available_usd[row.user_id] -= needed
+            locked_usd[row.user_id] = locked_usd.get(row.user_id, 0) + needed
+        else:
+            key = (row.user_id, row.crypto_id)
+            if available_amount.get(key, 0) < remaining:
+                dropped.append({'id': row.id, 'inactive': False})
+                continue
+            available_amount[key] -= remaining
+            locked_amount[key] = locked_amount.get(key, 0) + remaining
+
+    if dropped:
+        bind.execute(sa.text('UPDATE orders SET is_active = :inactive WHERE id = :id'), dropped)
+    if locked_usd:
+        bind.execute(sa.text('UPDATE users SET locked_usd = :locked WHERE id = :id')
+                     .bindparams(sa.bindparam('locked', type_=sa.Numeric(20, 2))), [
+            {'id': user_id, 'locked': locked} for user_id, locked in locked_usd.items()
+        ])
+    if locked_amount:
+        bind.execute(sa.text('UPDATE holdings SET locked_amount = :locked WHERE user_id = :user_id AND crypto_id = :crypto_id')
+                     .bindparams(sa.bindparam('locked', type_=sa.Numeric(28, 8))), [
+            {'user_id': user_id, 'crypto_id': crypto_id, 'locked': locked}
+            for (user_id, crypto_id), locked in locked_amount.items()
+        ])
+
+
+def downgrade():
+    with op.batch_alter_table('holdings') as batch_op:
+        batch_op.drop_column('locked_amount')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('locked_usd')
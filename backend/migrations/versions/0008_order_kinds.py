@@ -0,0 +1,75 @@
+"""Stop and take-profit orders
+
+Revision ID: 0008_order_kinds
+Revises: 0007_locked_balances
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+from decimal import Decimal, ROUND_CEILING, ROUND_HALF_UP
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_order_kinds'
+down_revision = '0007_locked_balances'
+branch_labels = None
+depends_on = None
+
+CENT = Decimal('0.01')
+COMMISSION_RATE = Decimal('0.015')
+
+
+def upgrade():
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(16), nullable=False, server_default='limit'))
+        batch_op.add_column(sa.Column('trigger_price', sa.Numeric(28, 8), nullable=True))
+
+
+def to_decimal(value):
+    return Decimal(str(value))
+
+
+def downgrade():
+    cancel_pending_triggers()
+    with op.batch_alter_table('orders') as batch_op:
+        batch_op.drop_column('trigger_price')
+        batch_op.drop_column('kind')
+
+
+def cancel_pending_triggers():
+    """Without ``kind`` pending triggers would become limit orders at their trigger price; cancel them."""
+    bind = op.get_bind()
+    pending = bind.execute(sa.text(
+        "SELECT id, user_id, crypto_id, order_type, quantity, filled_quantity, price FROM orders "
+        "WHERE kind <> 'limit' AND is_active"
+    )).all()
+    if not pending:
+        return
+
+    released_usd, released_amount = {}, {}
+    for row in pending:
+        remaining = to_decimal(row.quantity) - to_decimal(row.filled_quantity or 0)
+        if row.order_type == 'buy':
+            gross = (remaining * to_decimal(row.price)).quantize(CENT, ROUND_CEILING)
+            amount = gross + (gross * COMMISSION_RATE).quantize(CENT, ROUND_HALF_UP)
+            released_usd[row.user_id] = released_usd.get(row.user_id, 0) + amount
+        else:
+            key = (row.user_id, row.crypto_id)
+            released_amount[key] = released_amount.get(key, 0) + remaining
+
+    bind.execute(sa.text('UPDATE orders SET is_active = :inactive WHERE id = :id'), [
+        {'id': row.id, 'inactive': False} for row in pending
+    ])
+    if released_usd:
+        bind.execute(sa.text('UPDATE users SET locked_usd = locked_usd - :released WHERE id = :id')
+                     .bindparams(sa.bindparam('released', type_=sa.Numeric(20, 2))), [
+            {'id': user_id, 'released': amount} for user_id, amount in released_usd.items()
+        ])
+    if released_amount:
+        bind.execute(sa.text('UPDATE holdings SET locked_amount = locked_amount - :released '
+                             'WHERE user_id = :user_id AND crypto_id = :crypto_id')
+                     .bindparams(sa.bindparam('released', type_=sa.Numeric(28, 8))), [
+            {'user_id': user_id, 'crypto_id': crypto_id, 'released': amount}
+            for (user_id, crypto_id), amount in released_amount.items()
+        ])
@@ -0,0 +1,78 @@
+"""Append-only ledger journal and its snapshots
+
+Revision ID: 0009_journal
+Revises: 0008_order_kinds
+Create Date: 2026-10-18 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_journal'
+down_revision = '0008_order_kinds'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'journal',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True),
+        sa.Column('event', sa.String(16), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('crypto_id', sa.Integer(), nullable=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('usd', sa.Numeric(20, 2), nullable=True),
+        sa.Column('locked_usd', sa.Numeric(20, 2), nullable=True),
+        sa.Column('pnl', sa.Numeric(20, 2), nullable=True),
+        sa.Column('amount', sa.Numeric(28, 8), nullable=True),
+        sa.Column('locked_amount', sa.Numeric(28, 8), nullable=True),
+        sa.Column('cost', sa.Numeric(20, 2), nullable=True),
+        sa.Column('side', sa.String(4), nullable=True),
+        sa.Column('kind', sa.String(16), nullable=True),
+        sa.Column('quantity', sa.Numeric(28, 8), nullable=True),
+        sa.Column('price', sa.Numeric(28, 8), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False)
+    )
+    op.create_table(
+        'journal_snapshots',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('last_seq', sa.BigInteger(), nullable=False),
+        sa.Column('events', sa.Integer(), nullable=False),
+        sa.Column('state', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False)
+    )
+    op.create_index('ix_journal_snapshots_last_seq', 'journal_snapshots', ['last_seq'])
+    open_journal()
+
+
+def open_journal():
+    """Start the journal from the current tables: opening balances, positions and open orders."""
+    op.execute("""
+        INSERT INTO journal (event, user_id, usd, locked_usd, pnl, created_at)
+        SELECT 'opening', id, balance_usd, NULLIF(locked_usd, 0), NULLIF(realized_pnl, 0), CURRENT_TIMESTAMP
+        FROM users ORDER BY id
+    """)
+    op.execute("""
+        INSERT INTO journal (event, user_id, crypto_id, amount, locked_amount, cost, created_at)
+        SELECT 'opening', user_id, crypto_id, amount, NULLIF(locked_amount, 0), NULLIF(cost_basis, 0), CURRENT_TIMESTAMP
+        FROM holdings ORDER BY user_id, crypto_id
+    """)
+    op.execute("""
+        INSERT INTO journal (event, user_id, crypto_id, order_id, side, kind, quantity, price, created_at)
+        SELECT 'order_placed', user_id, crypto_id, id, order_type, kind, quantity, price, CURRENT_TIMESTAMP
+        FROM orders WHERE is_active ORDER BY timestamp, id
+    """)
+    op.execute("""
+        INSERT INTO journal (event, user_id, order_id, quantity, created_at)
+        SELECT 'order_filled', user_id, id, filled_quantity, CURRENT_TIMESTAMP
+        FROM orders WHERE is_active AND filled_quantity > 0 ORDER BY id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_journal_snapshots_last_seq', table_name='journal_snapshots')
+    op.drop_table('journal_snapshots')
+    op.drop_table('journal')
@@ -0,0 +1,33 @@
+"""When the ticks behind each candle's open and close happened
+
+Revision ID: 0010_candle_tick_times
+Revises: 0009_journal
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_candle_tick_times'
+down_revision = '0009_journal'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('candles') as batch_op:
+        batch_op.add_column(sa.Column('open_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('close_at', sa.DateTime(), nullable=True))
+    # Existing candles keep their open, and their close gives way to any new tick.
+    op.execute('UPDATE candles SET open_at = bucket_start, close_at = bucket_start')
+    with op.batch_alter_table('candles') as batch_op:
+        batch_op.alter_column('open_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.alter_column('close_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('candles') as batch_op:
+        batch_op.drop_column('close_at')
+        batch_op.drop_column('open_at')
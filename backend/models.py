@@ -1,5 +1,5 @@
 from database import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from money import UsdType, PriceType, QuantityType, QUANTITY_DECIMALS, usd
 from datetime import datetime
 import os
 
@@ -10,24 +10,22 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
-    balance_usd = db.Column(db.Float, default=float(os.environ.get('INITIAL_BALANCE', '10000.0')))
+    balance_usd = db.Column(UsdType, default=usd(os.environ.get('INITIAL_BALANCE', '10000.00')))
+    realized_pnl = db.Column(UsdType, nullable=False, default=0)
+    # USD held back by active buy orders; available = balance_usd - locked_usd.
+    locked_usd = db.Column(UsdType, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     holdings = db.relationship('Holdings', backref='user', lazy=True)
     transactions = db.relationship('Transaction', backref='user', lazy=True)
     
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-    
     def to_dict(self):
         return {
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'balance_usd': self.balance_usd
+            'balance_usd': self.balance_usd,
+            'locked_usd': self.locked_usd
         }
 
 class Cryptocurrency(db.Model):
@@ -37,10 +35,13 @@ class Cryptocurrency(db.Model):
     symbol = db.Column(db.String(10), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     coingecko_id = db.Column(db.String(100), unique=True, nullable=True)
+    image = db.Column(db.String(512))
     current_price = db.Column(db.Float, nullable=True)
     market_cap = db.Column(db.Float)
+    market_cap_rank = db.Column(db.Integer, index=True)
     volume_24h = db.Column(db.Float)
     price_change_24h = db.Column(db.Float)
+    quantity_decimals = db.Column(db.Integer, nullable=False, default=QUANTITY_DECIMALS)
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -51,6 +52,7 @@ class Cryptocurrency(db.Model):
             'coingecko_id': self.coingecko_id,
             'current_price': self.current_price,
             'market_cap': self.market_cap,
+            'market_cap_rank': self.market_cap_rank,
             'volume_24h': self.volume_24h,
             'price_change_24h': self.price_change_24h,
             'last_updated': self.last_updated.isoformat() if self.last_updated else None
@@ -58,33 +60,49 @@ class Cryptocurrency(db.Model):
 
 class Holdings(db.Model):
     __tablename__ = 'holdings'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'crypto_id', name='uq_holdings_user_crypto'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     crypto_id = db.Column(db.Integer, db.ForeignKey('cryptocurrencies.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False, default=0.0)
+    amount = db.Column(QuantityType, nullable=False, default=0)
+    cost_basis = db.Column(UsdType, nullable=False, default=0)
+    # Coins held back by active sell orders; available = amount - locked_amount.
+    locked_amount = db.Column(QuantityType, nullable=False, default=0)
     
     cryptocurrency = db.relationship('Cryptocurrency', backref='holdings')
     
-    def to_dict(self):
+    def to_dict(self, price=None):
+        if price is None:
+            price = self.cryptocurrency.current_price or 0
+        # Market value is an estimate at a float market price, not a ledger amount.
+        total_value = float(self.amount) * price
         return {
             'id': self.id,
             'crypto': self.cryptocurrency.to_dict(),
             'amount': self.amount,
-            'total_value': self.amount * (self.cryptocurrency.current_price or 0)
+            'locked_amount': self.locked_amount,
+            'total_value': total_value,
+            'cost_basis': self.cost_basis,
+            'unrealized_pnl': total_value - float(self.cost_basis)
         }
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     crypto_id = db.Column(db.Integer, db.ForeignKey('cryptocurrencies.id'), nullable=False)
     transaction_type = db.Column(db.String(10), nullable=False)  # 'buy' или 'sell'
-    amount = db.Column(db.Float, nullable=False)
-    price_at_transaction = db.Column(db.Float, nullable=False)
-    fee = db.Column(db.Float, nullable=False)
-    total_cost = db.Column(db.Float, nullable=False)
+    amount = db.Column(QuantityType, nullable=False)
+    price_at_transaction = db.Column(PriceType, nullable=False)
+    fee = db.Column(UsdType, nullable=False)
+    total_cost = db.Column(UsdType, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     cryptocurrency = db.relationship('Cryptocurrency', backref='transactions')
@@ -92,13 +110,25 @@ class Transaction(db.Model):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Partial indexes: only resting orders are ever listed or matched.
+        db.Index('ix_orders_active_timestamp', 'timestamp', 'id',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+        db.Index('ix_orders_active_book', 'crypto_id', 'order_type', 'price',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     crypto_id = db.Column(db.Integer, db.ForeignKey('cryptocurrencies.id'), nullable=False)
-    quantity = db.Column(db.Float, nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    quantity = db.Column(QuantityType, nullable=False)
+    filled_quantity = db.Column(QuantityType, nullable=False, default=0)
+    price = db.Column(PriceType, nullable=False)
     order_type = db.Column(db.String(4), nullable=False)  # 'buy' or 'sell'
+    # 'limit' rests on the book at ``price``; 'stop' and 'take_profit' wait for
+    # the market to reach ``trigger_price`` (also stored in ``price``) and then trade at spot.
+    kind = db.Column(db.String(16), nullable=False, default='limit', server_default='limit')
+    trigger_price = db.Column(PriceType, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
 
@@ -111,11 +141,100 @@ class Order(db.Model):
             'user_id': self.user_id,
             'crypto_id': self.crypto_id,
             'quantity': self.quantity,
+            'filled_quantity': self.filled_quantity,
             'price': self.price,
             'order_type': self.order_type,
+            'kind': self.kind,
+            'trigger_price': self.trigger_price,
             'timestamp': self.timestamp.isoformat(),
             'is_active': self.is_active,
             'user': self.user.username,
             'crypto_symbol': self.cryptocurrency.symbol,
             'crypto_name': self.cryptocurrency.name
         }
+
+
+class PriceTick(db.Model):
+    __tablename__ = 'price_ticks'
+    __table_args__ = (
+        db.Index('ix_price_ticks_crypto_timestamp', 'crypto_id', 'timestamp'),
+        # Ticks are appended in time order, so a BRIN index keeps retention
+        # deletes by timestamp cheap at a fraction of a btree's size.
+        db.Index('ix_price_ticks_timestamp_brin', 'timestamp', postgresql_using='brin'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    crypto_id = db.Column(db.Integer, db.ForeignKey('cryptocurrencies.id'), nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    source = db.Column(db.String(10), nullable=False)  # 'refresh' or 'trade'
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class Candle(db.Model):
+    __tablename__ = 'candles'
+
+    crypto_id = db.Column(db.Integer, db.ForeignKey('cryptocurrencies.id'), primary_key=True)
+    interval = db.Column(db.String(3), primary_key=True)  # '1m', '5m', '1h', '1d'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    open = db.Column(db.Float, nullable=False)
+    high = db.Column(db.Float, nullable=False)
+    low = db.Column(db.Float, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+    volume = db.Column(db.Float, nullable=False, default=0.0)
+    ticks = db.Column(db.Integer, nullable=False, default=0)
+    # When the ticks behind open and close happened; batched trade ticks can arrive late.
+    open_at = db.Column(db.DateTime, nullable=False)
+    close_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'time': self.bucket_start.isoformat(),
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': self.volume,
+            'ticks': self.ticks
+        }
+
+
+class JournalEvent(db.Model):
+    """One change to a balance, position or order; ``id`` is the journal sequence number.
+
+    Rows are only ever inserted, in the transaction that made the change.
+    Deltas are NULL rather than zero when a column was not touched. There
+    are no foreign keys: the journal outlives the rows it describes.
+    """
+    __tablename__ = 'journal'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    event = db.Column(db.String(16), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    crypto_id = db.Column(db.Integer, nullable=True)
+    order_id = db.Column(db.Integer, nullable=True)
+    # Added to users.balance_usd, locked_usd and realized_pnl.
+    usd = db.Column(UsdType, nullable=True)
+    locked_usd = db.Column(UsdType, nullable=True)
+    pnl = db.Column(UsdType, nullable=True)
+    # Added to holdings.amount, locked_amount and cost_basis.
+    amount = db.Column(QuantityType, nullable=True)
+    locked_amount = db.Column(QuantityType, nullable=True)
+    cost = db.Column(UsdType, nullable=True)
+    # Order placements carry the order; fills carry the quantity filled.
+    side = db.Column(db.String(4), nullable=True)
+    kind = db.Column(db.String(16), nullable=True)
+    quantity = db.Column(QuantityType, nullable=True)
+    price = db.Column(PriceType, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class JournalSnapshot(db.Model):
+    """The ledger folded from every journal event up to ``last_seq``, zlib-compressed JSON."""
+    __tablename__ = 'journal_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.BigInteger, nullable=False, index=True)
+    events = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,90 @@
+"""Fixed-point money and quantity arithmetic.
+
+The ledger (balances, holdings, orders, transactions) is stored as
+``NUMERIC`` and handled as ``Decimal`` at these scales:
+
+- USD amounts: 2 decimals (cents)
+- prices: 8 decimals (USD per unit; many coins trade below a cent)
+- quantities: 8 decimals, further limited per coin by
+  ``Cryptocurrency.quantity_decimals``
+
+The matching engine works on plain integers in minor units (``to_units``)
+so its inner loop never touches ``Decimal``. All rounding happens here.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR, ROUND_HALF_EVEN, ROUND_HALF_UP
+from sqlalchemy import Numeric
+
+USD_DECIMALS = 2
+PRICE_DECIMALS = 8
+QUANTITY_DECIMALS = 8
+
+COMMISSION_RATE = Decimal('0.015')
+
+UsdType = Numeric(20, USD_DECIMALS)
+PriceType = Numeric(28, PRICE_DECIMALS)
+QuantityType = Numeric(28, QUANTITY_DECIMALS)
+
+_EXPONENTS = {decimals: Decimal(1).scaleb(-decimals) for decimals in range(QUANTITY_DECIMALS + 1)}
+
+# Slack for comparisons evaluated in SQL. Stored values are whole minor units,
+# so half a unit changes nothing on NUMERIC backends, while it absorbs the
+# rounding noise of SQLite, which keeps NUMERIC columns as REAL.
+HALF_CENT = _EXPONENTS[USD_DECIMALS] / 2
+HALF_QUANTITY_UNIT = _EXPONENTS[QUANTITY_DECIMALS] / 2
+
+
+def parse(value):
+    """``Decimal`` from user input; floats go through ``str`` to avoid binary noise."""
+    try:
+        result = Decimal(str(value))
+    except (InvalidOperation, TypeError) as exc:
+        raise ValueError(f'Invalid number: {value!r}') from exc
+    if not result.is_finite():
+        raise ValueError(f'Invalid number: {value!r}')
+    return result
+
+
+def usd(value):
+    return parse(value).quantize(_EXPONENTS[USD_DECIMALS], ROUND_HALF_EVEN)
+
+
+def price(value):
+    return parse(value).quantize(_EXPONENTS[PRICE_DECIMALS], ROUND_HALF_EVEN)
+
+
+def quantity(value, decimals=QUANTITY_DECIMALS):
+    """Round a quantity down to the coin's precision, so nobody trades what they do not have."""
+    return parse(value).quantize(_EXPONENTS[min(decimals, QUANTITY_DECIMALS)], ROUND_DOWN)
+
+
+def notional(amount, unit_price):
+    """USD value of ``amount`` at ``unit_price``, rounded to the cent."""
+    return (amount * unit_price).quantize(_EXPONENTS[USD_DECIMALS], ROUND_HALF_EVEN)
+
+
+def reserved_notional(amount, unit_price):
+    """USD a buy order holds back for ``amount`` at its limit price, rounded up to the cent.
+
+    Fills round down (``fill_notional``), and floor(a) + floor(b) <= floor(a + b),
+    so whatever a reservation releases for a fill always covers its cost.
+    """
+    return (amount * unit_price).quantize(_EXPONENTS[USD_DECIMALS], ROUND_CEILING)
+
+
+def fill_notional(amount, unit_price):
+    """USD paid when resting and incoming limit orders match, rounded down to the cent."""
+    return (amount * unit_price).quantize(_EXPONENTS[USD_DECIMALS], ROUND_FLOOR)
+
+
+def commission(gross):
+    """The exchange fee on a USD amount; half-cents round in the exchange's favour."""
+    return (gross * COMMISSION_RATE).quantize(_EXPONENTS[USD_DECIMALS], ROUND_HALF_UP)
+
+
+def to_units(value, decimals):
+    """Exact integer count of ``10 ** -decimals`` units in an already-rounded ``Decimal``."""
+    return int(value.scaleb(decimals))
+
+
+def from_units(units, decimals):
+    return Decimal(units).scaleb(-decimals)
@@ -0,0 +1,238 @@
+from stream import broker
+from money import PRICE_DECIMALS, QUANTITY_DECIMALS, to_units
+from collections import deque
+import bisect
+import threading
+
+PRICE_SCALE = 10 ** PRICE_DECIMALS
+QUANTITY_SCALE = 10 ** QUANTITY_DECIMALS
+
+FILLED = 'filled'
+MAKER_REJECTED = 'maker_rejected'
+
+
+class BookOrder:
+    """A resting order in integer minor units: ``price`` in 1e-8 USD, ``remaining`` in 1e-8 coins."""
+
+    __slots__ = ('id', 'user_id', 'crypto_id', 'side', 'price', 'remaining', 'active')
+
+    def __init__(self, id, user_id, crypto_id, side, price, remaining):
+        self.id = id
+        self.user_id = user_id
+        self.crypto_id = crypto_id
+        self.side = side
+        self.price = price
+        self.remaining = remaining
+        self.active = True
+
+    @classmethod
+    def from_model(cls, order):
+        return cls(order.id, order.user_id, order.crypto_id, order.order_type,
+                   to_units(order.price, PRICE_DECIMALS),
+                   to_units(order.quantity - (order.filled_quantity or 0), QUANTITY_DECIMALS))
+
+
+class _BookSide:
+    """One side of a book: sorted price levels, each a FIFO queue of orders.
+
+    Cancelled orders are only flagged inactive and skipped when they reach the
+    front of their queue, so cancel is O(1) apart from dropping an emptied level.
+    """
+
+    def __init__(self, is_bid):
+        self.is_bid = is_bid
+        self.prices = []
+        self.levels = {}
+        self.volume = {}
+        self.changed = set()
+
+    def best_price(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.is_bid else self.prices[0]
+
+    def add(self, order):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = self.levels[order.price] = deque()
+            self.volume[order.price] = 0
+            bisect.insort(self.prices, order.price)
+        level.append(order)
+        self.volume[order.price] += order.remaining
+        self.changed.add(order.price)
+
+    def reduce(self, price, quantity):
+        self.volume[price] -= quantity
+        self.changed.add(price)
+        if self.volume[price] <= 0:
+            self._drop_level(price)
+
+    def front(self, price):
+        level = self.levels[price]
+        while level and not level[0].active:
+            level.popleft()
+        return level[0] if level else None
+
+    def pop_front(self, price):
+        self.levels[price].popleft()
+
+    def _drop_level(self, price):
+        del self.levels[price]
+        del self.volume[price]
+        index = bisect.bisect_left(self.prices, price)
+        del self.prices[index]
+
+    def depth(self, limit):
+        prices = reversed(self.prices) if self.is_bid else iter(self.prices)
+        result = []
+        for price in prices:
+            if len(result) >= limit:
+                break
+            result.append({'price': price / PRICE_SCALE, 'quantity': self.volume[price] / QUANTITY_SCALE})
+        return result
+
+    def take_changes(self):
+        """``{price: quantity}`` for levels touched since the last call; 0 means removed."""
+        changes = {price / PRICE_SCALE: self.volume.get(price, 0) / QUANTITY_SCALE for price in self.changed}
+        self.changed.clear()
+        return changes
+
+
+class OrderBook:
+    def __init__(self, crypto_id):
+        self.crypto_id = crypto_id
+        self.bids = _BookSide(is_bid=True)
+        self.asks = _BookSide(is_bid=False)
+        self.orders = {}
+        self.lock = threading.RLock()
+        self.topic = f'book:{crypto_id}'
+
+    def clear(self):
+        with self.lock:
+            self.bids = _BookSide(is_bid=True)
+            self.asks = _BookSide(is_bid=False)
+            self.orders = {}
+            broker.publish(self.topic, 'reset', {})
+
+    def publish_changes(self):
+        """Send touched price levels to stream subscribers as one delta."""
+        if not broker.has_subscribers(self.topic):
+            self.bids.changed.clear()
+            self.asks.changed.clear()
+            return
+        bids, asks = self.bids.take_changes(), self.asks.take_changes()
+        if bids or asks:
+            broker.publish(self.topic, 'book', {'bids': bids, 'asks': asks}, nested=True)
+
+    def _side(self, side):
+        return self.bids if side == 'buy' else self.asks
+
+    def add(self, order):
+        """Rest an order on the book without matching it."""
+        with self.lock:
+            self._side(order.side).add(order)
+            self.orders[order.id] = order
+            self.publish_changes()
+
+    def cancel(self, order_id):
+        with self.lock:
+            order = self.orders.pop(order_id, None)
+            if order is None:
+                return None
+            order.active = False
+            self._side(order.side).reduce(order.price, order.remaining)
+            self.publish_changes()
+            return order
+
+    def submit(self, order, settle):
+        """Match an incoming limit order, then rest whatever is left.
+
+        ``settle(taker, maker, quantity, price)`` persists a single fill and
+        returns ``FILLED`` or ``MAKER_REJECTED`` (the resting order is dropped
+        and matching continues). Fills execute at the maker's price.
+        Quantities and prices are integer minor units, as on ``BookOrder``.
+        Returns the list of ``(maker, quantity, price)`` fills.
+        """
+        fills = []
+        with self.lock:
+            opposite = self.asks if order.side == 'buy' else self.bids
+            while order.remaining > 0:
+                best = opposite.best_price()
+                if best is None:
+                    break
+                if order.side == 'buy' and best > order.price:
+                    break
+                if order.side == 'sell' and best < order.price:
+                    break
+
+                maker = opposite.front(best)
+                quantity = min(order.remaining, maker.remaining)
+                outcome = settle(order, maker, quantity, best)
+
+                if outcome == MAKER_REJECTED:
+                    self.cancel(maker.id)
+                    continue
+
+                fills.append((maker, quantity, best))
+                order.remaining -= quantity
+                maker.remaining -= quantity
+                opposite.reduce(best, quantity)
+                if maker.remaining <= 0:
+                    maker.active = False
+                    self.orders.pop(maker.id, None)
+                    if best in opposite.levels:
+                        opposite.pop_front(best)
+
+            if order.remaining > 0:
+                self.add(order)
+            else:
+                order.active = False
+            self.publish_changes()
+        return fills
+
+    def depth(self, limit=20):
+        with self.lock:
+            return {'bids': self.bids.depth(limit), 'asks': self.asks.depth(limit)}
+
+
+class MatchingEngine:
+    """Registry of per-crypto order books living in this process."""
+
+    def __init__(self):
+        self.books = {}
+        self._lock = threading.Lock()
+
+    def book(self, crypto_id):
+        book = self.books.get(crypto_id)
+        if book is None:
+            with self._lock:
+                book = self.books.setdefault(crypto_id, OrderBook(crypto_id))
+        return book
+
+    def submit(self, order, settle):
+        return self.book(order.crypto_id).submit(order, settle)
+
+    def cancel(self, crypto_id, order_id):
+        return self.book(crypto_id).cancel(order_id)
+
+    def rebuild(self, orders, crypto_id=None):
+        """Load resting orders (already in time priority order) into fresh books.
+
+        With ``crypto_id`` only that book is cleared, in place, so threads that
+        already hold a reference to it keep using the same lock.
+        """
+        if crypto_id is None:
+            with self._lock:
+                self.books.clear()
+        else:
+            self.book(crypto_id).clear()
+        count = 0
+        for order in orders:
+            book_order = BookOrder.from_model(order)
+            if book_order.remaining > 0:
+                self.book(book_order.crypto_id).add(book_order)
+                count += 1
+        return count
+
+
+matching_engine = MatchingEngine()
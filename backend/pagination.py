@@ -0,0 +1,58 @@
+from sqlalchemy import and_, or_
+from datetime import datetime
+import base64
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise InvalidCursor('Invalid cursor') from exc
+
+
+def page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(value, MAX_PAGE_SIZE))
+
+
+def keyset_before(timestamp_column, id_column, cursor):
+    """Filter for rows strictly after ``cursor`` in (timestamp DESC, id DESC) order."""
+    timestamp, row_id = decode_cursor(cursor)
+    return or_(
+        timestamp_column < timestamp,
+        and_(timestamp_column == timestamp, id_column < row_id)
+    )
+
+
+def paginate_desc(query, timestamp_column, id_column, cursor, limit):
+    """Apply keyset pagination to ``query`` ordered newest first.
+
+    Fetches one extra row to learn whether another page exists and returns
+    ``(rows, next_cursor)``; ``next_cursor`` is ``None`` on the last page.
+    Rows must expose the timestamp and id under the columns' attribute names.
+    """
+    if cursor:
+        query = query.filter(keyset_before(timestamp_column, id_column, cursor))
+    rows = query.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,149 @@
+from database import db
+from models import User, Cryptocurrency, Holdings
+from price_cache import price_cache
+from sqlalchemy import select, cast, Float
+from sqlalchemy.orm import contains_eager
+import money
+import numpy as np
+import threading
+import time
+import os
+
+MAX_LEADERBOARD = 100
+
+users = User.__table__
+holdings = Holdings.__table__
+cryptocurrencies = Cryptocurrency.__table__
+
+
+def mark_price(crypto):
+    """Fresh cached price if there is one, else the stored snapshot price."""
+    price = price_cache.get_price(crypto)
+    return price if price is not None else (crypto.current_price or 0.0)
+
+
+def user_portfolio(user):
+    """Positions with market value and unrealized P&L from one joined query.
+
+    Amounts and cost basis are kept current by every trade (see
+    ``trading.add_holding`` / ``remove_holding``), so nothing is replayed here.
+    """
+    positions = Holdings.query.join(Holdings.cryptocurrency).options(
+        contains_eager(Holdings.cryptocurrency)
+    ).filter(Holdings.user_id == user.id).order_by(Holdings.id).all()
+
+    items = [position.to_dict(mark_price(position.cryptocurrency)) for position in positions]
+    portfolio_value = sum(item['total_value'] for item in items)
+    cost_basis = sum(float(item['cost_basis']) for item in items)
+    return {
+        'balance_usd': user.balance_usd,
+        'locked_usd': user.locked_usd,
+        'available_usd': user.balance_usd - user.locked_usd,
+        'portfolio_value': portfolio_value,
+        'total_value': float(user.balance_usd) + portfolio_value,
+        'cost_basis': cost_basis,
+        'unrealized_pnl': portfolio_value - cost_basis,
+        'realized_pnl': user.realized_pnl,
+        'holdings': items
+    }
+
+
+class PortfolioValuator:
+    """Values every account at once from column arrays.
+
+    Holdings and users are loaded in two queries, priced against a dense
+    ``crypto_id -> price`` vector and summed per user with ``np.bincount``.
+    Results are reused for ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age if max_age is not None else float(os.environ.get('PORTFOLIO_VALUATION_MAX_AGE', '15'))
+        self._lock = threading.Lock()
+        self._result = None
+        self._computed_at = None
+        self.runs = 0
+        self.last_duration = None
+
+    def price_vector(self):
+        rows = db.session.execute(
+            select(cryptocurrencies.c.id, cryptocurrencies.c.coingecko_id, cryptocurrencies.c.current_price)
+        ).all()
+        prices = np.zeros(max((row.id for row in rows), default=0) + 1)
+        for row in rows:
+            cached = price_cache.get(row.coingecko_id)
+            prices[row.id] = cached if cached is not None else (row.current_price or 0.0)
+        return prices
+
+    def compute(self):
+        start = time.perf_counter()
+        # Valuation is an estimate at float market prices, so ledger NUMERICs
+        # are cast in SQL instead of building millions of Decimals.
+        account_rows = db.session.execute(
+            select(users.c.id, cast(users.c.balance_usd, Float), cast(users.c.realized_pnl, Float)).order_by(users.c.id)
+        ).all()
+        position_rows = db.session.execute(
+            select(holdings.c.user_id, holdings.c.crypto_id, cast(holdings.c.amount, Float), cast(holdings.c.cost_basis, Float))
+        ).all()
+        prices = self.price_vector()
+
+        # Plain tuples: NumPy probes Row objects for array attributes, which is slow.
+        accounts = np.array(list(map(tuple, account_rows)), dtype=float).reshape(-1, 3)
+        user_ids = accounts[:, 0].astype(np.int64)
+        positions = np.array(list(map(tuple, position_rows)), dtype=float).reshape(-1, 4)
+
+        owner = np.searchsorted(user_ids, positions[:, 0].astype(np.int64))
+        market_value = positions[:, 2] * prices[positions[:, 1].astype(np.int64)]
+        holdings_value = np.bincount(owner, weights=market_value, minlength=len(user_ids))
+        cost_basis = np.bincount(owner, weights=positions[:, 3], minlength=len(user_ids))
+
+        result = {
+            'user_id': user_ids,
+            'balance_usd': accounts[:, 1],
+            'portfolio_value': holdings_value,
+            'total_value': accounts[:, 1] + holdings_value,
+            'unrealized_pnl': holdings_value - cost_basis,
+            'realized_pnl': accounts[:, 2]
+        }
+        self.runs += 1
+        self.last_duration = time.perf_counter() - start
+        return result
+
+    def value_all(self):
+        with self._lock:
+            if self._result is None or time.monotonic() - self._computed_at > self.max_age:
+                self._result = self.compute()
+                self._computed_at = time.monotonic()
+            return self._result
+
+    def leaderboard(self, limit=10):
+        limit = max(1, min(limit, MAX_LEADERBOARD))
+        result = self.value_all()
+        totals = result['total_value']
+        if len(totals) > limit:
+            top = np.argpartition(-totals, limit - 1)[:limit]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.argsort(-totals[top], kind='stable')]
+
+        names = dict(db.session.execute(
+            select(users.c.id, users.c.username).where(users.c.id.in_(result['user_id'][top].tolist()))
+        ).all())
+        return [{
+            'rank': rank,
+            'user_id': int(result['user_id'][i]),
+            'username': names.get(int(result['user_id'][i])),
+            'total_value': float(totals[i]),
+            'portfolio_value': float(result['portfolio_value'][i]),
+            'unrealized_pnl': float(result['unrealized_pnl'][i]),
+            'realized_pnl': round(float(result['realized_pnl'][i]), money.USD_DECIMALS)
+        } for rank, i in enumerate(top, start=1)]
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'last_duration': self.last_duration,
+            'max_age': self.max_age
+        }
+
+
+portfolio_valuator = PortfolioValuator()
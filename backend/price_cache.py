@@ -0,0 +1,189 @@
+from database import db
+from models import Cryptocurrency
+from upstream import coingecko
+from price_history import record_ticks, retention
+from stream import broker
+from datetime import datetime
+import threading
+import time
+import os
+
+REFRESH_BATCH_SIZE = 250
+
+
+class PriceCache:
+    """Process-wide USD price cache kept warm by a background refresher.
+
+    Entries are ``coingecko_id -> (price, fetched_at)`` where ``fetched_at`` is a
+    ``time.monotonic()`` timestamp. Reads never touch the network.
+    """
+
+    def __init__(self, max_age=None, refresh_interval=None, fallback_max_age=None):
+        self.max_age = max_age if max_age is not None else float(os.environ.get('PRICE_CACHE_MAX_AGE', '60'))
+        self.fallback_max_age = fallback_max_age if fallback_max_age is not None else float(os.environ.get('PRICE_FALLBACK_MAX_AGE', '300'))
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.environ.get('PRICE_REFRESH_INTERVAL', '20'))
+        self._prices = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_refresh = None
+
+    def set(self, coingecko_id, price):
+        self.set_many({coingecko_id: price})
+
+    def add_listener(self, listener):
+        """Call ``listener({coingecko_id: price})`` with every batch of changed prices."""
+        self._listeners.append(listener)
+
+    def set_many(self, prices):
+        """Store prices and publish the ones that changed on the ``prices`` stream topic and to listeners."""
+        now = time.monotonic()
+        changed = {}
+        with self._lock:
+            for coingecko_id, price in prices.items():
+                if price is not None:
+                    previous = self._prices.get(coingecko_id)
+                    if previous is None or previous[0] != price:
+                        changed[coingecko_id] = price
+                    self._prices[coingecko_id] = (price, now)
+        if changed:
+            broker.publish('prices', 'prices', changed)
+            for listener in self._listeners:
+                listener(changed)
+
+    def snapshot(self, max_age=None):
+        """All fresh prices as ``{coingecko_id: price}`` without touching hit counters."""
+        max_age = self.max_age if max_age is None else max_age
+        now = time.monotonic()
+        with self._lock:
+            return {
+                coingecko_id: price
+                for coingecko_id, (price, fetched_at) in self._prices.items()
+                if now - fetched_at <= max_age
+            }
+
+    def get(self, coingecko_id, max_age=None):
+        """Return the cached price, or ``None`` if missing or older than ``max_age``."""
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            entry = self._prices.get(coingecko_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            price, fetched_at = entry
+            if time.monotonic() - fetched_at > max_age:
+                self.stale += 1
+                return None
+            self.hits += 1
+            return price
+
+    def get_price(self, crypto, max_age=None):
+        """Price for a ``Cryptocurrency`` row.
+
+        A fresh cache entry wins. When the cache has never seen the coin (cold
+        start) the stored ``current_price`` column is used instead, as long as
+        it is no older than ``fallback_max_age``. A stale entry yields ``None``
+        so the caller can fetch the price itself.
+        """
+        price = self.get(crypto.coingecko_id, max_age)
+        if price is not None:
+            return price
+        with self._lock:
+            cold = crypto.coingecko_id not in self._prices
+        return self.last_known(crypto) if cold else None
+
+    def last_known(self, crypto):
+        """The newest price of ``crypto`` from the cache or its row, if no older than ``fallback_max_age``.
+
+        What a trade may use while CoinGecko cannot be reached.
+        """
+        with self._lock:
+            entry = self._prices.get(crypto.coingecko_id)
+        if entry is not None and time.monotonic() - entry[1] <= self.fallback_max_age:
+            return entry[0]
+        if (crypto.current_price is not None and crypto.last_updated is not None
+                and (datetime.utcnow() - crypto.last_updated).total_seconds() <= self.fallback_max_age):
+            return crypto.current_price
+        return None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - fetched_at for _, fetched_at in self._prices.values()]
+            lookups = self.hits + self.misses + self.stale
+            return {
+                'entries': len(self._prices),
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'max_age': self.max_age,
+                'oldest_entry_age': max(ages) if ages else None,
+                'newest_entry_age': min(ages) if ages else None,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            }
+
+    def refresh(self):
+        """Fetch prices for every known coin in bulk and write them through to the DB."""
+        rows = db.session.query(Cryptocurrency.id, Cryptocurrency.coingecko_id).filter(
+            Cryptocurrency.coingecko_id.isnot(None)
+        ).all()
+        ids_by_gecko = {gecko_id: crypto_id for crypto_id, gecko_id in rows}
+        gecko_ids = list(ids_by_gecko)
+
+        prices = {}
+        for start in range(0, len(gecko_ids), REFRESH_BATCH_SIZE):
+            batch = gecko_ids[start:start + REFRESH_BATCH_SIZE]
+            quotes = coingecko.get_json('/simple/price', params={'ids': ','.join(batch), 'vs_currencies': 'usd'})
+            for gecko_id, quote in quotes.items():
+                if quote.get('usd') is not None:
+                    prices[gecko_id] = quote['usd']
+
+        now = datetime.utcnow()
+        db.session.bulk_update_mappings(Cryptocurrency, [
+            {'id': ids_by_gecko[gecko_id], 'current_price': price, 'last_updated': now}
+            for gecko_id, price in prices.items()
+        ])
+        record_ticks([(ids_by_gecko[gecko_id], price, 0.0) for gecko_id, price in prices.items()], 'refresh')
+        retention.maybe_prune()
+        db.session.commit()
+        # Listeners (trigger orders, cached market pages) run once the new prices are committed.
+        self.set_many(prices)
+
+        self.refreshes += 1
+        self.last_refresh = now
+        return len(prices)
+
+    def start(self, app):
+        if self._thread is not None or os.environ.get('PRICE_REFRESH_ENABLED', '1') != '1':
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='price-refresher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    self.refresh_errors += 1
+                    db.session.rollback()
+                    app.logger.exception('Price refresh failed')
+                finally:
+                    db.session.remove()
+            self._stop.wait(self.refresh_interval)
+
+
+price_cache = PriceCache()
@@ -0,0 +1,245 @@
+from database import db, dialect_insert, RoutingSession
+from models import PriceTick, Candle
+from sqlalchemy import case, event, func, delete
+from datetime import datetime, timedelta
+import threading
+import time
+import os
+
+INTERVALS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+MAX_CANDLES = 1000
+PENDING_TRADES = 'pending_trade_ticks'
+
+EPOCH = datetime(1970, 1, 1)
+
+ticks_table = PriceTick.__table__
+candles_table = Candle.__table__
+
+
+def bucket_start(timestamp, seconds):
+    elapsed = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=elapsed - elapsed % seconds)
+
+
+def _greatest(a, b):
+    # SQLite's multi-argument max()/min() are scalar, like GREATEST/LEAST.
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.greatest(a, b)
+    return func.max(a, b)
+
+
+def _least(a, b):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.least(a, b)
+    return func.min(a, b)
+
+
+def record_ticks(ticks, source, at=None):
+    """Append ``(crypto_id, price, volume)`` ticks and roll them into every candle interval.
+
+    Candles are maintained incrementally with one upsert per interval, so
+    reads never aggregate raw ticks. Runs in the caller's transaction and
+    does not commit. Ticks are stamped ``at`` (now by default).
+    """
+    now = at or datetime.utcnow()
+    return write_ticks([
+        {'crypto_id': crypto_id, 'price': price, 'volume': volume or 0.0, 'source': source, 'timestamp': now}
+        for crypto_id, price, volume in ticks
+    ])
+
+
+def write_ticks(rows):
+    """Insert tick rows and upsert their candles, in ascending ``crypto_id`` order.
+
+    Every writer touches candle rows in the same order, so concurrent
+    refreshes, ingestion runs and trade flushes cannot deadlock on them.
+    Open and close follow tick timestamps, not write order: a trade flushed
+    after a newer refresher tick does not replace that tick's close.
+    """
+    rows = [row for row in rows if row['price'] is not None]
+    if not rows:
+        return 0
+
+    db.session.execute(ticks_table.insert(), rows)
+
+    stmt = dialect_insert(candles_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[candles_table.c.crypto_id, candles_table.c.interval, candles_table.c.bucket_start],
+        set_={
+            'high': _greatest(candles_table.c.high, stmt.excluded.high),
+            'low': _least(candles_table.c.low, stmt.excluded.low),
+            'open': case((stmt.excluded.open_at < candles_table.c.open_at, stmt.excluded.open),
+                         else_=candles_table.c.open),
+            'open_at': _least(candles_table.c.open_at, stmt.excluded.open_at),
+            'close': case((stmt.excluded.close_at >= candles_table.c.close_at, stmt.excluded.close),
+                          else_=candles_table.c.close),
+            'close_at': _greatest(candles_table.c.close_at, stmt.excluded.close_at),
+            'volume': candles_table.c.volume + stmt.excluded.volume,
+            'ticks': candles_table.c.ticks + stmt.excluded.ticks
+        }
+    )
+    for interval, seconds in INTERVALS.items():
+        buckets = {}
+        for row in rows:
+            key = (row['crypto_id'], bucket_start(row['timestamp'], seconds))
+            candle = buckets.get(key)
+            if candle is None:
+                buckets[key] = {
+                    'crypto_id': key[0], 'interval': interval, 'bucket_start': key[1],
+                    'open': row['price'], 'high': row['price'], 'low': row['price'], 'close': row['price'],
+                    'open_at': row['timestamp'], 'close_at': row['timestamp'], 'volume': row['volume'], 'ticks': 1
+                }
+            else:
+                candle['high'] = max(candle['high'], row['price'])
+                candle['low'] = min(candle['low'], row['price'])
+                if row['timestamp'] < candle['open_at']:
+                    candle['open'], candle['open_at'] = row['price'], row['timestamp']
+                if row['timestamp'] >= candle['close_at']:
+                    candle['close'], candle['close_at'] = row['price'], row['timestamp']
+                candle['volume'] += row['volume']
+                candle['ticks'] += 1
+        db.session.execute(stmt, [buckets[key] for key in sorted(buckets)])
+    return len(rows)
+
+
+def record_trade(crypto_id, price, amount):
+    """Queue a trade tick; it is written by ``trade_ticks`` once the trade commits.
+
+    Upserting candles inside the trade would hold them locked along with the
+    trade's user and holding rows, serializing every trade on the coin.
+    """
+    db.session.info.setdefault(PENDING_TRADES, []).append({
+        'crypto_id': crypto_id, 'price': price, 'volume': amount or 0.0, 'source': 'trade',
+        'timestamp': datetime.utcnow()
+    })
+
+
+class TradeTickWriter:
+    """Buffers committed trade ticks and writes them in batches from a background thread."""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else float(os.environ.get('TRADE_TICK_FLUSH_INTERVAL', '1'))
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+
+    def add(self, rows):
+        with self._lock:
+            self._pending.extend(rows)
+
+    def flush(self):
+        """Write every buffered tick in one transaction; on failure they are kept for the next try."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        try:
+            write_ticks(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._pending[:0] = rows
+            raise
+        self.flushes += 1
+        self.written += len(rows)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'pending': pending, 'flushes': self.flushes, 'written': self.written, 'errors': self.errors}
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='trade-tick-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self.errors += 1
+                    app.logger.exception('Trade tick flush failed')
+                finally:
+                    db.session.remove()
+
+
+trade_ticks = TradeTickWriter()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _queue_committed_trades(session):
+    rows = session.info.pop(PENDING_TRADES, None)
+    if rows:
+        trade_ticks.add(rows)
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _drop_pending_trades(session, previous_transaction):
+    session.info.pop(PENDING_TRADES, None)
+
+
+def candles_for(crypto_id, interval, start=None, end=None, limit=MAX_CANDLES):
+    """Candles in ascending time order; without ``start`` the most recent ``limit``."""
+    limit = max(1, min(limit, MAX_CANDLES))
+    query = Candle.query.filter(Candle.crypto_id == crypto_id, Candle.interval == interval)
+    if end is not None:
+        query = query.filter(Candle.bucket_start <= end)
+    if start is not None:
+        return query.filter(Candle.bucket_start >= start).order_by(Candle.bucket_start).limit(limit).all()
+    return list(reversed(query.order_by(Candle.bucket_start.desc()).limit(limit).all()))
+
+
+class RetentionPolicy:
+    """Bounds storage: raw ticks are kept briefly, finer candles for less time than coarse ones."""
+
+    def __init__(self, raw_ticks=None, candles=None, interval=None):
+        self.raw_ticks = raw_ticks or timedelta(hours=float(os.environ.get('PRICE_TICK_RETENTION_HOURS', '24')))
+        self.candles = candles or {
+            '1m': timedelta(days=7),
+            '5m': timedelta(days=30),
+            '1h': timedelta(days=365),
+            '1d': None
+        }
+        self.interval = interval if interval is not None else float(os.environ.get('PRICE_HISTORY_PRUNE_INTERVAL', '3600'))
+        self._last_prune = None
+        self._lock = threading.Lock()
+
+    def prune(self, now=None):
+        now = now or datetime.utcnow()
+        deleted = db.session.execute(
+            delete(ticks_table).where(ticks_table.c.timestamp < now - self.raw_ticks)
+        ).rowcount
+        for interval, keep in self.candles.items():
+            if keep is None:
+                continue
+            deleted += db.session.execute(
+                delete(candles_table).where(
+                    candles_table.c.interval == interval,
+                    candles_table.c.bucket_start < now - keep
+                )
+            ).rowcount
+        return deleted
+
+    def maybe_prune(self):
+        """Prune at most once per ``interval`` seconds; does not commit."""
+        with self._lock:
+            if self._last_prune is not None and time.monotonic() - self._last_prune < self.interval:
+                return 0
+            self._last_prune = time.monotonic()
+        return self.prune()
+
+
+retention = RetentionPolicy()
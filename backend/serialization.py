@@ -0,0 +1,160 @@
+"""JSON encoding, conditional GETs and compression for API responses.
+
+``dumps`` uses orjson when it is installed (it is in requirements.txt) and
+the standard library otherwise. Ledger ``Decimal`` values are written as
+JSON numbers and datetimes in ISO 8601, as the API always has.
+
+``init_serialization`` adds an after-request hook for JSON ``GET``
+responses. It gives them a weak ``ETag`` (views serving a cached body reuse
+the one stored with it instead of hashing again), answers a matching
+``If-None-Match`` with ``304 Not Modified``, and compresses bodies of
+``RESPONSE_COMPRESS_MIN_BYTES`` or more with brotli (if the ``brotli``
+package is installed) or gzip, whichever the client prefers. Compressed
+cached bodies are kept per worker by ETag, so a shared payload such as a
+markets page is compressed once per version, not once per request.
+"""
+from flask import current_app, request
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+import threading
+import hashlib
+import gzip
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+COMPRESSED_CACHE_SIZE = int(os.environ.get('RESPONSE_COMPRESSED_CACHE_SIZE', '256'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+Encoded = namedtuple('Encoded', ['body', 'etag'])
+
+
+def _default(o):
+    if isinstance(o, Decimal):
+        return float(o)
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    if hasattr(o, 'item'):
+        return o.item()  # numpy scalars
+    raise TypeError(f'{type(o).__name__} is not JSON serializable')
+
+
+def dumps(obj, sort_keys=False, indent=False):
+    """Encode ``obj`` as UTF-8 JSON bytes."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode()
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def etag_for(body):
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+def encode(obj):
+    """``obj`` as JSON bytes together with their ETag."""
+    body = dumps(obj)
+    return Encoded(body, etag_for(body))
+
+
+EMPTY_LIST = encode([])
+
+
+def json_body(encoded, status=200):
+    """A response for already encoded JSON; the after-request hook takes its ETag as is."""
+    response = current_app.response_class(encoded.body, status=status, mimetype='application/json')
+    response.set_etag(encoded.etag, weak=True)
+    return response
+
+
+class CompressedCache:
+    """LRU of ``(etag, encoding) -> compressed body``."""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size if max_size is not None else COMPRESSED_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag, encoding, body):
+        key = (etag, encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+        compressed = compress(body, encoding)
+        with self._lock:
+            self._entries[key] = compressed
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return compressed
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'encodings': list(ENCODINGS)}
+
+
+compressed_cache = CompressedCache()
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def _finish(response):
+    if (request.method != 'GET' or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    etag, _ = response.get_etag()
+    cached = etag is not None
+    if not cached:
+        etag = etag_for(response.get_data())
+        response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        return response.make_conditional(request)
+
+    if response.content_length is None or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    response.set_data(compressed_cache.get(etag, encoding, body) if cached else compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_serialization(app):
+    app.after_request(_finish)
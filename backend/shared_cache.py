@@ -0,0 +1,298 @@
+"""Response cache shared by every worker, with stale-while-revalidate.
+
+``CACHE_URL`` picks the backend: empty or ``memory://`` keeps entries in this
+process, ``redis://host:6379/0`` (needs the ``redis`` package) shares them
+between workers and nodes. Any Redis-protocol server works.
+
+``get_or_compute`` returns a fresh entry as is. Past its ``ttl`` an entry is
+still served for ``stale_ttl`` more seconds while one worker, holding a short
+lock, recomputes it in the background. A ``compute`` that returns
+``NOT_FOUND`` is remembered for ``negative_ttl`` seconds; one that returns
+``None`` is not stored at all.
+
+``invalidate`` bumps a per-key generation instead of deleting, so a refresh
+that started before the invalidation cannot write its outdated result back.
+Entries given a ``group`` share the group's generation, so one
+``invalidate(group)`` drops all of them. When the backend is unreachable
+every lookup computes directly.
+
+Values are stored as encoded JSON after a one-line header. ``get_encoded``
+hands a hit back as those bytes with the ETag computed when they were
+stored, so a view can send it without decoding and encoding it again.
+
+The same backends keep the rate limit token buckets of ``admission``.
+"""
+from flask import current_app
+from database import db
+from serialization import Encoded, dumps, encode, loads
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import os
+
+CACHE_URL = os.environ.get('CACHE_URL', '')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'cx:')
+REFRESH_LOCK_SECONDS = 30
+GENERATION_TTL = 86400
+
+NOT_FOUND = object()
+_UNDECODED = object()
+
+
+def _encoded(value):
+    return value, (None if value is None or value is NOT_FOUND else encode(value))
+
+
+class MemoryBackend:
+    """Per-process stand-in for Redis with the few commands the cache needs."""
+
+    errors = ()
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get('CACHE_MAX_ENTRIES', '10000'))
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _store(self, key, value, ttl, now):
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            for stale in [k for k, (_, expires) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            if len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = (value, now + ttl)
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return [entry[0] if entry else None for entry in (self._live(key, now) for key in keys)]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._store(key, value, ttl, time.monotonic())
+
+    def add(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def incr(self, key, ttl):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            value = int(entry[0]) + 1 if entry else 1
+            self._store(key, str(value).encode(), ttl, now)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pop(self, key):
+        """Delete ``key`` and return its value, or ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                return None
+            del self._entries[key]
+            return entry[0]
+
+    def take(self, key, rate, capacity):
+        """Take a token from the bucket at ``key``: 0, or seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            tokens, at = entry[0] if entry else (capacity, now)
+            tokens = min(capacity, tokens + (now - at) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            # A bucket left alone this long is full again, the same as a missing one.
+            self._store(key, (tokens, now), capacity / rate, now)
+            return wait
+
+
+# Token bucket on the server clock, so every worker and node sees the same refill.
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or capacity
+local at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.errors = (redis.exceptions.RedisError,)
+        self._take = self.client.register_script(_TAKE_SCRIPT)
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def incr(self, key, ttl):
+        pipe = self.client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, int(ttl))
+        return pipe.execute()[0]
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def pop(self, key):
+        return self.client.getdel(key)
+
+    def take(self, key, rate, capacity):
+        return float(self._take(keys=[key], args=[rate, capacity]))
+
+
+def backend_from_url(url):
+    if not url or url.startswith('memory:'):
+        return MemoryBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f'Unsupported CACHE_URL: {url}')
+
+
+def _split(raw):
+    """``(header, body)`` of a stored entry, or ``None`` for one in an older format."""
+    header, _, body = raw.partition(b'\n')
+    header = loads(header)
+    return (header, body) if 'e' in header else None
+
+
+class SharedCache:
+    def __init__(self, backend=None, prefix=CACHE_PREFIX):
+        self.backend = backend if backend is not None else backend_from_url(CACHE_URL)
+        self.prefix = prefix
+        self._refresher = ThreadPoolExecutor(int(os.environ.get('CACHE_REFRESH_WORKERS', '2')),
+                                             thread_name_prefix='cache-refresh')
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def get_or_compute(self, key, compute, ttl, stale_ttl=0, negative_ttl=None, group=None):
+        value, encoded = self._lookup(key, compute, ttl, stale_ttl, negative_ttl, group)
+        return loads(encoded.body) if value is _UNDECODED else value
+
+    def get_encoded(self, key, compute, ttl, stale_ttl=0, negative_ttl=None, group=None):
+        """Like ``get_or_compute``, but a value comes back as ``Encoded`` JSON; hits are never decoded."""
+        value, encoded = self._lookup(key, compute, ttl, stale_ttl, negative_ttl, group)
+        return value if encoded is None else encoded
+
+    def invalidate(self, key):
+        """Drop ``key``, or every entry of the group ``key``."""
+        try:
+            self.backend.incr(self.prefix + key + ':gen', GENERATION_TTL)
+        except self.backend.errors:
+            self.errors += 1
+
+    def _lookup(self, key, compute, ttl, stale_ttl, negative_ttl, group):
+        """``(value, encoded)``; ``value`` is ``_UNDECODED`` for a hit, ``encoded`` is ``None`` without a value."""
+        generation_key = self.prefix + (group or key) + ':gen'
+        key = self.prefix + key
+        try:
+            raw, generation = self.backend.get_many([key, generation_key])
+        except self.backend.errors:
+            self.errors += 1
+            return _encoded(compute())
+        generation = int(generation or 0)
+        entry = _split(raw) if raw else None
+        if entry is None or entry[0]['g'] != generation:
+            self.misses += 1
+            return self._compute_and_store(key, generation, compute, ttl, stale_ttl, negative_ttl)
+
+        header, body = entry
+        if header['f'] > time.time():
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self._refresh_in_background(key, generation_key, compute, ttl, stale_ttl, negative_ttl)
+        return (NOT_FOUND, None) if header['n'] else (_UNDECODED, Encoded(body, header['e']))
+
+    def _compute_and_store(self, key, generation, compute, ttl, stale_ttl, negative_ttl):
+        value, encoded = _encoded(compute())
+        if value is None or (value is NOT_FOUND and not negative_ttl):
+            return value, encoded
+        negative = value is NOT_FOUND
+        fresh = negative_ttl if negative else ttl
+        header = dumps({'g': generation, 'f': time.time() + fresh, 'n': negative, 'e': '' if negative else encoded.etag})
+        try:
+            self.backend.set(key, header + b'\n' + (b'' if negative else encoded.body),
+                             fresh + (0 if negative else stale_ttl))
+        except self.backend.errors:
+            self.errors += 1
+        return value, encoded
+
+    def _refresh_in_background(self, key, generation_key, compute, ttl, stale_ttl, negative_ttl):
+        lock = key + ':refreshing'
+        try:
+            if not self.backend.add(lock, b'1', REFRESH_LOCK_SECONDS):
+                return
+        except self.backend.errors:
+            self.errors += 1
+            return
+        app = current_app._get_current_object()
+
+        def refresh():
+            with app.app_context():
+                try:
+                    generation = int(self.backend.get_many([generation_key])[0] or 0)
+                    self._compute_and_store(key, generation, compute, ttl, stale_ttl, negative_ttl)
+                    self.refreshes += 1
+                except Exception:
+                    self.errors += 1
+                    app.logger.exception('Refreshing cache entry %s failed', key)
+                finally:
+                    db.session.remove()
+                    try:
+                        self.backend.delete(lock)
+                    except self.backend.errors:
+                        pass
+
+        self._refresher.submit(refresh)
+
+    def stats(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'errors': self.errors
+        }
+
+
+response_cache = SharedCache()
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import itertools
+import threading
+import json
+import os
+
+RESYNC = 'resync'
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """One client's view of the broker: a small buffer of pending events.
+
+    Delta events on the same topic are conflated: a newer delta is merged into
+    the pending one (last value per key wins), so a slow reader of price or
+    book topics holds at most one pending event per topic. Events that cannot
+    be merged (fills) queue up to ``max_pending``; past that the buffer is
+    discarded and the reader is told to resync from the REST endpoints.
+    """
+
+    def __init__(self, topics, max_pending):
+        self.topics = frozenset(topics)
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self.closed = False
+        self.dropped = 0
+
+    def offer(self, topic, kind, data, conflate, nested=False):
+        with self._cond:
+            if self.closed:
+                return
+            if kind == 'reset':
+                # Anything queued for the topic is superseded by the reset.
+                for stale in [k for k in self._pending if k[0] == topic]:
+                    del self._pending[stale]
+            key = (topic, kind) if conflate else (topic, kind, next(self._seq))
+            pending = self._pending.get(key)
+            if pending is not None:
+                # Published data is shared between subscribers; copy before the first merge.
+                if not pending[1]:
+                    pending[:] = [copy(pending[0], nested), True]
+                merge(pending[0], data, nested)
+            else:
+                if len(self._pending) >= self.max_pending:
+                    self.dropped += len(self._pending)
+                    self._pending.clear()
+                    self._pending[(None, RESYNC)] = [{}, True]
+                self._pending[key] = [data, False]
+            self._cond.notify()
+
+    def drain(self, timeout):
+        """Wait up to ``timeout`` seconds and return ``[(id, topic, kind, data)]``."""
+        with self._cond:
+            if not self._pending and not self.closed:
+                self._cond.wait(timeout)
+            events = [(next(self._ids), key[0], key[1], data) for key, (data, _) in self._pending.items()]
+            self._pending.clear()
+            return events
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+
+def copy(data, nested):
+    if nested:
+        return {key: dict(value) for key, value in data.items()}
+    return dict(data)
+
+
+def merge(pending, data, nested):
+    """Last value per key wins; ``nested`` deltas (``{side: {price: qty}}``) merge one level down."""
+    if not nested:
+        pending.update(data)
+        return
+    for key, value in data.items():
+        if key in pending:
+            pending[key].update(value)
+        else:
+            pending[key] = dict(value)
+
+
+class Broker:
+    """In-process publish/subscribe hub fanning events out to stream clients.
+
+    ``publish`` never blocks on a subscriber: each subscription buffers (and
+    conflates) on its own, so one slow client cannot hold up the publisher or
+    anybody else.
+    """
+
+    def __init__(self, max_subscribers=None, max_pending=None):
+        self.max_subscribers = max_subscribers or int(os.environ.get('STREAM_MAX_SUBSCRIBERS', '5000'))
+        self.max_pending = max_pending or int(os.environ.get('STREAM_MAX_PENDING', '256'))
+        self._topics = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics, self.max_pending)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers('Too many stream subscribers')
+            self._count += 1
+            for topic in subscription.topics:
+                self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        with self._lock:
+            self._count -= 1
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    def publish(self, topic, kind, data, conflate=True, nested=False):
+        """Offer ``data`` to every subscriber of ``topic``; callers must not mutate it afterwards."""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        self.published += 1
+        for subscription in subscribers:
+            subscription.offer(topic, kind, data, conflate, nested)
+        return len(subscribers)
+
+    def has_subscribers(self, topic):
+        return topic in self._topics
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'topics': len(self._topics),
+                'published': self.published,
+                'max_pending': self.max_pending
+            }
+
+
+def format_event(event_id, topic, kind, data):
+    """Serialize one event in text/event-stream framing."""
+    payload = json.dumps({'topic': topic, 'data': data}, separators=(',', ':'))
+    prefix = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{prefix}event: {kind}\ndata: {payload}\n\n'
+
+
+broker = Broker()
@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import app as appmod
+from database import db, upgrade_db
+from models import Cryptocurrency
+
+
+@pytest.fixture
+def exchange(tmp_path):
+    """The app on a fresh, fully migrated SQLite database with one coin, BTC."""
+    app = appmod.create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "exchange.db"}'},
+                            start_services=False)
+    with app.app_context():
+        upgrade_db()
+        db.session.add(Cryptocurrency(symbol='BTC', name='Bitcoin', coingecko_id='bitcoin', current_price=1))
+        db.session.commit()
+    appmod.matching_engine.books.clear()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,89 @@
+"""Limit orders matched through the API against a throwaway SQLite database."""
+from decimal import Decimal
+
+from flask_jwt_extended import create_access_token
+
+import app as appmod
+from database import db
+from models import Cryptocurrency, Holdings, Order, User
+
+
+def make_user(app, name, balance_usd, btc=0):
+    with app.app_context():
+        user = User(username=name, email=f'{name}@example.com', password_hash='-', balance_usd=balance_usd)
+        db.session.add(user)
+        db.session.flush()
+        if btc:
+            coin = Cryptocurrency.query.filter_by(coingecko_id='bitcoin').one()
+            db.session.add(Holdings(user_id=user.id, crypto_id=coin.id, amount=btc, cost_basis=0))
+        db.session.commit()
+        return user.id, {'Authorization': 'Bearer ' + create_access_token(identity=str(user.id))}
+
+
+def place(client, headers, order_type, quantity, price):
+    return client.post('/api/orders', headers=headers, json={
+        'crypto_id': 'bitcoin', 'order_type': order_type, 'quantity': quantity, 'price': price
+    })
+
+
+def test_buy_reservation_rounds_up_to_the_cent(exchange):
+    # 0.05 @ 0.5 is 0.025: it reserves 0.03, so a 0.02 balance cannot place it.
+    # Rounded half-even it reserved 0.02, and a 0.03 fill costing 0.02 then
+    # released only 0.01 and cancelled the order instead of filling it.
+    _, buyer = make_user(exchange, 'buyer', Decimal('0.02'))
+    client = exchange.test_client()
+
+    response = place(client, buyer, 'buy', 0.05, 0.5)
+
+    assert response.status_code == 400
+    assert response.json['message'] == 'Insufficient funds to place buy order'
+
+
+def test_fills_of_a_fully_reserved_buy_always_settle(exchange):
+    # Fills round down: 0.03 @ 0.5 costs 0.01 out of the 0.02 it releases,
+    # and the last 0.02 costs 0.01 out of the 0.01 still reserved.
+    buyer_id, buyer = make_user(exchange, 'buyer', Decimal('0.03'))
+    seller_id, seller = make_user(exchange, 'seller', Decimal('0'), btc=Decimal('1'))
+    client = exchange.test_client()
+
+    assert place(client, buyer, 'buy', 0.05, 0.5).status_code == 201
+    first = place(client, seller, 'sell', 0.03, 0.5)
+    second = place(client, seller, 'sell', 0.02, 0.5)
+
+    assert [len(response.json['fills']) for response in (first, second)] == [1, 1]
+    with exchange.app_context():
+        buy_order = Order.query.filter_by(user_id=buyer_id).one()
+        assert not buy_order.is_active and buy_order.filled_quantity == Decimal('0.05')
+        buyer_row = db.session.get(User, buyer_id)
+        assert (buyer_row.balance_usd, buyer_row.locked_usd) == (Decimal('0.01'), Decimal('0'))
+        assert db.session.get(User, seller_id).balance_usd == Decimal('0.02')
+
+
+def test_cancel_of_an_order_filled_after_the_active_check_is_refused(exchange, monkeypatch):
+    _, buyer = make_user(exchange, 'buyer', Decimal('10'))
+    client = exchange.test_client()
+    order_id = place(client, buyer, 'buy', 1, 1).json['id']
+
+    def filled_meanwhile(order_id):
+        Order.query.filter_by(id=order_id).update({'filled_quantity': 1, 'is_active': False})
+        return deactivate_order(order_id)
+
+    deactivate_order = appmod.deactivate_order
+    monkeypatch.setattr(appmod, 'deactivate_order', filled_meanwhile)
+    response = client.delete(f'/api/orders/{order_id}', headers=buyer)
+
+    assert response.status_code == 404
+    assert response.json['message'] == 'Order not found or already executed'
+
+
+def test_batch_cancel_refuses_a_boolean_order_id(exchange):
+    buyer_id, buyer = make_user(exchange, 'buyer', Decimal('10'))
+    client = exchange.test_client()
+    assert place(client, buyer, 'buy', 1, 1).json['id'] == 1
+
+    response = client.post('/api/orders/batch', headers=buyer,
+                           json={'operations': [{'action': 'cancel', 'order_id': True}]})
+
+    assert response.json['results'] == [{'status': 400, 'message': 'Invalid operation'}]
+    with exchange.app_context():
+        assert Order.query.filter_by(user_id=buyer_id).one().is_active
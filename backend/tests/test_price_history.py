@@ -0,0 +1,41 @@
+"""Candles built from refresher ticks and late, batched trade ticks."""
+from datetime import datetime
+
+from database import db
+from models import Candle
+from price_history import record_ticks, write_ticks
+
+
+def trade(price, at):
+    return {'crypto_id': 1, 'price': price, 'volume': 1.0, 'source': 'trade', 'timestamp': at}
+
+
+def candle(interval, bucket_start):
+    return db.session.get(Candle, (1, interval, bucket_start))
+
+
+def test_late_trade_flush_keeps_the_newer_close(exchange):
+    with exchange.app_context():
+        record_ticks([(1, 100.0, 0)], 'refresh', at=datetime(2026, 1, 1, 12, 0, 30))
+        db.session.commit()
+        # Traded at :10 and :40, written after the :30 tick.
+        write_ticks([trade(90.0, datetime(2026, 1, 1, 12, 0, 40)), trade(95.0, datetime(2026, 1, 1, 12, 0, 10))])
+        db.session.commit()
+
+        minute = candle('1m', datetime(2026, 1, 1, 12, 0))
+        assert (minute.open, minute.close) == (95.0, 90.0)
+        assert (minute.open_at, minute.close_at) == (datetime(2026, 1, 1, 12, 0, 10), datetime(2026, 1, 1, 12, 0, 40))
+        assert (minute.high, minute.low, minute.ticks) == (100.0, 90.0, 3)
+
+
+def test_late_trade_from_the_previous_minute_does_not_replace_the_close(exchange):
+    with exchange.app_context():
+        record_ticks([(1, 100.0, 0)], 'refresh', at=datetime(2026, 1, 1, 12, 1, 5))
+        db.session.commit()
+        write_ticks([trade(90.0, datetime(2026, 1, 1, 12, 0, 59))])
+        db.session.commit()
+
+        assert candle('1m', datetime(2026, 1, 1, 12, 0)).close == 90.0
+        assert candle('1m', datetime(2026, 1, 1, 12, 1)).close == 100.0
+        five_minutes = candle('5m', datetime(2026, 1, 1, 12, 0))
+        assert (five_minutes.open, five_minutes.close) == (90.0, 100.0)
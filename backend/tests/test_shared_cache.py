@@ -0,0 +1,155 @@
+"""Two SharedCache instances, as two workers would have, on one fakeredis server."""
+import threading
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from shared_cache import NOT_FOUND, RedisBackend, SharedCache
+
+
+class Source:
+    """A compute function that counts its calls and returns ``value``, once ``gate`` is set."""
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.gate.wait(2)
+        return self.value
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', lambda url, **options: fakeredis.FakeRedis(server=server))
+    return server
+
+
+@pytest.fixture
+def workers(server, exchange):
+    with exchange.app_context():
+        yield SharedCache(RedisBackend('redis://cache'), 'test:'), SharedCache(RedisBackend('redis://cache'), 'test:')
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_an_entry_computed_by_one_worker_is_a_hit_on_the_other(workers):
+    first, second = workers
+    source = Source({'balance': 1})
+
+    assert first.get_or_compute('portfolio:1', source, 60) == {'balance': 1}
+    assert second.get_or_compute('portfolio:1', source, 60) == {'balance': 1}
+
+    assert source.calls == 1
+    assert (first.stats()['misses'], second.stats()['hits']) == (1, 1)
+
+
+def test_encoded_hits_keep_their_etag(workers):
+    first, second = workers
+    stored = first.get_encoded('markets:1', Source([1, 2]), 60)
+    hit = second.get_encoded('markets:1', Source([3]), 60)
+
+    assert (hit.body, hit.etag) == (stored.body, stored.etag)
+
+
+def test_invalidate_on_one_worker_drops_the_entry_for_both(workers):
+    first, second = workers
+    first.get_or_compute('portfolio:1', Source('old'), 60)
+
+    second.invalidate('portfolio:1')
+
+    assert first.get_or_compute('portfolio:1', Source('new'), 60) == 'new'
+    assert second.get_or_compute('portfolio:1', Source('newer'), 60) == 'new'
+
+
+def test_invalidating_a_group_drops_all_its_entries(workers):
+    first, second = workers
+    for page in (1, 2):
+        first.get_or_compute(f'markets:{page}', Source('old'), 60, group='markets')
+    first.get_or_compute('coin:bitcoin', Source('old'), 60)
+
+    second.invalidate('markets')
+
+    assert [second.get_or_compute(f'markets:{page}', Source('new'), 60, group='markets') for page in (1, 2)] == ['new', 'new']
+    assert second.get_or_compute('coin:bitcoin', Source('new'), 60) == 'old'
+
+
+def test_not_found_is_cached_for_the_negative_ttl_only(workers):
+    first, second = workers
+    source = Source(NOT_FOUND)
+
+    assert first.get_or_compute('coin:nope', source, 60, negative_ttl=0.1) is NOT_FOUND
+    assert second.get_or_compute('coin:nope', source, 60, negative_ttl=0.1) is NOT_FOUND
+    assert source.calls == 1
+
+    time.sleep(0.15)
+    second.get_or_compute('coin:nope', source, 60, negative_ttl=0.1)
+    assert source.calls == 2
+
+
+def test_none_is_not_stored(workers):
+    first, second = workers
+    source = Source(None)
+
+    assert first.get_or_compute('markets:1', source, 60) is None
+    assert second.get_or_compute('markets:1', source, 60) is None
+    assert source.calls == 2
+
+
+def test_stale_entry_is_served_while_one_worker_refreshes_it(workers):
+    first, second = workers
+    first.get_or_compute('coin:bitcoin', Source('old'), 0.05, stale_ttl=60)
+    time.sleep(0.1)
+    source = Source('new')
+    source.gate.clear()
+
+    assert first.get_or_compute('coin:bitcoin', source, 0.05, stale_ttl=60) == 'old'
+    assert second.get_or_compute('coin:bitcoin', source, 0.05, stale_ttl=60) == 'old'
+    source.gate.set()
+    wait_for(lambda: first.stats()['refreshes'] == 1)
+
+    assert source.calls == 1
+    assert second.stats()['refreshes'] == 0
+    assert second.get_or_compute('coin:bitcoin', source, 60) == 'new'
+
+
+def test_refresh_overtaken_by_an_invalidation_is_not_served(workers):
+    first, second = workers
+    first.get_or_compute('portfolio:1', Source('old'), 0.05, stale_ttl=60)
+    time.sleep(0.1)
+    source = Source('refreshed before the trade')
+    source.gate.clear()
+
+    first.get_or_compute('portfolio:1', source, 0.05, stale_ttl=60)
+    second.invalidate('portfolio:1')
+    source.gate.set()
+    wait_for(lambda: first.stats()['refreshes'] == 1)
+
+    assert second.get_or_compute('portfolio:1', Source('after the trade'), 60) == 'after the trade'
+
+
+def test_lookups_compute_directly_while_redis_is_down(server, workers):
+    first, _ = workers
+    source = Source('value')
+
+    server.connected = False
+    assert first.get_or_compute('portfolio:1', source, 60) == 'value'
+    first.invalidate('portfolio:1')
+    assert first.get_or_compute('portfolio:1', source, 60) == 'value'
+    assert (source.calls, first.stats()['errors']) == (2, 3)
+
+    server.connected = True
+    first.get_or_compute('portfolio:1', source, 60)
+    first.get_or_compute('portfolio:1', source, 60)
+    assert source.calls == 3
@@ -0,0 +1,225 @@
+"""UpstreamClient against a scripted CoinGecko stand-in on a local port."""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import json
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from upstream import UpstreamClient, UpstreamError, UpstreamHTTPError
+
+
+class StubServer:
+    """Answers each path from a script of ``(status, headers, body, delay)`` responses.
+
+    The last response of a script repeats. Every request is logged as
+    ``(path, query, client port)``.
+    """
+
+    def __init__(self):
+        self.scripts = {}
+        self.log = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def script(self, path, *responses):
+        self.scripts[path] = list(responses)
+
+    def hits(self, path):
+        return sum(1 for logged, _, _ in self.log if logged == path)
+
+    def _next(self, path):
+        with self._lock:
+            script = self.scripts.get(path) or [(404, {}, {'error': 'unknown endpoint'}, 0)]
+            return script.pop(0) if len(script) > 1 else script[0]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                stub.log.append((url.path, url.query, self.client_address[1]))
+                status, headers, body, delay = stub._next(url.path)
+                if delay:
+                    time.sleep(delay)
+                payload = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:  # the client gave up waiting
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def ok(body, delay=0):
+    return 200, {}, body, delay
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def make_client(stub, **options):
+    options.setdefault('backoff', 0.01)
+    options.setdefault('read_timeout', 2)
+    return UpstreamClient(stub.base_url, **options)
+
+
+def test_returns_json_over_a_kept_alive_connection(stub):
+    stub.script('/simple/price', ok({'bitcoin': {'usd': 100}}))
+    client = make_client(stub)
+
+    assert client.get_json('/simple/price', {'ids': 'bitcoin'}) == {'bitcoin': {'usd': 100}}
+    assert client.get_json('/simple/price', {'ids': 'bitcoin'}) == {'bitcoin': {'usd': 100}}
+
+    assert [query for _, query, _ in stub.log] == ['ids=bitcoin', 'ids=bitcoin']
+    assert len({port for _, _, port in stub.log}) == 1
+    assert client.stats()['requests'] == 2
+
+
+def test_concurrent_identical_calls_share_one_request(stub):
+    stub.script('/coins/bitcoin', ok({'id': 'bitcoin'}, delay=0.3))
+    client = make_client(stub)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: client.get_json('/coins/bitcoin'), range(8)))
+
+    assert results == [{'id': 'bitcoin'}] * 8
+    assert stub.hits('/coins/bitcoin') == 1
+    assert client.stats()['coalesced'] == 7
+    assert client.stats()['in_flight'] == 0
+
+
+def test_calls_with_different_params_are_not_coalesced(stub):
+    stub.script('/simple/price', ok({}, delay=0.2))
+    client = make_client(stub)
+
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda coin: client.get_json('/simple/price', {'ids': coin}), ['a', 'b']))
+
+    assert stub.hits('/simple/price') == 2
+    assert client.stats()['coalesced'] == 0
+
+
+def test_waiters_receive_the_leaders_error(stub):
+    stub.script('/coins/bitcoin', (500, {}, {}, 0.3))
+    client = make_client(stub, max_retries=0)
+
+    def call(_):
+        with pytest.raises(UpstreamHTTPError) as info:
+            client.get_json('/coins/bitcoin')
+        return info.value.status_code
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(call, range(4))) == [500] * 4
+    assert stub.hits('/coins/bitcoin') == 1
+
+
+def test_429_waits_for_retry_after(stub):
+    stub.script('/coins/markets', (429, {'Retry-After': '0.3'}, {}, 0), ok([{'id': 'bitcoin'}]))
+    client = make_client(stub)
+
+    started = time.monotonic()
+    assert client.get_json('/coins/markets') == [{'id': 'bitcoin'}]
+
+    assert time.monotonic() - started >= 0.3
+    assert stub.hits('/coins/markets') == 2
+    assert client.stats()['retries'] == 1
+
+
+def test_retry_after_beyond_the_limit_fails_at_once(stub):
+    stub.script('/coins/markets', (429, {'Retry-After': '30'}, {}, 0), ok([]))
+    client = make_client(stub, max_retry_after=1)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamHTTPError) as info:
+        client.get_json('/coins/markets')
+
+    assert info.value.status_code == 429
+    assert time.monotonic() - started < 1
+    assert stub.hits('/coins/markets') == 1
+
+
+def test_server_errors_back_off_then_give_up(stub):
+    stub.script('/simple/price', (503, {}, {}, 0))
+    client = make_client(stub, max_retries=2, backoff=0.1)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamHTTPError) as info:
+        client.get_json('/simple/price')
+
+    # Jittered exponential backoff: at least half of 0.1 + 0.2 seconds.
+    assert time.monotonic() - started >= 0.15
+    assert info.value.status_code == 503
+    assert stub.hits('/simple/price') == 3
+    assert client.stats()['retries'] == 2
+    assert client.stats()['errors'] == 1
+
+
+def test_server_error_then_success_is_retried(stub):
+    stub.script('/simple/price', (502, {}, {}, 0), ok({'bitcoin': {'usd': 1}}))
+    client = make_client(stub)
+
+    assert client.get_json('/simple/price') == {'bitcoin': {'usd': 1}}
+    assert stub.hits('/simple/price') == 2
+
+
+def test_client_errors_are_not_retried(stub):
+    client = make_client(stub)
+
+    with pytest.raises(UpstreamHTTPError) as info:
+        client.get_json('/coins/unknown')
+
+    assert info.value.status_code == 404
+    assert stub.hits('/coins/unknown') == 1
+    assert client.stats()['retries'] == 0
+
+
+def test_read_timeout_is_retried_then_raised(stub):
+    stub.script('/coins/bitcoin', ok({'id': 'bitcoin'}, delay=0.5))
+    client = make_client(stub, read_timeout=0.1, max_retries=1)
+
+    started = time.monotonic()
+    with pytest.raises(UpstreamError) as info:
+        client.get_json('/coins/bitcoin')
+
+    assert not isinstance(info.value, UpstreamHTTPError)
+    assert time.monotonic() - started < 0.5
+    assert stub.hits('/coins/bitcoin') == 2
+
+
+def test_connection_refused_raises_a_requests_exception():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = UpstreamClient(f'http://127.0.0.1:{port}', connect_timeout=0.5, max_retries=1, backoff=0.01)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        client.get_json('/ping')
+    assert client.stats()['requests'] == 2
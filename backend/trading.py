@@ -0,0 +1,314 @@
+from database import db, dialect_insert
+from models import User, Holdings, Order
+from money import usd, reserved_notional, commission, HALF_CENT, HALF_QUANTITY_UNIT
+import journal
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import DBAPIError
+from collections import defaultdict
+import random
+import time
+import os
+
+MAX_ATTEMPTS = int(os.environ.get('TRADE_MAX_ATTEMPTS', '5'))
+RETRY_BACKOFF = float(os.environ.get('TRADE_RETRY_BACKOFF', '0.01'))
+
+# serialization_failure, deadlock_detected
+RETRYABLE_SQLSTATES = {'40001', '40P01'}
+
+users = User.__table__
+holdings = Holdings.__table__
+orders = Order.__table__
+
+
+class TradeError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class InsufficientFunds(TradeError):
+    pass
+
+
+class InsufficientHoldings(TradeError):
+    pass
+
+
+class OrderUnavailable(TradeError):
+    pass
+
+
+def is_retryable(exc):
+    orig = getattr(exc, 'orig', None)
+    if getattr(orig, 'pgcode', None) in RETRYABLE_SQLSTATES:
+        return True
+    return 'database is locked' in str(orig)
+
+
+def run_in_transaction(work, attempts=None, on_retry=None):
+    """Run ``work()`` and commit, retrying on serialization failures and deadlocks.
+
+    ``work`` must only touch the database through the session so a rollback
+    fully undoes it. ``TradeError`` rolls back and propagates immediately.
+    """
+    attempts = attempts or MAX_ATTEMPTS
+    for attempt in range(attempts):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except TradeError:
+            db.session.rollback()
+            raise
+        except DBAPIError as exc:
+            db.session.rollback()
+            if not is_retryable(exc) or attempt == attempts - 1:
+                raise
+            if on_retry:
+                on_retry()
+            time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.random())
+
+
+def lock_users(user_ids):
+    """Lock user rows in ascending id order and return ``{id: available_usd}``.
+
+    Every multi-row write path locks users first, then holdings, then orders,
+    each in ascending id order, so concurrent trades cannot deadlock.
+    Available means the balance not reserved by active buy orders.
+    """
+    rows = db.session.execute(
+        select(users.c.id, (users.c.balance_usd - users.c.locked_usd).label('available'))
+        .where(users.c.id.in_(set(user_ids)))
+        .order_by(users.c.id)
+        .with_for_update()
+    ).all()
+    return {row.id: row.available for row in rows}
+
+
+def lock_holdings(crypto_id, user_ids):
+    """Lock holdings rows for one coin in ascending user order; returns ``{user_id: available}``."""
+    rows = db.session.execute(
+        select(holdings.c.user_id, (holdings.c.amount - holdings.c.locked_amount).label('available'))
+        .where(holdings.c.crypto_id == crypto_id, holdings.c.user_id.in_(set(user_ids)))
+        .order_by(holdings.c.user_id)
+        .with_for_update()
+    ).all()
+    return {row.user_id: row.available for row in rows}
+
+
+def lock_account(user_id, crypto_ids):
+    """Lock one user and their positions in ``crypto_ids``; returns ``(available_usd, {crypto_id: available})``."""
+    available_usd = lock_users([user_id]).get(user_id)
+    rows = db.session.execute(
+        select(holdings.c.crypto_id, (holdings.c.amount - holdings.c.locked_amount).label('available'))
+        .where(holdings.c.user_id == user_id, holdings.c.crypto_id.in_(set(crypto_ids)))
+        .order_by(holdings.c.crypto_id)
+        .with_for_update()
+    ).all()
+    return available_usd, {row.crypto_id: row.available for row in rows}
+
+
+def debit_usd(user_id, amount, release=0):
+    """Atomically subtract ``amount`` if the available balance covers it; returns the new balance.
+
+    ``release`` is the part of the user's reservation that pays for this debit
+    (a buy order being filled); it is unlocked in the same statement.
+    """
+    row = db.session.execute(
+        update(users)
+        .where(users.c.id == user_id, users.c.balance_usd - users.c.locked_usd + release >= amount - HALF_CENT)
+        .values(balance_usd=users.c.balance_usd - amount, locked_usd=users.c.locked_usd - release)
+        .returning(users.c.balance_usd)
+    ).first()
+    if row is None:
+        raise InsufficientFunds('Insufficient funds')
+    journal.record('debit', user_id, usd=-amount, locked_usd=-release)
+    return row.balance_usd
+
+
+def credit_usd(user_id, amount):
+    row = db.session.execute(
+        update(users)
+        .where(users.c.id == user_id)
+        .values(balance_usd=users.c.balance_usd + amount)
+        .returning(users.c.balance_usd)
+    ).first()
+    journal.record('credit', user_id, usd=amount)
+    return row.balance_usd
+
+
+def add_holding(user_id, crypto_id, amount, cost):
+    """Upsert-increment a position and its cost basis in one statement.
+
+    Relies on uq_holdings_user_crypto. ``cost`` is the USD paid including fees.
+    """
+    stmt = dialect_insert(holdings).values(user_id=user_id, crypto_id=crypto_id, amount=amount, cost_basis=cost)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[holdings.c.user_id, holdings.c.crypto_id],
+        set_={
+            'amount': holdings.c.amount + stmt.excluded.amount,
+            'cost_basis': holdings.c.cost_basis + stmt.excluded.cost_basis
+        }
+    )
+    db.session.execute(stmt)
+    journal.record('add_holding', user_id, crypto_id=crypto_id, amount=amount, cost=cost)
+
+
+def remove_holding(user_id, crypto_id, amount, proceeds, release=0):
+    """Subtract ``amount`` from a locked position, deleting it once empty.
+
+    Only the unreserved part of the position can be sold, plus ``release``:
+    the coins a sell order being filled had reserved.
+
+    Amounts are exact decimals, so selling the whole position leaves exactly
+    zero and the row is removed. The released cost is the position's average
+    cost times ``amount`` (all of it on a full sale); ``proceeds`` minus that
+    is booked to the user's realized P&L. The user row must already be locked
+    (or updated) by this transaction. Returns the realized P&L of the sale.
+    """
+    row = db.session.execute(
+        select(holdings.c.id, holdings.c.amount, holdings.c.locked_amount, holdings.c.cost_basis)
+        .where(holdings.c.user_id == user_id, holdings.c.crypto_id == crypto_id)
+        .with_for_update()
+    ).first()
+    if row is None or row.amount - row.locked_amount + release < amount:
+        raise InsufficientHoldings('Not enough cryptocurrency to sell')
+
+    if row.amount == amount:
+        released = row.cost_basis
+        db.session.execute(delete(holdings).where(holdings.c.id == row.id))
+    else:
+        released = usd(row.cost_basis * amount / row.amount)
+        db.session.execute(
+            update(holdings)
+            .where(holdings.c.id == row.id)
+            .values(amount=holdings.c.amount - amount, cost_basis=holdings.c.cost_basis - released,
+                    locked_amount=holdings.c.locked_amount - release)
+        )
+
+    pnl = proceeds - released
+    db.session.execute(
+        update(users).where(users.c.id == user_id).values(realized_pnl=users.c.realized_pnl + pnl)
+    )
+    journal.record('remove_holding', user_id, crypto_id=crypto_id, amount=-amount, locked_amount=-release,
+                   cost=-released, pnl=pnl)
+    return pnl
+
+
+def fill_order(order_id, quantity):
+    """Claim ``quantity`` of an active order; deactivates it when fully filled.
+
+    The WHERE clause makes a second claim on an exhausted order match no rows,
+    so an order can never be executed twice.
+    """
+    remaining = orders.c.quantity - orders.c.filled_quantity
+    row = db.session.execute(
+        update(orders)
+        .where(orders.c.id == order_id, orders.c.is_active.is_(True), remaining >= quantity - HALF_QUANTITY_UNIT)
+        .values(
+            filled_quantity=orders.c.filled_quantity + quantity,
+            is_active=remaining - quantity > HALF_QUANTITY_UNIT
+        )
+        .returning(orders.c.user_id, orders.c.filled_quantity, orders.c.is_active)
+    ).first()
+    if row is None:
+        raise OrderUnavailable('Order not found or already executed', 404)
+    journal.record('order_filled', row.user_id, order_id=order_id, quantity=quantity)
+    if not row.is_active:
+        journal.record('order_closed', row.user_id, order_id=order_id)
+    return row
+
+
+def reservation(order_type, remaining, price, kind='limit'):
+    """What an active order holds back: its USD notional, rounded up, for a buy; its coins for a sell.
+
+    Stop and take-profit buys execute at spot and pay commission on top, so
+    they also hold back the commission at their trigger price.
+    """
+    if order_type != 'buy':
+        return remaining
+    amount = reserved_notional(remaining, price)
+    return amount if kind == 'limit' else amount + commission(amount)
+
+
+def reserve_order(user_id, crypto_id, order_type, quantity, price, kind='limit'):
+    """Reserve what a new order needs, failing unless the available balance or position covers it."""
+    amount = reservation(order_type, quantity, price, kind)
+    if order_type == 'buy':
+        row = db.session.execute(
+            update(users)
+            .where(users.c.id == user_id, users.c.balance_usd - users.c.locked_usd >= amount - HALF_CENT)
+            .values(locked_usd=users.c.locked_usd + amount)
+            .returning(users.c.id)
+        ).first()
+        if row is None:
+            raise InsufficientFunds('Insufficient funds to place buy order')
+        journal.record('lock', user_id, locked_usd=amount)
+    else:
+        row = db.session.execute(
+            update(holdings)
+            .where(holdings.c.user_id == user_id, holdings.c.crypto_id == crypto_id,
+                   holdings.c.amount - holdings.c.locked_amount >= amount - HALF_QUANTITY_UNIT)
+            .values(locked_amount=holdings.c.locked_amount + amount)
+            .returning(holdings.c.id)
+        ).first()
+        if row is None:
+            raise InsufficientHoldings('Insufficient funds to place sell order')
+        journal.record('lock', user_id, crypto_id=crypto_id, locked_amount=amount)
+
+
+def shift_locked(user_id, usd_amount=0, amounts=None):
+    """Add to a user's reserved USD and per-coin reserved amounts (negative to release)."""
+    if usd_amount:
+        db.session.execute(
+            update(users).where(users.c.id == user_id).values(locked_usd=users.c.locked_usd + usd_amount)
+        )
+        journal.record('lock', user_id, locked_usd=usd_amount)
+    for crypto_id, amount in sorted((amounts or {}).items()):
+        if amount:
+            db.session.execute(
+                update(holdings)
+                .where(holdings.c.user_id == user_id, holdings.c.crypto_id == crypto_id)
+                .values(locked_amount=holdings.c.locked_amount + amount)
+            )
+            journal.record('lock', user_id, crypto_id=crypto_id, locked_amount=amount)
+
+
+def deactivate_orders(order_ids, user_id=None):
+    """Deactivate the active orders among ``order_ids`` and release what they reserved.
+
+    With ``user_id`` only that user's orders are touched. Callers hold the
+    order book lock of every coin involved. Returns ``{order_id: (crypto_id,
+    order_type, released)}`` for the orders actually deactivated.
+    """
+    conditions = [orders.c.id.in_(set(order_ids)), orders.c.is_active.is_(True)]
+    if user_id is not None:
+        conditions.append(orders.c.user_id == user_id)
+    rows = db.session.execute(
+        update(orders)
+        .where(*conditions)
+        .values(is_active=False)
+        .returning(orders.c.id, orders.c.user_id, orders.c.crypto_id, orders.c.order_type,
+                   orders.c.quantity, orders.c.filled_quantity, orders.c.price, orders.c.kind)
+    ).all()
+
+    released = {}
+    released_usd = defaultdict(int)
+    released_amounts = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        journal.record('order_closed', row.user_id, crypto_id=row.crypto_id, order_id=row.id)
+        amount = reservation(row.order_type, row.quantity - row.filled_quantity, row.price, row.kind)
+        released[row.id] = (row.crypto_id, row.order_type, amount)
+        if row.order_type == 'buy':
+            released_usd[row.user_id] += amount
+        else:
+            released_amounts[row.user_id][row.crypto_id] += amount
+    for owner in sorted(set(released_usd) | set(released_amounts)):
+        shift_locked(owner, -released_usd.get(owner, 0),
+                     {crypto_id: -amount for crypto_id, amount in released_amounts.get(owner, {}).items()})
+    return released
+
+
+def deactivate_order(order_id):
+    return order_id in deactivate_orders([order_id])
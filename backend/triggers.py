@@ -0,0 +1,157 @@
+"""Pending stop and take-profit orders, indexed by trigger price per coin.
+
+A ``stop`` sell and a ``take_profit`` buy fire when the price falls to their
+trigger; a ``take_profit`` sell and a ``stop`` buy fire when it rises to it.
+Each coin keeps the two groups in sorted arrays arranged so that the orders a
+price move crosses are always a tail of the array: one bisect finds it and
+the tail is cut off, O(log n + k) for k fired orders, however many are
+waiting.
+
+Fired orders are queued and executed one at a time on a background thread
+by the callable given to ``start``, which runs them through the normal trade
+path. The database decides whether an order still runs, so a cancel racing
+a fire, or several workers firing the same order, is harmless.
+"""
+from database import db
+from money import PRICE_DECIMALS, price as to_price, to_units
+import bisect
+import logging
+import queue
+import threading
+
+LIMIT = 'limit'
+STOP = 'stop'
+TAKE_PROFIT = 'take_profit'
+ORDER_KINDS = (LIMIT, STOP, TAKE_PROFIT)
+
+logger = logging.getLogger(__name__)
+
+
+def fires_on_fall(side, kind):
+    """Whether an order triggers when the price drops to its trigger (otherwise when it rises)."""
+    return (side == 'sell') == (kind == STOP)
+
+
+def is_crossed(side, kind, trigger_units, price_units):
+    if fires_on_fall(side, kind):
+        return price_units <= trigger_units
+    return price_units >= trigger_units
+
+
+class _CoinTriggers:
+    """``falling`` holds ``(trigger, id)`` ascending; ``rising`` holds ``(-trigger, id)`` ascending."""
+
+    __slots__ = ('falling', 'rising')
+
+    def __init__(self):
+        self.falling = []
+        self.rising = []
+
+    def crossed(self, price_units):
+        fired = []
+        for entries, bound in ((self.falling, price_units), (self.rising, -price_units)):
+            # Entries keyed at or above ``bound`` are crossed; ids are positive, so -1 sorts first.
+            start = bisect.bisect_left(entries, (bound, -1))
+            if start < len(entries):
+                fired.extend(order_id for _, order_id in entries[start:])
+                del entries[start:]
+        return fired
+
+    def __len__(self):
+        return len(self.falling) + len(self.rising)
+
+
+class TriggerEngine:
+    def __init__(self):
+        self._coins = {}
+        self._index = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self.fired = 0
+        self.failed = 0
+
+    def add(self, order_id, coingecko_id, side, kind, trigger_units):
+        with self._lock:
+            coin = self._coins.setdefault(coingecko_id, _CoinTriggers())
+            if fires_on_fall(side, kind):
+                entries, entry = coin.falling, (trigger_units, order_id)
+            else:
+                entries, entry = coin.rising, (-trigger_units, order_id)
+            bisect.insort(entries, entry)
+            self._index[order_id] = (entries, entry)
+
+    def remove(self, order_id):
+        with self._lock:
+            found = self._index.pop(order_id, None)
+            if found is None:
+                return False
+            entries, entry = found
+            index = bisect.bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+            return True
+
+    def crossed(self, coingecko_id, price_units):
+        """Remove and return the ids of orders on ``coingecko_id`` that ``price_units`` triggers."""
+        with self._lock:
+            coin = self._coins.get(coingecko_id)
+            if coin is None:
+                return []
+            fired = coin.crossed(price_units)
+            for order_id in fired:
+                del self._index[order_id]
+            return fired
+
+    def rebuild(self, rows):
+        """Load pending orders from ``(id, coingecko_id, side, kind, trigger_price)`` rows."""
+        with self._lock:
+            self._coins = {}
+            self._index = {}
+        count = 0
+        for order_id, coingecko_id, side, kind, trigger_price in rows:
+            self.add(order_id, coingecko_id, side, kind, to_units(trigger_price, PRICE_DECIMALS))
+            count += 1
+        return count
+
+    def on_prices(self, prices):
+        """Price listener: queue every order the new ``{coingecko_id: price}`` values cross."""
+        for coingecko_id, price in prices.items():
+            if price is None or coingecko_id not in self._coins:
+                continue
+            for order_id in self.crossed(coingecko_id, to_units(to_price(price), PRICE_DECIMALS)):
+                self._queue.put((order_id, price))
+
+    def start(self, app, execute):
+        """Execute fired orders with ``execute(order_id, price)`` inside ``app``'s context."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app, execute), name='trigger-executor', daemon=True)
+        self._thread.start()
+
+    def _run(self, app, execute):
+        while True:
+            order_id, price = self._queue.get()
+            with app.app_context():
+                try:
+                    execute(order_id, price)
+                    self.fired += 1
+                except Exception:
+                    self.failed += 1
+                    db.session.rollback()
+                    logger.exception('Executing triggered order %s failed', order_id)
+                finally:
+                    db.session.remove()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._index),
+                'coins': sum(1 for coin in self._coins.values() if len(coin)),
+                'queued': self._queue.qsize(),
+                'fired': self.fired,
+                'failed': self.failed
+            }
+
+
+trigger_engine = TriggerEngine()
@@ -0,0 +1,235 @@
+from requests.adapters import HTTPAdapter
+from metrics import observe_upstream
+from market_store import FrameFile
+import requests
+import threading
+import bisect
+import random
+import time
+import os
+
+COINGECKO_API_URL = os.environ.get('COINGECKO_API_URL', 'https://api.coingecko.com/api/v3')
+UPSTREAM_REPLAY_PATH = os.environ.get('UPSTREAM_REPLAY_PATH', '')
+
+
+class UpstreamError(requests.exceptions.RequestException):
+    """Raised for upstream failures; subclasses RequestException so existing handlers keep working."""
+
+
+class UpstreamHTTPError(UpstreamError):
+    def __init__(self, status_code, message=None):
+        super().__init__(message or f'Upstream responded with HTTP {status_code}')
+        self.status_code = status_code
+
+
+class _InFlight:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP client with retries and single-flight coalescing.
+
+    Concurrent ``get_json`` calls for the same path and params share one
+    request: the first caller fetches, the rest wait for its result. Results
+    are shared between callers and must be treated as read-only.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url=COINGECKO_API_URL, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None, max_retry_after=None, pool_size=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '3')),
+            read_timeout if read_timeout is not None else float(os.environ.get('UPSTREAM_READ_TIMEOUT', '10'))
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('UPSTREAM_MAX_RETRIES', '2'))
+        self.backoff = backoff if backoff is not None else float(os.environ.get('UPSTREAM_BACKOFF', '0.5'))
+        self.max_retry_after = max_retry_after if max_retry_after is not None else float(os.environ.get('UPSTREAM_MAX_RETRY_AFTER', '10'))
+        pool_size = pool_size or int(os.environ.get('UPSTREAM_POOL_SIZE', '20'))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept'] = 'application/json'
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.errors = 0
+
+    def get_json(self, path, params=None):
+        params = dict(params or {})
+        key = (path, tuple(sorted((k, str(v)) for k, v in params.items())))
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._fetch(path, params)
+            return call.result
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def _fetch(self, path, params):
+        url = f'{self.base_url}/{path.lstrip("/")}'
+        attempt = 0
+        while True:
+            self.requests += 1
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                observe_upstream(path, 'error', time.perf_counter() - started)
+                if attempt >= self.max_retries:
+                    self.errors += 1
+                    raise UpstreamError(str(exc)) from exc
+                self._sleep_before_retry(attempt, None)
+                attempt += 1
+                continue
+            observe_upstream(path, response.status_code, time.perf_counter() - started)
+
+            if response.status_code in self.RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._retry_after(response)
+                if delay is None or delay <= self.max_retry_after:
+                    self._sleep_before_retry(attempt, delay)
+                    attempt += 1
+                    continue
+
+            if response.status_code >= 400:
+                self.errors += 1
+                raise UpstreamHTTPError(response.status_code)
+            return response.json()
+
+    def _retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    def _sleep_before_retry(self, attempt, delay):
+        self.retries += 1
+        if delay is None:
+            delay = self.backoff * (2 ** attempt) * (0.5 + random.random() / 2)
+        time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._inflight)
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'errors': self.errors,
+            'in_flight': in_flight
+        }
+
+
+class ReplayClient:
+    """Answers the calls ``UpstreamClient`` would make from a recording, without the network.
+
+    Frames play back at the pace they were recorded, sped up by
+    ``UPSTREAM_REPLAY_SPEED``, and start over after the last one.
+    ``/coins/markets``, ``/simple/price`` and ``/coins/<id>`` are served from
+    the current frame; anything else is a 404.
+    """
+
+    def __init__(self, path, speed=None):
+        self.frames = FrameFile(path)
+        self.speed = speed if speed is not None else float(os.environ.get('UPSTREAM_REPLAY_SPEED', '1'))
+        times = self.frames.times
+        self._offsets = [t - times[0] for t in times]
+        # One more average gap after the last frame before the first one comes round again.
+        self._period = self._offsets[-1] * len(times) / (len(times) - 1) if len(times) > 1 else 0.0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._index = None
+        self._coins = []
+        self._by_id = {}
+        self.requests = 0
+        self.loops = 0
+
+    def _current(self):
+        elapsed = (time.monotonic() - self._started) * self.speed
+        position = elapsed % self._period if self._period else 0.0
+        index = bisect.bisect_right(self._offsets, position) - 1
+        with self._lock:
+            self.requests += 1
+            if index != self._index:
+                if self._index is not None and index < self._index:
+                    self.loops += 1
+                self._index = index
+                self._coins = self.frames.frame(index).coins
+                self._by_id = {coin.get('id'): coin for coin in self._coins}
+            return self._coins, self._by_id
+
+    def get_json(self, path, params=None):
+        params = params or {}
+        coins, by_id = self._current()
+        parts = path.strip('/').split('/')
+        if parts == ['coins', 'markets']:
+            per_page = int(params.get('per_page', 100))
+            start = (int(params.get('page', 1)) - 1) * per_page
+            return coins[start:start + per_page]
+        if parts == ['simple', 'price']:
+            ids = str(params.get('ids', '')).split(',')
+            return {coin_id: {'usd': by_id[coin_id].get('current_price')} for coin_id in ids if coin_id in by_id}
+        if len(parts) == 2 and parts[0] == 'coins' and parts[1] in by_id:
+            coin = by_id[parts[1]]
+            return {
+                'id': coin['id'],
+                'symbol': coin.get('symbol'),
+                'name': coin.get('name'),
+                'image': {'large': coin.get('image')},
+                'description': {'en': ''},
+                'market_data': {
+                    'current_price': {'usd': coin.get('current_price')},
+                    'market_cap': {'usd': coin.get('market_cap')},
+                    'total_volume': {'usd': coin.get('total_volume')},
+                    'price_change_percentage_24h': coin.get('price_change_percentage_24h')
+                }
+            }
+        raise UpstreamHTTPError(404)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replay': self.frames.path,
+                'frames': len(self.frames),
+                'frame': self._index,
+                'loops': self.loops,
+                'requests': self.requests
+            }
+
+
+coingecko = ReplayClient(UPSTREAM_REPLAY_PATH) if UPSTREAM_REPLAY_PATH else UpstreamClient()
@@ -0,0 +1,4 @@
+#!/bin/sh
+# Runs once when the primary's data directory is initialised: let replicas stream WAL.
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
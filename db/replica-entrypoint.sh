@@ -0,0 +1,14 @@
+#!/bin/sh
+# Clone the primary on first start, then run as a hot standby that follows it.
+set -e
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    mkdir -p "$PGDATA"
+    chown postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    until su-exec postgres pg_basebackup -h db -U postgres -D "$PGDATA" -R -X stream; do
+        echo "waiting for primary"
+        rm -rf "${PGDATA:?}"/*
+        sleep 2
+    done
+fi
+exec su-exec postgres postgres -c hot_standby=on
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import api from '../services/api';
+import { openStream } from '../services/stream';
 
 function Dashboard() {
   const [cryptocurrencies, setCryptocurrencies] = useState([]);
@@ -9,8 +10,15 @@ function Dashboard() {
 
   useEffect(() => {
     fetchCryptocurrencies();
-    const interval = setInterval(fetchCryptocurrencies, 60000); // Update every minute
-    return () => clearInterval(interval);
+    // Live prices are pushed by the server; a resync means updates were dropped.
+    return openStream(['prices'], {
+      prices: ({ data }) => setCryptocurrencies((current) =>
+        current.map((coin) =>
+          data[coin.id] !== undefined ? { ...coin, current_price: data[coin.id] } : coin
+        )
+      ),
+      resync: () => fetchCryptocurrencies(),
+    });
   }, []);
 
   const fetchCryptocurrencies = async () => {
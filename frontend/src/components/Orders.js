@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { getOrders, executeOrder } from '../services/api';
+import { openStream } from '../services/stream';
 
 const Orders = () => {
     const [orders, setOrders] = useState([]);
@@ -25,6 +26,7 @@ const Orders = () => {
         fetchOrders();
         const user = JSON.parse(localStorage.getItem('user'));
         setCurrentUser(user);
+        return openStream(['fills'], { fill: fetchOrders, resync: fetchOrders });
     }, []);
 
     const handleExecuteOrder = async (orderId) => {
@@ -1,6 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import api from '../services/api';
+import { openStream } from '../services/stream';
 
 function Portfolio() {
   const [portfolio, setPortfolio] = useState(null);
@@ -18,6 +19,12 @@ function Portfolio() {
     
     fetchPortfolio();
     fetchTransactions();
+
+    const refresh = () => {
+      fetchPortfolio();
+      fetchTransactions();
+    };
+    return openStream(['fills'], { fill: refresh, resync: refresh });
   }, [navigate]);
 
   const fetchPortfolio = async () => {
@@ -51,6 +58,9 @@ function Portfolio() {
         <div className="summary-card">
           <h3>USD Balance</h3>
           <p className="amount">${portfolio.balance_usd?.toFixed(2)}</p>
+          {portfolio.locked_usd > 0 && (
+            <p className="locked">${portfolio.locked_usd.toFixed(2)} reserved by open orders</p>
+          )}
         </div>
         <div className="summary-card">
           <h3>Cryptocurrency Value</h3>
@@ -0,0 +1,61 @@
+import api from './api';
+
+const RECONNECT_DELAY_MS = 3000;
+
+// Server-Sent Events client for /api/stream.
+// handlers maps event names ('prices', 'book', 'reset', 'fill', 'resync') to callbacks
+// receiving ({ topic, data }). Returns a function that closes the stream.
+//
+// EventSource cannot send an Authorization header, so the private 'fills' topic is
+// opened with a single-use ticket from POST /api/stream/ticket. The browser's own
+// reconnect reuses the URL and its spent ticket, so once it gives up the stream is
+// opened again with a new one.
+export const openStream = (topics, handlers) => {
+  let source = null;
+  let timer = null;
+  let closed = false;
+
+  const reconnect = () => {
+    if (!closed) {
+      timer = setTimeout(connect, RECONNECT_DELAY_MS);
+    }
+  };
+
+  const connect = async () => {
+    const params = new URLSearchParams({ topics: topics.join(',') });
+    if (topics.includes('fills')) {
+      try {
+        const response = await api.post('/stream/ticket');
+        params.set('ticket', response.data.ticket);
+      } catch (error) {
+        // Signed out: there is nothing to stream until the user logs in again.
+        if (error.response?.status !== 401) {
+          reconnect();
+        }
+        return;
+      }
+    }
+    if (closed) {
+      return;
+    }
+
+    source = new EventSource(`/api/stream?${params.toString()}`);
+    Object.entries(handlers).forEach(([event, handler]) => {
+      source.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+    });
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        reconnect();
+      }
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(timer);
+    if (source) {
+      source.close();
+    }
+  };
+};